@@ -1,5 +1,6 @@
 import datetime
 import os
+import tempfile
 
 from django.conf.global_settings import STATICFILES_DIRS, STATICFILES_STORAGE
 
@@ -26,12 +27,15 @@ INSTALLED_APPS = [
     'django.contrib.contenttypes',
     'django.contrib.sessions',
     'django.contrib.messages',
-    'django.contrib.staticfiles'
+    'django.contrib.staticfiles',
+    'django.contrib.postgres',
 ]
 
 MIDDLEWARE = [
+    'toolbox_app.metrics.MetricsMiddleware', # first, to time everything below
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware', 
+    'toolbox_app.media.MediaFilesMiddleware', # uploads, see toolbox_app.media
     'corsheaders.middleware.CorsMiddleware',
     #'django_referrer_policy.middleware.ReferrerPolicyMiddleware',   # ! UN-COMMENT THIS LINE IN PRODUCTION
     #'csp.middleware.CSPMiddleware',                                 # ! UN-COMMENT THIS LINE IN PRODUCTION
@@ -73,21 +77,53 @@ REST_FRAMEWORK = {
         'rest_framework.authentication.SessionAuthentication',
         'rest_framework.authentication.BasicAuthentication',
     ),
+    'DEFAULT_RENDERER_CLASSES': (
+        'toolbox_app.renderers.ORJSONRenderer', # JSONRenderer output, encoded by orjson
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
+    'DEFAULT_PARSER_CLASSES': (
+        'toolbox_app.renderers.ORJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ),
     'TEST_REQUEST_DEFAULT_FORMAT': 'json',
+    'DEFAULT_PAGINATION_CLASS': 'toolbox_app.pagination.KeysetPagination',
+    'PAGE_SIZE': 100, # default page size of paginated lists, clients may ask for up to 1000 with ?page_size=
 }
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql_psycopg2',
+        'ENGINE': 'toolbox_app.dbpool', # postgresql, connections reused through a pool per worker process
         'NAME': 'toolbox_db',
         'USER': 'admin',
         'PASSWORD': 'devweb2',
         #'HOST': '109.128.245.26',
         'HOST': '51.178.40.108',
         'PORT': '5432',
+        'CONN_MAX_AGE': 0, # the connection goes back to the pool at the end of each request
+        'POOL': {
+            # a gthread worker holds at most one connection per thread (see Heroku/Procfile), so this
+            # only sizes the pool: the connections of all the workers and dynos are bounded by pgbouncer
+            # or the max_connections of the server, not here
+            'MAX_SIZE': int(os.environ.get('GUNICORN_THREADS', 4)),
+            'WAIT_TIMEOUT': 10, # seconds a request waits for a connection before failing
+            'IDLE_TIMEOUT': 300, # seconds an unused connection stays open
+            'HEALTH_CHECK_INTERVAL': 30, # connections unused for longer are checked before reuse
+        },
     }
 }
 
+# File based so that invalidations (see toolbox_app.responseCache, toolbox_app.signals)
+# reach every gunicorn worker of the dyno
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(tempfile.gettempdir(), 'toolbox_cache'),
+    }
+}
+RESPONSE_CACHE_TTL = 3600 # seconds a cached reference response (countries, towns, public groups) is kept
+STREAM_CHUNK_SIZE = 2000 # rows read per round trip by the streamed lists (?stream=1, toolbox_app.streaming)
+
 
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -127,10 +163,25 @@ JWT_AUTH = {
     'JWT_EXPIRATION_DELTA': datetime.timedelta(seconds=3600),
     'JWT_ALLOW_REFRESH': True,
 }
+JWT_PRINCIPAL_CACHE_TTL = 60 # seconds the id and email of a token's person are cached (toolbox_app.customJWTAuth)
+
+# bcrypt runs in PASSWORD_POOL_WORKERS processes per gunicorn worker, at most PASSWORD_POOL_QUEUE
+# more calls may wait before sign-ups / logins are answered with a 503 (toolbox_app.passwords)
+PASSWORD_HASH_ROUNDS = 12
+PASSWORD_POOL_WORKERS = 2
+PASSWORD_POOL_QUEUE = 8
+PASSWORD_POOL_TIMEOUT = 10 # seconds
+
+# per endpoint request metrics, exposed at /metrics/ (toolbox_app.metrics)
+METRICS_FLUSH_INTERVAL = 10 # seconds between two publications of a worker's metrics
+METRICS_SERVER_TIMING = os.environ.get('METRICS_SERVER_TIMING') == '1' # add a Server-Timing header to the responses
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN') # /metrics/ requires "Authorization: Bearer <token>", unset it is denied (open in DEBUG)
 
 STATIC_URL = '/static/'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media/')
+DEFAULT_FILE_STORAGE = 'toolbox_app.media.HashedFileSystemStorage' # content hashed names, cached forever
+MEDIA_MAX_AGE = 3600 # seconds the media uploaded before names were hashed are cached
 
 ########################################################
 #! PRODUCTION SETTINGS 
@@ -1,17 +1,24 @@
 import json
-from math import atan2, cos, radians, sin, sqrt
+from functools import partial
+from math import cos
 from os.path import defpath
 
-import bcrypt
-from django.db import IntegrityError
-from django.db.models import CharField, Value
+from django.db import IntegrityError, transaction
+from django.contrib.postgres.search import SearchQuery, SearchRank, TrigramSimilarity
+from django.db.models import CharField, F, FloatField, Max, Q, Subquery, Value
 from django.http import QueryDict
+from django.shortcuts import get_object_or_404
 from rest_framework import permissions, status, viewsets
 from rest_framework.decorators import action, permission_classes
 from rest_framework.response import Response
 from rest_framework_jwt.settings import api_settings
 from rest_framework_jwt.utils import jwt_decode_handler
 from .customIsAuth import AllowAny, IsAuthenticated, IsAdminUser
+from .geo import EARTH_RADIUS_KM, cellsAround, distanceExpr, dotExpr, minDotExpr
+from .metrics import timedSerialization
+from .passwords import checkPassword, hashPassword
+from .responseCache import cachedResponse, invalidateResponses
+from .streaming import streamedListResponse
 
 from .models import *
 from .serializers import *
@@ -26,10 +33,166 @@ class PermissionsPerMethodMixin(object):
             return [permission_class() for permission_class in view.permission_classes]
         return super().get_permissions()
 
+class EagerLoadingViewMixin(object):
+    """
+    The GET endpoints honour the `fields` and `expand` query params: the response only
+    carries the fields listed in `fields` and the nested relations listed in `expand`
+    (comma separated, dotted for nested ones, see serializers.sparseFields), and only
+    those columns and relations are loaded.
+
+    GET 127.0.0.1:8000/api/tools/1/?fields=id_tool,toolName,toolOwner.alias&expand=toolOwner
+    """
+    def serialize(self, serializer_class, queryset):
+        """
+        Serializes a list of rows, loading the related rows the serializer
+        declares (see serializers.EagerLoadingMixin) in a fixed number of queries
+        """
+        serializer = self.sparse_serializer(serializer_class, many=True)
+        serializer.instance = self.eager_load(serializer_class, queryset, serializer)
+        return serializer
+
+    def flag_param(self, name):
+        """" whether the query param `name` is on: ?name=1 / true / yes / on (?name=0 / false is off) """
+        return self.request.query_params.get(name, '').lower() in ('1', 'true', 'yes', 'on')
+
+    def serialized(self, serializer):
+        """" `serializer.data`, the time it takes recorded in the request metrics (see metrics.timedSerialization) """
+        with timedSerialization():
+            return serializer.data
+
+    def sparse_serializer(self, serializer_class, *args, **kwargs):
+        """" `serializer_class(*args, **kwargs)` without the fields and relations the request leaves out """
+        serializer = serializer_class(*args, **kwargs)
+        fields = fieldsTree(self.request.query_params.get('fields'))
+        expand = fieldsTree(self.request.query_params.get('expand'))
+        serializer.sparse = fields is not None or expand is not None
+        if serializer.sparse:
+            sparseFields(serializer, fields, expand)
+        return serializer
+
+    def eager_load(self, serializer_class, queryset, serializer=None):
+        """" `serializer`, from sparse_serializer(), limits the loading to what it still reads """
+        sparse = getattr(serializer, 'sparse', False)
+        if hasattr(serializer_class, 'setup_eager_loading'):
+            narrow = sparse or serializer_class.only_read_columns
+            return serializer_class.setup_eager_loading(queryset, serializer if narrow else None)
+        return onlyReadColumns(queryset, serializer) if sparse else queryset
+
+    def list_response(self, serializer_class, queryset):
+        """
+        Response listing `queryset`, one page at a time when the client asks for
+        pages (see pagination.KeysetPagination), streamed when it asks for `stream`
+        (see streaming.streamedListResponse). The rows of the serializers that only
+        read columns are serialized from values() (see serializers.valuesPlan)
+
+        GET 127.0.0.1:8000/api/tools/?stream=1
+        """
+        serializer = self.sparse_serializer(serializer_class, many=True)
+        queryset = self.eager_load(serializer_class, queryset, serializer)
+        plan = valuesPlan(serializer, queryset.model) if not queryset._prefetch_related_lookups else None
+        if plan is not None:
+            # read-only fast path: output dicts built straight from values() rows
+            ordering = [name.lstrip('-') for name in queryset.query.order_by if isinstance(name, str)]
+            queryset = queryset.values(*dict.fromkeys(valuesPaths(plan) + ordering))
+        if self.flag_param('stream') and self.request.accepted_renderer.format == 'json':
+            # the browsable API (text/html) renders the whole list
+            represent = partial(valuesRow, plan) if plan is not None else serializer.child.to_representation
+            return streamedListResponse(queryset, represent, self.request.accepted_renderer)
+        page = self.paginate_queryset(queryset)
+        rows = queryset if page is None else page
+        if plan is not None:
+            with timedSerialization():
+                data = [valuesRow(plan, row) for row in rows]
+        else:
+            serializer.instance = rows
+            data = self.serialized(serializer)
+        if page is None:
+            return Response(data)
+        return self.get_paginated_response(data)
+
+class BulkRowsViewMixin(object):
+    """
+    Batch variants of the one row POST / DELETE actions: the rows are validated together
+    (one query per referenced table), written with a single statement in one transaction,
+    and the response reports the outcome of every item, in the order they were sent
+    """
+    def bulk_create_response(self, request, serializer_class):
+        """
+        Response to the POST of a list of rows, `serializer_class` declares the model
+        and the foreign keys to check (see serializers.groupsMembersBulkSerializer)
+        """
+        rows = request.data
+        if not isinstance(rows, list) or not rows:
+            return Response({'error': "a non empty list of rows is expected"}, status=status.HTTP_400_BAD_REQUEST)
+        model = serializer_class.model
+        uniqueFields = model._meta.unique_together[0]
+
+        results = [None] * len(rows)
+        valid = {}
+        for index, row in enumerate(rows):
+            serializer = serializer_class(data=row)
+            if serializer.is_valid():
+                valid[index] = serializer
+            else:
+                results[index] = {'status': status.HTTP_400_BAD_REQUEST, 'error': serializer.errors}
+
+        # one query per referenced table, one for the rows already there
+        missing = {}
+        for field, related in serializer_class.foreign_keys.items():
+            wanted = set(serializer.validated_data[field] for serializer in valid.values())
+            missing[field] = wanted - set(related.objects.filter(pk__in=wanted).values_list('pk', flat=True))
+        existing = set(model.objects
+            .filter(**{field + '__in': set(serializer.validated_data[field] for serializer in valid.values()) for field in uniqueFields})
+            .values_list(*uniqueFields))
+
+        created = []
+        for index, serializer in valid.items():
+            data = serializer.validated_data
+            key = tuple(data[field] for field in uniqueFields)
+            missingFields = [field for field in serializer_class.foreign_keys if data[field] in missing[field]]
+            if missingFields:
+                error = "; ".join("%s: %s does not exist" % (field, data[field]) for field in missingFields)
+                results[index] = {'status': status.HTTP_404_NOT_FOUND, 'error': error}
+            elif key in existing:
+                error = "%s already exists" % ", ".join("%s: %s" % (field, data[field]) for field in uniqueFields)
+                results[index] = {'status': status.HTTP_409_CONFLICT, 'error': error}
+            else:
+                existing.add(key)
+                created.append(model(**{model._meta.get_field(field).attname: value for field, value in data.items()}))
+                results[index] = {'status': status.HTTP_201_CREATED, 'data': serializer.data}
+
+        try:
+            with transaction.atomic():
+                model.objects.bulk_create(created)
+        except IntegrityError:
+            # written concurrently since the checks above
+            return Response({'error': "some rows already exist, nothing was created"}, status=status.HTTP_409_CONFLICT)
+        allCreated = len(created) == len(rows)
+        return Response(results, status=status.HTTP_201_CREATED if allCreated else status.HTTP_207_MULTI_STATUS)
+
+    def bulk_delete_response(self, request, serializer_class, queryset, field):
+        """ Response to the DELETE of the rows of `queryset` whose `field` is in the list sent """
+        serializer = serializer_class(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = serializer.validated_data[field]
+
+        with transaction.atomic():
+            found = set(queryset.select_for_update().filter(**{field + '__in': ids}).values_list(field, flat=True))
+            queryset.filter(**{field + '__in': found}).delete()
+
+        results = []
+        for id in ids:
+            if id in found:
+                results.append({'status': status.HTTP_204_NO_CONTENT, field: id})
+            else:
+                results.append({'status': status.HTTP_404_NOT_FOUND, field: id, 'error': "%s: %s does not exist" % (field, id)})
+        allDeleted = len(found) == len(set(ids))
+        return Response(results, status=status.HTTP_200_OK if allDeleted else status.HTTP_207_MULTI_STATUS)
+
 #######################
 ###   PERSONS API   ###
 
-class personsViewSet(PermissionsPerMethodMixin, viewsets.GenericViewSet):
+class personsViewSet(PermissionsPerMethodMixin, EagerLoadingViewMixin, viewsets.GenericViewSet):
 
     @permission_classes([AllowAny])
     def create_token(self,user):
@@ -45,25 +208,23 @@ class personsViewSet(PermissionsPerMethodMixin, viewsets.GenericViewSet):
     @permission_classes([IsAdminUser])
     def list(self, request, *args, **kwargs):
         """" list all users """
-        queryset = Persons.objects.all().order_by('lastName')
-        serializer = personsSerializer(queryset, many=True)
-        return Response(serializer.data)
+        queryset = Persons.objects.all().order_by('lastName','id_person')
+        return self.list_response(personsSerializer, queryset)
     
     # GET 127.0.0.1:8000/api/persons/1
     @permission_classes([IsAuthenticated])
     def retrieve(self, request,pk=None, *args, **kwargs):
         """" get a user profile by it's id """
         queryset = Persons.objects.filter(id_person=pk)
-        serializer = personsSerializer(queryset, many=True)
-        return Response(serializer.data)
+        serializer = self.serialize(personsSerializer, queryset)
+        return Response(self.serialized(serializer))
 
     # POST 127.0.0.1:8000/api/persons/
     @permission_classes([AllowAny])
     def create(self, request, *args, **kwargs):
         """" create a new user """
         data = request.data.copy()
-        data['password']= bcrypt.hashpw(data['password'].encode('utf8'), bcrypt.gensalt())
-        data['password'] = data['password'].decode('utf8')
+        data['password'] = hashPassword(data['password'])
         serializer = personsSerializer(data=data)
         serializer.is_valid(raise_exception=True)
         try:
@@ -74,7 +235,7 @@ class personsViewSet(PermissionsPerMethodMixin, viewsets.GenericViewSet):
             queryset = set()
             queryset.add(user)
             serializer = personsLoginGetTokenSerializer(queryset,many=True)
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
+            return Response(self.serialized(serializer), status=status.HTTP_201_CREATED)
         except IntegrityError as exception:
             if "unique_alias" in str(exception):
                 error = "alias already exists"
@@ -87,9 +248,8 @@ class personsViewSet(PermissionsPerMethodMixin, viewsets.GenericViewSet):
     @permission_classes([IsAdminUser])
     def aliases(self, request, *args, **kwargs):
         """" get all used aliases"""
-        queryset = Persons.objects.all()
-        serializer = aliasesSerializer(queryset, many=True)
-        return Response(serializer.data)
+        queryset = Persons.objects.all().order_by('id_person')
+        return self.list_response(aliasesSerializer, queryset)
     
     # GET 127.0.0.1:8000/api/persons/login/?email=john.doe@gmail.com&pwd=testpwd1
     @action(detail=False, methods=['get'])
@@ -98,15 +258,16 @@ class personsViewSet(PermissionsPerMethodMixin, viewsets.GenericViewSet):
         """" authenticate user w/o token"""
         email = request.query_params.get('email')
         pwd = request.query_params.get('pwd')
+        serializer = self.sparse_serializer(personsLoginGetTokenSerializer, many=True)
         queryset = Persons.objects.filter(email=email)
         if queryset:
             user = queryset.get()
-            if bcrypt.checkpw(pwd.encode('utf8'), user.password.encode('utf8')):
+            if checkPassword(pwd, user.password):
                 user.token = self.create_token(user)
                 queryset = set()
                 queryset.add(user)
-                serializer = personsLoginGetTokenSerializer(queryset,many=True)
-                return Response(serializer.data)
+                serializer.instance = queryset
+                return Response(self.serialized(serializer))
             else:
                 error = "wrong sign-in information for: %s"%(email)
                 return Response({'error': error}, status=status.HTTP_404_NOT_FOUND)
@@ -120,13 +281,14 @@ class personsViewSet(PermissionsPerMethodMixin, viewsets.GenericViewSet):
     def login_token(self, request, *args, **kwargs):
         """" authenticate user w/ token"""
         token = request.query_params.get('token')
+        serializer = self.sparse_serializer(personsLoginSerializer, many=True)
         try:
             decoded_payload = jwt_decode_handler(token) #TODO signature expired? 
             id_person = decoded_payload['user_id']
             queryset = Persons.objects.filter(id_person=id_person)
             if queryset:
-                serializer = personsLoginSerializer(queryset,many=True)
-                return Response(serializer.data)
+                serializer.instance = queryset
+                return Response(self.serialized(serializer))
             else:
                 error = "Invalid token"
                 return Response({'error': error}, status=status.HTTP_404_NOT_FOUND)
@@ -141,8 +303,8 @@ class personsViewSet(PermissionsPerMethodMixin, viewsets.GenericViewSet):
         if request.method == 'GET':
             """" get all towns of a user"""
             queryset = PersonsTowns.objects.filter(id_person=pk)
-            serializer = personsTownsDetailSerializer(queryset, many=True)
-            return Response(serializer.data)
+            serializer = self.serialize(personsTownsDetailSerializer, queryset)
+            return Response(self.serialized(serializer))
         
         elif request.method == 'POST':
             """" add a new town to the user """
@@ -151,7 +313,7 @@ class personsViewSet(PermissionsPerMethodMixin, viewsets.GenericViewSet):
             serializer = personsTownsSerializer(data=data)
             serializer.is_valid(raise_exception=True)
             serializer.save()
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
+            return Response(self.serialized(serializer), status=status.HTTP_201_CREATED)
 
     # GET,POST 127.0.0.1:8000/api/persons/1/tools/
     @action(detail=True, methods=['get','post'])
@@ -160,8 +322,8 @@ class personsViewSet(PermissionsPerMethodMixin, viewsets.GenericViewSet):
         if request.method == 'GET':
             """" get all tools belonging to a user"""
             queryset = Tools.objects.filter(id_person=pk)
-            serializer = toolsDetailSerializer(queryset, many=True)
-            return Response(serializer.data)
+            serializer = self.serialize(toolsDetailSerializer, queryset)
+            return Response(self.serialized(serializer))
         
         elif request.method == 'POST':
             """" add a new tool to the user """
@@ -170,17 +332,24 @@ class personsViewSet(PermissionsPerMethodMixin, viewsets.GenericViewSet):
             serializer = toolsSerializer(data=data)
             serializer.is_valid(raise_exception=True)
             serializer.save()
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
+            return Response(self.serialized(serializer), status=status.HTTP_201_CREATED)
     
     # GET,POST 127.0.0.1:8000/api/persons/1/reviews/
     @action(detail=True, methods=['get','post'])
     @permission_classes([IsAuthenticated])
     def reviews(self, request, pk=None, *args, **kwargs):
-        if request.method == 'GET':
+        if request.method == 'GET' and request.query_params.get('summary'):
+            # GET 127.0.0.1:8000/api/persons/1/reviews/?summary=true
+            """" get the review count, average and stars histogram of a user """
+            serializer = self.sparse_serializer(reviewsSummarySerializer)
+            serializer.instance = get_object_or_404(self.eager_load(reviewsSummarySerializer, Persons.objects.all(), serializer), id_person=pk)
+            return Response(self.serialized(serializer))
+
+        elif request.method == 'GET':
             """" get all reviews belonging to a user"""
             queryset = PersonReviews.objects.filter(id_person=pk)
-            serializer = personReviewsSerializer(queryset, many=True)
-            return Response(serializer.data)
+            serializer = self.serialize(personReviewsSerializer, queryset)
+            return Response(self.serialized(serializer))
         
         elif request.method == 'POST':
             """" add a new review to the user """
@@ -189,7 +358,7 @@ class personsViewSet(PermissionsPerMethodMixin, viewsets.GenericViewSet):
             serializer = personReviewsSerializer(data=data)
             serializer.is_valid(raise_exception=True)
             serializer.save()
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
+            return Response(self.serialized(serializer), status=status.HTTP_201_CREATED)
 
     # GET 127.0.0.1:8000/api/persons/1/groups/
     @action(detail=True, methods=['get'])
@@ -197,30 +366,29 @@ class personsViewSet(PermissionsPerMethodMixin, viewsets.GenericViewSet):
     def groups(self, request, pk=None, *args, **kwargs):
         """" get all groups in which the user is """
         queryset = GroupsMembers.objects.filter(id_person=pk).order_by('id_groupName')
-        serializer = membersGroupsDetailSerializer(queryset, many=True)
-        return Response(serializer.data)
+        serializer = self.serialize(membersGroupsDetailSerializer, queryset)
+        return Response(self.serialized(serializer))
 
 
 ######################
 ###   TOOLS  API   ###
 
-class toolsViewSet(PermissionsPerMethodMixin, viewsets.GenericViewSet):
+class toolsViewSet(PermissionsPerMethodMixin, EagerLoadingViewMixin, viewsets.GenericViewSet):
 
     # GET 127.0.0.1:8000/api/tools/
     @permission_classes([AllowAny])
     def list(self, request, *args, **kwargs):
         """" list all tools """
-        queryset = Tools.objects.all()
-        serializer = toolsBasicSerializer(queryset, many=True)
-        return Response(serializer.data)
+        queryset = Tools.objects.all().order_by('id_tool')
+        return self.list_response(toolsBasicSerializer, queryset)
 
     # GET 127.0.0.1:8000/api/tools/1
     @permission_classes([AllowAny])
     def retrieve(self, request,pk=None, *args, **kwargs):
         """" get a tool by it's id """
         queryset = Tools.objects.filter(id_tool=pk)
-        serializer = toolsDetailWithOwnerSerializer(queryset, many=True)
-        return Response(serializer.data)
+        serializer = self.serialize(toolsDetailWithOwnerSerializer, queryset)
+        return Response(self.serialized(serializer))
 
     # GET,POST 127.0.0.1:8000/api/tools/1/images/
     @action(detail=True, methods=['get','post'])
@@ -229,8 +397,8 @@ class toolsViewSet(PermissionsPerMethodMixin, viewsets.GenericViewSet):
         if request.method == 'GET':
             """" get all images belonging to a tool"""
             queryset = ToolImages.objects.filter(id_tool=pk)
-            serializer = toolImagesSerializer(queryset, many=True)
-            return Response(serializer.data)
+            serializer = self.serialize(toolImagesSerializer, queryset)
+            return Response(self.serialized(serializer))
         
         elif request.method == 'POST':
             """" add a new image to the tool """
@@ -239,17 +407,24 @@ class toolsViewSet(PermissionsPerMethodMixin, viewsets.GenericViewSet):
             serializer = toolImagesSerializer(data=data)
             serializer.is_valid(raise_exception=True)
             serializer.save()
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
+            return Response(self.serialized(serializer), status=status.HTTP_201_CREATED)
     
     # GET,POST 127.0.0.1:8000/api/tools/1/reviews/
     @action(detail=True, methods=['get','post'])
     @permission_classes([IsAuthenticated])
     def reviews(self, request, pk=None, *args, **kwargs):
-        if request.method == 'GET':
+        if request.method == 'GET' and request.query_params.get('summary'):
+            # GET 127.0.0.1:8000/api/tools/1/reviews/?summary=true
+            """" get the review count, average and stars histogram of a tool """
+            serializer = self.sparse_serializer(reviewsSummarySerializer)
+            serializer.instance = get_object_or_404(self.eager_load(reviewsSummarySerializer, Tools.objects.all(), serializer), id_tool=pk)
+            return Response(self.serialized(serializer))
+
+        elif request.method == 'GET':
             """" get all reviews made on a tool"""
             queryset = ToolReviews.objects.filter(id_tool=pk)
-            serializer = toolReviewsSerializer(queryset, many=True)
-            return Response(serializer.data)
+            serializer = self.serialize(toolReviewsSerializer, queryset)
+            return Response(self.serialized(serializer))
 
         elif request.method == 'POST':
             """" add a new review on the tool """
@@ -258,7 +433,7 @@ class toolsViewSet(PermissionsPerMethodMixin, viewsets.GenericViewSet):
             serializer = toolReviewsSerializer(data=data)
             serializer.is_valid(raise_exception=True)
             serializer.save()
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
+            return Response(self.serialized(serializer), status=status.HTTP_201_CREATED)
     
     # GET 127.0.0.1:8000/api/tools/1/groups/
     @permission_classes([IsAuthenticated])
@@ -266,23 +441,22 @@ class toolsViewSet(PermissionsPerMethodMixin, viewsets.GenericViewSet):
     def groups(self, request, pk=None, *args, **kwargs):
         """" get all groups in which a tool is """
         queryset = ToolsGroups.objects.filter(id_tool=pk)
-        serializer = toolsGroupsDetailSerializer(queryset, many=True)
-        return Response(serializer.data)
+        serializer = self.serialize(toolsGroupsDetailSerializer, queryset)
+        return Response(self.serialized(serializer))
 
 
 
 ######################
 ###   GROUPS API   ###
 
-class groupsViewSet(PermissionsPerMethodMixin, viewsets.GenericViewSet):
+class groupsViewSet(PermissionsPerMethodMixin, EagerLoadingViewMixin, BulkRowsViewMixin, viewsets.GenericViewSet):
 
     # GET 127.0.0.1:8000/api/groups/
     @permission_classes([AllowAny])
     def list(self, request, *args, **kwargs):
         """" list all groups (public & private) """
-        queryset = Groups.objects.all()
-        serializer = groupsSerializer(queryset, many=True)
-        return Response(serializer.data)
+        queryset = Groups.objects.all().order_by('id_groupName')
+        return self.list_response(groupsSerializer, queryset)
     
     # POST 127.0.0.1:8000/api/groups/
     @permission_classes([IsAuthenticated])
@@ -291,25 +465,20 @@ class groupsViewSet(PermissionsPerMethodMixin, viewsets.GenericViewSet):
         serializer = groupsSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         serializer.save()
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
+        invalidateResponses('groups')
+        return Response(self.serialized(serializer), status=status.HTTP_201_CREATED)
 
     # GET 127.0.0.1:8000/api/groups/public/
     @action(detail=False, methods=['get'])
     @permission_classes([AllowAny])
+    @cachedResponse('groups')
     def public(self, request, *args, **kwargs):
         country = request.query_params.get('countryCode')
         town = request.query_params.get('id_town')
         if country:
             # GET 127.0.0.1:8000/api/groups/public/?countryCode=BE
             """" list all public groups of a certain country"""
-            queryset = Groups.objects.raw( 
-                '''
-                SELECT * 
-                FROM "Groups"
-                JOIN "Towns" ON ("Groups".id_town = "Towns".id_town)
-                WHERE "Groups"."groupType" = 'public' AND "Towns"."id_countryCode" = '%s';
-                '''%(country)
-            )
+            queryset = Groups.objects.filter(groupType='public',id_town__id_countryCode=country)
         elif town:
             # GET 127.0.0.1:8000/api/groups/public/?id_town=1
             """" list all public groups of a certain town"""
@@ -318,8 +487,7 @@ class groupsViewSet(PermissionsPerMethodMixin, viewsets.GenericViewSet):
             """" list all public groups """
             queryset = Groups.objects.filter(groupType='public')
 
-        serializer = groupsDetailSerializer(queryset, many=True)
-        return Response(serializer.data)
+        return self.list_response(groupsDetailSerializer, queryset.order_by('id_groupName'))
 
 
 
@@ -332,14 +500,7 @@ class groupsViewSet(PermissionsPerMethodMixin, viewsets.GenericViewSet):
         if country:
             # GET 127.0.0.1:8000/api/groups/private/?countryCode=BE
             """" list all private groups of a certain country"""
-            queryset = Groups.objects.raw( 
-                '''
-                SELECT * 
-                FROM "Groups"
-                JOIN "Towns" ON ("Groups".id_town = "Towns".id_town)
-                WHERE "Groups"."groupType" = 'private' AND "Towns"."id_countryCode" = '%s';
-                '''%(country)
-            )
+            queryset = Groups.objects.filter(groupType='private',id_town__id_countryCode=country)
         elif town:
             # GET 127.0.0.1:8000/api/groups/private/?id_town=1
             """" list all private groups of a certain town"""
@@ -348,8 +509,7 @@ class groupsViewSet(PermissionsPerMethodMixin, viewsets.GenericViewSet):
             """" list all private groups """
             queryset = Groups.objects.filter(groupType='private')
 
-        serializer = groupsDetailSerializer(queryset, many=True)
-        return Response(serializer.data)
+        return self.list_response(groupsDetailSerializer, queryset.order_by('id_groupName'))
 
 
 
@@ -362,15 +522,15 @@ class groupsViewSet(PermissionsPerMethodMixin, viewsets.GenericViewSet):
             """" list all members of a group """
             groupName = request.query_params.get('groupName')
             queryset = GroupsMembers.objects.filter(id_groupName=groupName)
-            serializer = groupsMembersDetailSerializer(queryset, many=True)
-            return Response(serializer.data)
+            serializer = self.serialize(groupsMembersDetailSerializer, queryset)
+            return Response(self.serialized(serializer))
 
         elif request.method == 'POST':
             """" add a new member to a group """
             serializer = groupsMembersSerializer(data=request.data)
             serializer.is_valid(raise_exception=True)
             serializer.save()
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
+            return Response(self.serialized(serializer), status=status.HTTP_201_CREATED)
         
         elif request.method == 'DELETE':
             """" delete a member from a group """
@@ -385,6 +545,23 @@ class groupsViewSet(PermissionsPerMethodMixin, viewsets.GenericViewSet):
                 error = "The member with id: %s does not exist in group: %s"%(id_person,groupName)
                 return Response({'error': error}, status=status.HTTP_404_NOT_FOUND)
 
+    # POST,DELETE 127.0.0.1:8000/api/groups/members/bulk/
+    @action(detail=False, methods=['post','delete'], url_path='members/bulk')
+    @permission_classes([IsAuthenticated])
+    def members_bulk(self, request, *args, **kwargs):
+        if request.method == 'POST':
+            """" add members to groups, body: [{"id_person": 1, "id_groupName": "TestGroup1", "groupAdmin": false}, ...] """
+            return self.bulk_create_response(request, groupsMembersBulkSerializer)
+
+        elif request.method == 'DELETE':
+            """" delete members from a group, body: {"id_person": [1, 2, ...]} """
+            # DELETE 127.0.0.1:8000/api/groups/members/bulk/?groupName=TestGroup1
+            groupName = request.query_params.get('groupName')
+            if not groupName:
+                return Response({'error': "groupName is required"}, status=status.HTTP_400_BAD_REQUEST)
+            queryset = GroupsMembers.objects.filter(id_groupName=groupName)
+            return self.bulk_delete_response(request, groupsMembersBulkDeleteSerializer, queryset, 'id_person')
+
 
     # GET 127.0.0.1:8000/api/groups/admins/
     @action(detail=False, methods=['get'])
@@ -394,8 +571,8 @@ class groupsViewSet(PermissionsPerMethodMixin, viewsets.GenericViewSet):
         """" list all admins of a group """
         groupName = request.query_params.get('groupName')
         queryset = GroupsMembers.objects.filter(id_groupName=groupName,groupAdmin=True)
-        serializer = groupsMembersDetailSerializer(queryset, many=True)
-        return Response(serializer.data)
+        serializer = self.serialize(groupsMembersDetailSerializer, queryset)
+        return Response(self.serialized(serializer))
 
     # GET 127.0.0.1:8000/api/groups/tools/
     @action(detail=False, methods=['get','post','delete'])
@@ -406,15 +583,15 @@ class groupsViewSet(PermissionsPerMethodMixin, viewsets.GenericViewSet):
             """" list all tools of a group """
             groupName = request.query_params.get('groupName')
             queryset = ToolsGroups.objects.filter(id_groupName=groupName)
-            serializer = groupsToolsDetailSerializer(queryset, many=True)
-            return Response(serializer.data)
+            serializer = self.serialize(groupsToolsDetailSerializer, queryset)
+            return Response(self.serialized(serializer))
 
         elif request.method == 'POST':
             """" add a new tool to a group """
             serializer = groupsToolsSerializer(data=request.data)
             serializer.is_valid(raise_exception=True)
             serializer.save()
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
+            return Response(self.serialized(serializer), status=status.HTTP_201_CREATED)
 
         elif request.method == 'DELETE':
             """" delete a tool from a group """
@@ -428,27 +605,44 @@ class groupsViewSet(PermissionsPerMethodMixin, viewsets.GenericViewSet):
             else:
                 error = "The tool with id: %s does not exist in group: %s"%(id_tool,groupName)
                 return Response({'error': error}, status=status.HTTP_404_NOT_FOUND)
+
+    # POST,DELETE 127.0.0.1:8000/api/groups/tools/bulk/
+    @action(detail=False, methods=['post','delete'], url_path='tools/bulk')
+    @permission_classes([AllowAny])
+    def tools_bulk(self, request, *args, **kwargs):
+        if request.method == 'POST':
+            """" add tools to groups, body: [{"id_tool": 1, "id_groupName": "TestGroup1"}, ...] """
+            return self.bulk_create_response(request, groupsToolsBulkSerializer)
+
+        elif request.method == 'DELETE':
+            """" delete tools from a group, body: {"id_tool": [1, 2, ...]} """
+            # DELETE 127.0.0.1:8000/api/groups/tools/bulk/?groupName=TestGroup1
+            groupName = request.query_params.get('groupName')
+            if not groupName:
+                return Response({'error': "groupName is required"}, status=status.HTTP_400_BAD_REQUEST)
+            queryset = ToolsGroups.objects.filter(id_groupName=groupName)
+            return self.bulk_delete_response(request, groupsToolsBulkDeleteSerializer, queryset, 'id_tool')
             
 
 ######################
 ###   TOWNS  API   ###
 
-class townsViewSet(PermissionsPerMethodMixin, viewsets.GenericViewSet):
+class townsViewSet(PermissionsPerMethodMixin, EagerLoadingViewMixin, viewsets.GenericViewSet):
 
     # GET 127.0.0.1:8000/api/towns/
     @permission_classes([AllowAny])
+    @cachedResponse('towns')
     def list(self, request, *args, **kwargs):
         country = request.query_params.get('countryCode')
         if country:
             # GET 127.0.0.1:8000/api/towns/?countryCode=BE
             """" list all towns of a country """
-            queryset = Towns.objects.filter(id_countryCode=country).order_by('townName')
+            queryset = Towns.objects.filter(id_countryCode=country).order_by('townName','id_town')
         else:
             """" list all towns """
-            queryset = Towns.objects.all().order_by('townName')
+            queryset = Towns.objects.all().order_by('townName','id_town')
 
-        serializer = townsSerializer(queryset, many=True)
-        return Response(serializer.data)
+        return self.list_response(townsSerializer, queryset)
     
     # POST 127.0.0.1:8000/api/towns/
     @permission_classes([IsAuthenticated])
@@ -457,22 +651,23 @@ class townsViewSet(PermissionsPerMethodMixin, viewsets.GenericViewSet):
         serializer = townsSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         serializer.save()
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
+        invalidateResponses('towns')
+        return Response(self.serialized(serializer), status=status.HTTP_201_CREATED)
 
 
 
 #######################
 ###  COUNTRIES API  ###
 
-class countriesViewSet(PermissionsPerMethodMixin, viewsets.GenericViewSet):
+class countriesViewSet(PermissionsPerMethodMixin, EagerLoadingViewMixin, viewsets.GenericViewSet):
 
     # GET 127.0.0.1:8000/api/countries/
     @permission_classes([AllowAny])
+    @cachedResponse('countries')
     def list(self, request, *args, **kwargs):
         """" list all countries """
         queryset = Countries.objects.all().order_by('countryName')
-        serializer = countriesSerializer(queryset, many=True)
-        return Response(serializer.data)
+        return self.list_response(countriesSerializer, queryset)
     
     # POST 127.0.0.1:8000/api/countries/
     @permission_classes([IsAuthenticated])
@@ -481,66 +676,127 @@ class countriesViewSet(PermissionsPerMethodMixin, viewsets.GenericViewSet):
         serializer = countriesSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         serializer.save()
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
+        invalidateResponses('countries')
+        return Response(self.serialized(serializer), status=status.HTTP_201_CREATED)
 
 
 #######################
 ###   SEARCH  API   ###
 
-class searchViewSet(PermissionsPerMethodMixin, viewsets.GenericViewSet):
-
-    def distCalc(self,town_Search, group):
-        R = 6373.0 # approximate radius of earth in km
-
-        lat1 = radians(abs(town_Search['lat']))
-        lon1 = radians(abs(town_Search['lng']))
-        lat2 = radians(abs(group['town']['lat']))
-        lon2 = radians(abs(group['town']['lng']))
-
-        dlon = lon2 - lon1
-        dlat = lat2 - lat1
-
-        a = sin(dlat / 2)**2 + cos(lat1) * cos(lat2) * sin(dlon / 2)**2
-        c = 2 * atan2(sqrt(a), sqrt(1 - a))
+MIN_RANKED_SEARCH_LENGTH = 3 # pg_trgm works on 3 letter trigrams
 
-        distance = R * c 
+class searchViewSet(PermissionsPerMethodMixin, EagerLoadingViewMixin, viewsets.GenericViewSet):
 
-        if (distance <= group['groupRange']):
-            return True
-        return False
+    def searchParam(self, request, name):
+        """" read a search param, clients send it wrapped in single quotes """
+        return (request.query_params.get(name) or '').replace("'", "")
 
-    # GET 127.0.0.1:8000/api/search/?what=xxxx&where=yyyyy
+    def searchTown(self, where):
+        """
+        The town searched from, annotated with the largest public group range
+        (`maxRange`, found through the groups_type_range_idx index) in the same round trip
+        """
+        maxRange = (Groups.objects
+            .filter(groupType='public')
+            .order_by('-groupRange')
+            .values('groupRange')[:1])
+        return (Towns.objects
+            .filter(townName__iexact=where)
+            .annotate(maxRange=Subquery(maxRange))
+            .first())
+
+    def groupsInRange(self, town, what, maxKm=None, limit=None, serializer=None):
+        """
+        Public groups owning a tool matching `what` whose range covers `town` (see searchTown),
+        optionally at most `maxKm` away, nearest first, each with its `distance`.
+        `serializer` (see EagerLoadingViewMixin.eager_load) limits the columns loaded.
+        """
+        if town.maxRange is None:
+            return []
+        searchKm = town.maxRange if maxKm is None else min(town.maxRange, maxKm)
+
+        # SearchEntries holds every (public group, tool) pair with the group's town
+        # coordinates: cheap prefilter on its indexed grid cell, exact check on the survivors
+        entries = SearchEntries.objects.all()
+        cells = cellsAround(town.lat, town.lng, searchKm)
+        if cells is not None:
+            entries = entries.filter(geoCell__in=cells)
+
+        # one row per group, with the relevance of its best matching tool
+        match, relevance = self.toolsMatching(what)
+        ranked = (entries
+            .filter(match)
+            .annotate(dot=dotExpr(town.lat, town.lng))
+            .filter(dot__gte=minDotExpr('groupRange'))
+            .filter(dot__gte=cos(searchKm / EARTH_RADIUS_KM))
+            .values('id_groupName')
+            .annotate(relevance=Max(relevance), groupDot=Max('dot'))
+            .annotate(distance=distanceExpr('groupDot'))
+            .order_by('distance', '-relevance', 'id_groupName'))
+        if limit is not None:
+            ranked = ranked[:limit]
+        ranked = list(ranked)
+
+        groups = self.eager_load(groupsSearchResultSerializer,
+            Groups.objects.filter(pk__in=[row['id_groupName'] for row in ranked]), serializer).in_bulk()
+        result = []
+        for row in ranked:
+            group = groups[row['id_groupName']]
+            group.distance = row['distance']
+            result.append(group)
+        return result
+
+    def toolsMatching(self, what):
+        """
+        Returns the filter matching search entries against `what` and their relevance:
+        full-text match on the tool name and description, substring and fuzzy (trigram)
+        match on the lower cased name, all backed by GIN indexes
+        """
+        if not what:
+            return Q(), Value(0.0, output_field=FloatField())
+        # a plain (case sensitive) LIKE on the lower cased name can use the trigram index,
+        # icontains compares UPPER() of the column which no index covers
+        contains = Q(toolName__contains=what.lower())
+        if len(what) < MIN_RANKED_SEARCH_LENGTH:
+            # trigrams / ranking of a 1-2 letter term match nearly every tool, computing
+            # them for each candidate costs CPU without telling the tools apart
+            return contains, Value(0.0, output_field=FloatField())
+
+        query = SearchQuery(what, config='simple')
+        match = Q(searchVector=query) | contains | Q(toolName__trigram_similar=what)
+        relevance = SearchRank(F('searchVector'), query) + TrigramSimilarity('toolName', what)
+        return match, relevance
+
+    # GET 127.0.0.1:8000/api/search/?what='xxxx'&where='yyyyy'
+    # GET 127.0.0.1:8000/api/search/?what='xxxx'&where='yyyyy'&limit=10&max_km=20
     @permission_classes([AllowAny])
     def list(self, request, *args, **kwargs):
-        """" list all users """
-        what = "'%%{}%%'".format(request.query_params.get('what').replace("'", ""))
-        where = request.query_params.get('where')
-        townSearchQuery =   '''
-                            SELECT *
-                            FROM "Towns"
-                            WHERE LOWER("Towns"."townName") LIKE LOWER(%s) ;
-                            ''' %(where)
-        townSearchQuerySet = Towns.objects.raw(townSearchQuery)
-        townSearch = townsSerializer(townSearchQuerySet, many=True).data
-
-        allGroupsWToolQuery =   '''
-                                SELECT *
-                                FROM "Groups"
-                                JOIN "Towns" ON ("Groups".id_town = "Towns".id_town)
-                                JOIN "ToolsGroups" ON ("Groups"."id_groupName" = "ToolsGroups"."id_groupName")
-                                JOIN "Tools" ON ("ToolsGroups".id_tool = "Tools".id_tool)
-                                WHERE "Groups"."groupType" = 'public' 
-                                AND LOWER("Tools"."toolName") LIKE LOWER(%s);
-                                ''' % (what)
-        allGroupsWToolQuerySet = Groups.objects.raw(allGroupsWToolQuery)
-        allGroupsWTool = groupsDetailSerializer(allGroupsWToolQuerySet, many=True).data
-        
-        groups = []
-        if(len(townSearch) != 0):
-            for group in allGroupsWTool:
-                if(self.distCalc(townSearch[0],group)):
-                    groups.append(group)
-                else:
-                    pass
-        
-        return Response(groups)
+        """" list the public groups near a town owning a tool, nearest first """
+        what = self.searchParam(request, 'what')
+        where = self.searchParam(request, 'where')
+        try:
+            limit = self.positiveParam(request, 'limit', int)
+            maxKm = self.positiveParam(request, 'max_km', float)
+        except ValueError as exception:
+            return Response({'error': str(exception)}, status=status.HTTP_400_BAD_REQUEST)
+
+        serializer = self.sparse_serializer(groupsSearchResultSerializer, many=True)
+        town = self.searchTown(where)
+        if town is None:
+            return Response([])
+
+        serializer.instance = self.groupsInRange(town, what, maxKm, limit, serializer)
+        return Response(self.serialized(serializer))
+
+    def positiveParam(self, request, name, cast):
+        """" the query param `name` converted by `cast`, None when absent, ValueError unless it is > 0 """
+        value = request.query_params.get(name)
+        if value is None:
+            return None
+        try:
+            value = cast(value)
+        except ValueError:
+            value = None
+        if value is None or value <= 0:
+            raise ValueError("%s must be a positive number" % name)
+        return value
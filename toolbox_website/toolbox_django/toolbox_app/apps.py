@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class Toolbox_appConfig(AppConfig):
     name = 'toolbox_app'
+
+    def ready(self):
+        from . import signals
@@ -1,6 +1,8 @@
 import jwt
 
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from django.utils.encoding import smart_text
 from django.utils.translation import ugettext as _
 from rest_framework import exceptions
@@ -16,6 +18,26 @@ from .models import Persons
 jwt_decode_handler = api_settings.JWT_DECODE_HANDLER
 jwt_get_username_from_payload = api_settings.JWT_PAYLOAD_GET_USERNAME_HANDLER
 
+# the PRINCIPAL_FIELDS of resolved Persons are cached by the token's user_id for
+# JWT_PRINCIPAL_CACHE_TTL seconds, the entry is dropped whenever the Persons row changes
+# (see signals.py). The other columns (the password hash first) are never written to the
+# cache, they are read from the database if a view asks for them
+PRINCIPAL_CACHE_TTL = getattr(settings, 'JWT_PRINCIPAL_CACHE_TTL', 60)
+PRINCIPAL_FIELDS = ('id_person', 'email')
+
+
+def principal_cache_key(user_id):
+    return 'jwt-principal:%s' % user_id
+
+
+def invalidate_principal(user_id):
+    cache.delete(principal_cache_key(user_id))
+
+
+def cached_principal(values):
+    """" Persons of the cached PRINCIPAL_FIELDS `values`, its other fields deferred """
+    return Persons.from_db(Persons.objects.db, PRINCIPAL_FIELDS, [values[field] for field in PRINCIPAL_FIELDS])
+
 
 class BaseJSONWebTokenAuthentication(BaseAuthentication):
     """
@@ -51,17 +73,28 @@ class BaseJSONWebTokenAuthentication(BaseAuthentication):
         """
         User = Persons
         username = jwt_get_username_from_payload(payload)
+        user_id = payload.get('user_id')
 
-        if not username:
+        if not username or not user_id:
             msg = _('Invalid payload.')
             raise exceptions.AuthenticationFailed(msg)
 
-        try:
-            user = User.objects.filter(email=username)
-        except User.DoesNotExist:
+        key = principal_cache_key(user_id)
+        principal = cache.get(key)
+        if principal is None:
+            try:
+                user = User.objects.only(*PRINCIPAL_FIELDS).get(id_person=user_id)
+            except User.DoesNotExist:
+                msg = _('Invalid signature.')
+                raise exceptions.AuthenticationFailed(msg)
+            cache.set(key, {field: getattr(user, field) for field in PRINCIPAL_FIELDS}, PRINCIPAL_CACHE_TTL)
+        else:
+            user = cached_principal(principal)
+
+        if user.email != username:
             msg = _('Invalid signature.')
             raise exceptions.AuthenticationFailed(msg)
-        
+
         return user
 
 
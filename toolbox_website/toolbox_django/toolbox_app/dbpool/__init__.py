@@ -0,0 +1,167 @@
+"""
+Postgres connection pool, used as a database ENGINE ('toolbox_app.dbpool', see base.py):
+closing a Django connection (at the end of each request with CONN_MAX_AGE = 0) hands the
+psycopg2 connection back to the pool of its worker process instead of closing it, so the
+next request skips the TCP handshake, the authentication and the backend process start.
+A connection given back is reset (DISCARD ALL), as a new one it keeps no session state.
+
+DATABASES['default']['POOL'] configures it:
+    MAX_SIZE                connections a process opens at most, the others wait for one (each
+                            thread holds one at most: the request threads of a worker suffice)
+    WAIT_TIMEOUT            seconds to wait for a connection before failing
+    IDLE_TIMEOUT            seconds an unused connection is kept open
+    HEALTH_CHECK_INTERVAL   a connection unused for longer is checked (SELECT 1) before being lent
+"""
+import os
+import threading
+import time
+
+from psycopg2 import OperationalError
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+
+DEFAULTS = {
+    'MAX_SIZE': 10,
+    'WAIT_TIMEOUT': 10,
+    'IDLE_TIMEOUT': 300,
+    'HEALTH_CHECK_INTERVAL': 30,
+}
+
+_pools = {}
+_poolsPid = None # process the pools belong to
+# pools inherited from the parent process on fork: they stay referenced, never used nor
+# closed, as collecting their connections would close the sockets the parent still uses
+_orphaned = []
+_poolsLock = threading.Lock()
+
+
+class PoolTimeout(OperationalError):
+    pass
+
+
+class ConnectionPool(object):
+    """" psycopg2 connections opened by `connect()`, lent to one Django connection at a time """
+    def __init__(self, connect, maxSize, waitTimeout, idleTimeout, healthCheckInterval):
+        self.connect = connect
+        self.maxSize = maxSize
+        self.waitTimeout = waitTimeout
+        self.idleTimeout = idleTimeout
+        self.healthCheckInterval = healthCheckInterval
+        self.idle = [] # (connection, time it was given back), the most recent last
+        self.size = 0 # connections open, idle or lent
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        """" (connection, seconds spent waiting for it, whether it was opened for this call) """
+        start = time.monotonic()
+        while True:
+            connection, returnedAt = self.reserve(start + self.waitTimeout)
+            if connection is None:
+                try:
+                    connection = self.connect()
+                except Exception:
+                    self.discard(None)
+                    raise
+                return connection, time.monotonic() - start, True
+            if time.monotonic() - returnedAt < self.healthCheckInterval or self.healthy(connection):
+                return connection, time.monotonic() - start, False
+            self.discard(connection)
+
+    def reserve(self, deadline):
+        """" an idle (connection, returned at), or (None, None) when a new connection may be opened """
+        with self.condition:
+            while True:
+                self.closeIdle(time.monotonic() - self.idleTimeout)
+                if self.idle:
+                    return self.idle.pop()
+                if self.size < self.maxSize:
+                    self.size += 1
+                    return None, None
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolTimeout('no database connection available after %ss (POOL MAX_SIZE = %s)' % (
+                        self.waitTimeout, self.maxSize))
+                self.condition.wait(remaining)
+
+    def release(self, connection):
+        """" takes back a lent connection, in the state of a new one """
+        try:
+            if not connection.closed and connection.info.transaction_status != TRANSACTION_STATUS_IDLE:
+                connection.rollback()
+            if not connection.closed:
+                # the session state a request may leave behind (SET parameters, WITH HOLD cursors,
+                # prepared statements, temporary tables, advisory locks, LISTEN) must not leak to the next
+                connection.autocommit = True
+                with connection.cursor() as cursor:
+                    cursor.execute('DISCARD ALL')
+                connection.autocommit = False
+        except Exception:
+            self.discard(connection)
+            return
+        if connection.closed:
+            self.discard(connection)
+            return
+        with self.condition:
+            self.idle.append((connection, time.monotonic()))
+            self.condition.notify()
+
+    def discard(self, connection):
+        """" forgets a lent (or never opened, None) connection """
+        if connection is not None:
+            close(connection)
+        with self.condition:
+            self.size -= 1
+            self.condition.notify()
+
+    def healthy(self, connection):
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            connection.rollback()
+            return True
+        except Exception:
+            return False
+
+    def closeIdle(self, before):
+        """" closes the idle connections given back before `before` (called with the lock held) """
+        expired = [connection for connection, returnedAt in self.idle if returnedAt < before]
+        if expired:
+            self.idle = [(connection, returnedAt) for connection, returnedAt in self.idle if returnedAt >= before]
+            self.size -= len(expired)
+            for connection in expired:
+                close(connection)
+
+    def closeAll(self):
+        """" closes the idle connections """
+        with self.condition:
+            self.closeIdle(float('inf'))
+
+
+def close(connection):
+    try:
+        connection.close()
+    except Exception:
+        pass
+
+
+def poolFor(key, options, connect):
+    """" the pool of this process for the connections of `key` (their parameters) """
+    global _poolsPid
+    with _poolsLock:
+        if _poolsPid != os.getpid():
+            # forked: the connections of the parent process are not ours to use
+            _orphaned.extend(_pools.values())
+            _pools.clear()
+            _poolsPid = os.getpid()
+        if key not in _pools:
+            settings = dict(DEFAULTS, **options)
+            _pools[key] = ConnectionPool(connect, settings['MAX_SIZE'], settings['WAIT_TIMEOUT'],
+                                         settings['IDLE_TIMEOUT'], settings['HEALTH_CHECK_INTERVAL'])
+        return _pools[key]
+
+
+def closePools():
+    """" closes the idle connections of every pool of this process """
+    with _poolsLock:
+        pools = list(_pools.values())
+    for pool in pools:
+        pool.closeAll()
@@ -0,0 +1,42 @@
+from django.db.backends.postgresql import base, creation
+
+from ..metrics import recordConnection
+from . import closePools, poolFor
+
+
+class DatabaseCreation(creation.DatabaseCreation):
+    def _destroy_test_db(self, test_database_name, verbosity):
+        # the pooled connections to the test database would prevent its DROP
+        closePools()
+        super()._destroy_test_db(test_database_name, verbosity)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """
+    The postgresql backend, borrowing its connections from a pool (see toolbox_app.dbpool)
+    when the database settings have a POOL entry
+    """
+    creation_class = DatabaseCreation
+
+    def pool(self, conn_params):
+        key = tuple(sorted((name, str(value)) for name, value in conn_params.items()))
+        return poolFor(key, self.settings_dict['POOL'], lambda: self.Database.connect(**conn_params))
+
+    def get_new_connection(self, conn_params):
+        if self.settings_dict.get('POOL') is None:
+            return super().get_new_connection(conn_params)
+        connection, waited, opened = self.pool(conn_params).acquire()
+        recordConnection(waited, opened)
+
+        # as super().get_new_connection(), the isolation level of a lent connection is
+        # its default one (the pool turns autocommit off when it is given back)
+        options = self.settings_dict['OPTIONS']
+        self.isolation_level = options.get('isolation_level', connection.isolation_level)
+        if self.isolation_level != connection.isolation_level:
+            connection.set_session(isolation_level=self.isolation_level)
+        return connection
+
+    def _close(self):
+        if self.connection is None or self.settings_dict.get('POOL') is None:
+            return super()._close()
+        self.pool(self.get_connection_params()).release(self.connection)
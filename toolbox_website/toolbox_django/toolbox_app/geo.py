@@ -0,0 +1,76 @@
+from math import cos, floor, radians, sin
+
+from django.db.models import ExpressionWrapper, F, FloatField, Value
+from django.db.models.functions import ACos, Cos, Least
+
+EARTH_RADIUS_KM = 6373.0 # approximate radius of earth in km
+KM_PER_DEGREE = 111.2    # length of one degree of latitude in km
+
+# Towns are bucketed in a grid of GEO_CELL_DEGREES x GEO_CELL_DEGREES cells (~111km high),
+# a radius search only reads the towns of the cells its circle overlaps. The geo columns of
+# Towns are computed by a db trigger (migration 0014) with the same formulas as unitVector()
+# and geoCell(): a change here needs a migration replacing it
+GEO_CELL_DEGREES = 1
+GEO_CELL_ROWS = 180 // GEO_CELL_DEGREES
+GEO_CELL_COLUMNS = 360 // GEO_CELL_DEGREES
+MAX_SEARCH_CELLS = 400 # past this, scanning is cheaper than a huge IN (...)
+
+
+def unitVector(lat, lng):
+    """" (x, y, z) of the point at (lat, lng) on a unit sphere """
+    latRad, lngRad = radians(lat), radians(lng)
+    return (cos(latRad) * cos(lngRad), cos(latRad) * sin(lngRad), sin(latRad))
+
+
+def geoCell(lat, lng):
+    """" id of the grid cell containing (lat, lng) """
+    row = min(int(floor((lat + 90) / GEO_CELL_DEGREES)), GEO_CELL_ROWS - 1)
+    column = int(floor((lng + 180) / GEO_CELL_DEGREES)) % GEO_CELL_COLUMNS
+    return row * GEO_CELL_COLUMNS + column
+
+
+def cellsAround(lat, lng, km):
+    """
+    Ids of the grid cells overlapping the circle of radius `km` around (lat, lng),
+    or None when there are too many of them to be worth filtering on.
+    """
+    dLat = km / KM_PER_DEGREE
+    minLat, maxLat = max(lat - dLat, -90), min(lat + dLat, 90)
+    rows = range(geoCell(minLat, 0) // GEO_CELL_COLUMNS, geoCell(maxLat, 0) // GEO_CELL_COLUMNS + 1)
+
+    # the circle is widest in longitude at its poleward edge
+    edgeLat = max(abs(minLat), abs(maxLat))
+    if edgeLat >= 90 or dLat / cos(radians(edgeLat)) >= 180:
+        columns = range(GEO_CELL_COLUMNS)
+    else:
+        dLng = dLat / cos(radians(edgeLat))
+        first = int(floor((lng - dLng + 180) / GEO_CELL_DEGREES))
+        last = int(floor((lng + dLng + 180) / GEO_CELL_DEGREES))
+        columns = sorted(set(column % GEO_CELL_COLUMNS for column in range(first, last + 1)))
+
+    if len(rows) * len(columns) > MAX_SEARCH_CELLS:
+        return None
+    return [row * GEO_CELL_COLUMNS + column for row in rows for column in columns]
+
+
+def dotExpr(lat, lng, prefix=''):
+    """
+    Database expression of the dot product between the unit vector of (lat, lng) and the
+    precomputed one of a town: the cosine of the angle between them, 1 for the same point.
+    """
+    x, y, z = unitVector(lat, lng)
+    return ExpressionWrapper(
+        F(prefix + 'unitX') * x + F(prefix + 'unitY') * y + F(prefix + 'unitZ') * z,
+        output_field=FloatField(),
+    )
+
+
+def minDotExpr(kmField):
+    """" smallest dot product (see dotExpr) of two points at most `kmField` km apart """
+    return Cos(ExpressionWrapper(F(kmField) / EARTH_RADIUS_KM, output_field=FloatField()))
+
+
+def distanceExpr(dotField):
+    """" great-circle distance (km) matching the dot product `dotField` (see dotExpr) """
+    # Least() guards acos() against rounding errors slightly above 1
+    return EARTH_RADIUS_KM * ACos(Least(F(dotField), Value(1.0)), output_field=FloatField())
@@ -0,0 +1,43 @@
+import os
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps
+
+# (field, max width/height in px, Pillow format, extension) of the variants generated for each ToolImages upload
+VARIANTS = (
+    ('thumbnail', 200, 'JPEG', 'jpg'),
+    ('medium', 800, 'JPEG', 'jpg'),
+    ('webp', 800, 'WEBP', 'webp'),
+)
+QUALITY = 80
+
+
+def encode(image, size, format):
+    """ Returns `image` shrunk to fit in a `size`x`size` box, encoded as `format` """
+    variant = image.copy()
+    variant.thumbnail((size, size), Image.LANCZOS)
+    output = BytesIO()
+    if format == 'JPEG':
+        variant.save(output, format, quality=QUALITY, optimize=True, progressive=True)
+    else:
+        variant.save(output, format, quality=QUALITY, method=6)
+    return output.getvalue()
+
+
+def makeVariants(toolImage):
+    """
+    Fills the resized / re-encoded variant fields of an (unsaved) ToolImages from its image.
+    The caller saves the instance.
+    """
+    toolImage.image.open()
+    toolImage.image.seek(0)
+    image = Image.open(toolImage.image)
+    image = ImageOps.exif_transpose(image) # phone pictures are often stored rotated
+    if image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+
+    base = os.path.splitext(os.path.basename(toolImage.image.name))[0]
+    for field, size, format, extension in VARIANTS:
+        data = encode(image, size, format)
+        getattr(toolImage, field).save('%s_%s.%s' % (base, field, extension), ContentFile(data), save=False)
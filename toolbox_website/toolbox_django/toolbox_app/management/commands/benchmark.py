@@ -0,0 +1,161 @@
+import json
+import platform
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from math import ceil
+from statistics import mean
+from urllib.parse import quote
+
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from toolbox_app.models import Groups, Persons, Tools, Towns
+from .generate_data import PASSWORD, TOOL_NAMES, email
+
+# (name, url template, needs a logged in client), the templates are filled with
+# rows picked at random on every request (see Command.sample)
+ENDPOINTS = (
+    ('tools.list', '/api/tools/', False),
+    ('tools.list.page', '/api/tools/?page_size=50', False),
+    ('tools.retrieve', '/api/tools/{tool}/', False),
+    ('tools.reviews.summary', '/api/tools/{tool}/reviews/?summary=1', True),
+    ('groups.public', '/api/groups/public/', False),
+    ('groups.tools', '/api/groups/tools/?groupName={group}', False),
+    ('groups.members', '/api/groups/members/?groupName={group}', True),
+    ('persons.retrieve', '/api/persons/{person}/', True),
+    ('towns.list', '/api/towns/', False),
+    ('countries.list', '/api/countries/', False),
+    ('search', "/api/search/?what='{what}'&where='{where}'", False),
+    ('search.nearest', "/api/search/?what='{what}'&where='{where}'&limit=10", False),
+)
+PERCENTILES = (50, 95, 99)
+SAMPLE_SIZE = 200 # rows of each table the requests are spread over
+
+
+def percentile(values, p):
+    """" nearest-rank percentile of a sorted list """
+    return values[max(0, ceil(p / 100 * len(values)) - 1)]
+
+
+class Command(BaseCommand):
+    help = ('Benchmarks the main API endpoints in-process (no network): latency percentiles, queries per request '
+            'and throughput of each, written as JSON to compare runs. Run it against a database filled by '
+            '`manage.py generate_data`')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=50, help='measured requests per endpoint')
+        parser.add_argument('--warmup', type=int, default=5, help='unmeasured requests per endpoint, run first')
+        parser.add_argument('--concurrency', type=int, default=1, help='threads sending the requests')
+        parser.add_argument('--endpoint', action='append', choices=[name for name, url, auth in ENDPOINTS],
+                            help='endpoint to benchmark (repeatable), all by default')
+        parser.add_argument('--prefix', default='bench', help='--prefix the data was generated with, to log in')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='JSON file the results are written to')
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        self.sample = {
+            'tool': list(Tools.objects.order_by('?').values_list('pk', flat=True)[:SAMPLE_SIZE]),
+            'group': list(Groups.objects.order_by('?').values_list('pk', flat=True)[:SAMPLE_SIZE]),
+            'person': list(Persons.objects.order_by('?').values_list('pk', flat=True)[:SAMPLE_SIZE]),
+            'where': list(Towns.objects.order_by('?').values_list('townName', flat=True)[:SAMPLE_SIZE]),
+            'what': [name.split()[0].lower() for name in TOOL_NAMES],
+        }
+        if not all(self.sample.values()):
+            raise CommandError('Nothing to benchmark, fill the database with `manage.py generate_data` first')
+        self.token = self.login(email(options['prefix'], 0))
+
+        results = {}
+        for name, url, auth in ENDPOINTS:
+            if options['endpoint'] and name not in options['endpoint']:
+                continue
+            if auth and self.token is None:
+                self.stderr.write('%s: skipped, could not log in as %s' % (name, email(options['prefix'], 0)))
+                continue
+            self.run(url, auth, options['warmup'], options['concurrency'])
+            results[name] = self.summarize(*self.run(url, auth, options['requests'], options['concurrency']))
+            self.stdout.write(self.formatLine(name, results[name]))
+
+        report = {
+            'date': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'database': connection.vendor,
+            'options': {name: options[name] for name in ('requests', 'warmup', 'concurrency', 'seed')},
+            'rows': {model.__name__: model.objects.count() for model in apps.get_app_config('toolbox_app').get_models()},
+            'endpoints': results,
+        }
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump(report, file, indent=2)
+            self.stdout.write(self.style.SUCCESS('Results written to %s' % options['output']))
+
+    def login(self, login):
+        """" JWT of a generated person, None if there is none """
+        response = self.client().get('/api/persons/login/?email=%s&pwd=%s' % (quote(login), PASSWORD))
+        if response.status_code != 200:
+            return None
+        return response.data[0]['token']
+
+    def client(self, auth=False):
+        client = APIClient(HTTP_HOST='localhost')
+        if auth:
+            client.credentials(HTTP_AUTHORIZATION='JWT %s' % self.token)
+        return client
+
+    def url(self, template):
+        return template.format(**{name: quote(str(self.random.choice(values))) for name, values in self.sample.items()})
+
+    def run(self, template, auth, count, concurrency):
+        """" sends `count` GET requests, returns their (latencies in ms, query counts, statuses) and the wall time """
+        urls = [self.url(template) for index in range(count)]
+
+        def send(urls):
+            client, measures = self.client(auth), []
+            try:
+                for url in urls:
+                    with CaptureQueriesContext(connection) as queries:
+                        start = time.perf_counter()
+                        response = client.get(url)
+                        elapsed = (time.perf_counter() - start) * 1000
+                    measures.append((elapsed, len(queries), response.status_code))
+            finally:
+                if concurrency > 1:
+                    connection.close() # each thread has its own connection
+            return measures
+
+        start = time.perf_counter()
+        if concurrency > 1:
+            with ThreadPoolExecutor(concurrency) as executor:
+                measures = [m for chunk in executor.map(send, [urls[i::concurrency] for i in range(concurrency)]) for m in chunk]
+        else:
+            measures = send(urls)
+        return measures, time.perf_counter() - start
+
+    def summarize(self, measures, wallTime):
+        if not measures:
+            return {'requests': 0}
+        latencies = sorted(latency for latency, queries, status in measures)
+        queries = [queries for latency, queries, status in measures]
+        summary = {'requests': len(measures)}
+        summary.update({'p%s_ms' % p: round(percentile(latencies, p), 3) for p in PERCENTILES})
+        summary.update({
+            'mean_ms': round(mean(latencies), 3),
+            'max_ms': round(latencies[-1], 3),
+            'queries_mean': round(mean(queries), 2),
+            'queries_max': max(queries),
+            'throughput_rps': round(len(measures) / wallTime, 1) if wallTime else None,
+            'errors': sum(1 for latency, queries, status in measures if status >= 400),
+        })
+        return summary
+
+    def formatLine(self, name, summary):
+        if not summary['requests']:
+            return '%-24s no requests' % name
+        return '%-24s p50 %8.2fms  p95 %8.2fms  p99 %8.2fms  %6.1f queries  %8.1f req/s  %s error(s)' % (
+            name, summary['p50_ms'], summary['p95_ms'], summary['p99_ms'],
+            summary['queries_mean'], summary['throughput_rps'], summary['errors'])
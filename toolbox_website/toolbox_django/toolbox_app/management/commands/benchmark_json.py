@@ -0,0 +1,87 @@
+import json
+import platform
+import time
+from datetime import datetime
+from io import BytesIO
+from statistics import median
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.module_loading import import_string
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+from toolbox_app.models import Persons, Tools, ToolsGroups
+from toolbox_app.renderers import ORJSONParser, ORJSONRenderer
+from toolbox_app.serializers import groupsToolsDetailSerializer, personsSerializer, toolsDetailWithOwnerSerializer
+
+# (name, serializer, model): the payloads are the serialized first rows of the model
+PAYLOADS = (
+    ('groups.tools', groupsToolsDetailSerializer, ToolsGroups),
+    ('tools.retrieve', toolsDetailWithOwnerSerializer, Tools),
+    ('persons', personsSerializer, Persons),
+)
+RENDERERS = (JSONRenderer, ORJSONRenderer)
+PARSERS = (JSONParser, ORJSONParser)
+
+
+class Command(BaseCommand):
+    help = ('Compares the time the JSON renderers / parsers take to encode / decode the largest API payloads '
+            '(nested tools of a group, tool with its owner, persons), written as JSON to compare runs. '
+            'Run it against a database filled by `manage.py generate_data`')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000, help='rows serialized in each payload')
+        parser.add_argument('--repeat', type=int, default=20, help='timed encodings / decodings of each payload')
+        parser.add_argument('--renderer', action='append', help='dotted path of an other renderer class to compare')
+        parser.add_argument('--output', help='JSON file the results are written to')
+
+    def handle(self, *args, **options):
+        renderers = list(RENDERERS) + [import_string(path) for path in options['renderer'] or ()]
+        results = {}
+        for name, serializer_class, model in PAYLOADS:
+            queryset = model.objects.order_by('pk')
+            if hasattr(serializer_class, 'setup_eager_loading'):
+                queryset = serializer_class.setup_eager_loading(queryset)
+            data = serializer_class(queryset[:options['rows']], many=True).data
+            if not data:
+                raise CommandError('Nothing to encode, fill the database with `manage.py generate_data` first')
+
+            reference = JSONRenderer().render(data)
+            results[name] = {'rows': len(data), 'bytes': len(reference), 'render_ms': {}, 'parse_ms': {}}
+            for renderer_class in renderers:
+                content = renderer_class().render(data)
+                if json.loads(content) != json.loads(reference):
+                    raise CommandError('%s: %s renders another content than JSONRenderer' % (name, renderer_class.__name__))
+                results[name]['render_ms'][renderer_class.__name__] = self.time(
+                    lambda: renderer_class().render(data), options['repeat'])
+            for parser_class in PARSERS:
+                results[name]['parse_ms'][parser_class.__name__] = self.time(
+                    lambda: parser_class().parse(BytesIO(reference), parser_context={}), options['repeat'])
+            self.stdout.write(self.formatLine(name, results[name]))
+
+        report = {
+            'date': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'options': {name: options[name] for name in ('rows', 'repeat')},
+            'payloads': results,
+        }
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump(report, file, indent=2)
+            self.stdout.write(self.style.SUCCESS('Results written to %s' % options['output']))
+
+    def time(self, function, repeat):
+        """" median duration of `function` in ms """
+        durations = []
+        for index in range(repeat):
+            start = time.perf_counter()
+            function()
+            durations.append((time.perf_counter() - start) * 1000)
+        return round(median(durations), 3)
+
+    def formatLine(self, name, result):
+        base = result['render_ms'][JSONRenderer.__name__]
+        renders = '  '.join('%s %8.2fms (x%.1f)' % (renderer, ms, base / ms if ms else 0)
+                            for renderer, ms in result['render_ms'].items())
+        parses = '  '.join('%s %8.2fms' % (parser, ms) for parser, ms in result['parse_ms'].items())
+        return '%-16s %5s rows %9s bytes  render: %s  parse: %s' % (name, result['rows'], result['bytes'], renders, parses)
@@ -0,0 +1,164 @@
+import random
+import time
+from datetime import date, timedelta
+from io import BytesIO
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from PIL import Image
+
+from toolbox_app.models import (Countries, Groups, GroupsMembers, PersonReviews, Persons, PersonsTowns,
+                                ToolImages, ToolReviews, Tools, ToolsGroups, Towns, MAX_STARS)
+from toolbox_app.passwords import hashPassword
+from toolbox_app.responseCache import invalidateResponses
+
+# every generated person logs in with this password (see `manage.py benchmark`)
+PASSWORD = 'benchmark'
+
+# rows generated per unit of --scale
+PER_SCALE = {
+    'towns': 50,
+    'persons': 200,
+    'groups': 40,
+    'tools': 500,
+}
+MEMBERSHIPS_PER_PERSON = 3
+GROUPS_PER_TOOL = 2
+REVIEWS_PER_TOOL = 3
+REVIEWS_PER_PERSON = 2
+IMAGES_PER_TOOL = 1
+DISTINCT_IMAGES = 8 # image files shared by all the generated ToolImages rows
+
+TOOL_NAMES = (
+    'Perceuse', 'Visseuse', 'Scie sauteuse', 'Scie circulaire', 'Ponceuse', 'Meuleuse', 'Marteau',
+    'Tondeuse', 'Taille-haie', 'Echelle', 'Brouette', 'Betonniere', 'Karcher', 'Niveau laser',
+    'Cle a molette', 'Rabot', 'Defonceuse', 'Compresseur', 'Souffleur', 'Tronconneuse',
+)
+TOOL_ADJECTIVES = ('electrique', 'sans fil', 'pro', 'compacte', 'lourde', 'legere', 'neuve', 'ancienne')
+WORDS = ('super', 'bien', 'pratique', 'puissant', 'batterie', 'lame', 'jardin', 'bois', 'metal', 'beton', 'mur', 'sol')
+FIRST_NAMES = ('Martin', 'Allan', 'Kevin', 'Lea', 'Emma', 'Louis', 'Nora', 'Hugo', 'Zoe', 'Adam')
+LAST_NAMES = ('Michotte', 'Fontaine', 'Vandenede', 'Peeters', 'Janssens', 'Maes', 'Dubois', 'Lambert')
+
+# towns are scattered over this (lat, lng) box, Belgium and around
+LAT_RANGE = (49.5, 51.5)
+LNG_RANGE = (2.5, 6.4)
+
+
+def email(prefix, index):
+    return '%s%s@example.com' % (prefix, index)
+
+
+class Command(BaseCommand):
+    help = ('Fills the database with synthetic persons, towns, groups, tools, memberships, reviews and images, '
+            'to benchmark the API against realistic volumes (see `manage.py benchmark`)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', type=float, default=1,
+                            help='multiplies the generated volumes: %s' % ', '.join('%s %s' % (n, name) for name, n in PER_SCALE.items()))
+        parser.add_argument('--prefix', default='bench', help='prefix of the generated names / emails, must not be in use')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        prefix, scale = options['prefix'], options['scale']
+        if Persons.objects.filter(email=email(prefix, 0)).exists():
+            raise CommandError('Data was already generated with the prefix "%s", pick another --prefix' % prefix)
+
+        self.random = random.Random(options['seed'])
+        self.batchSize = options['batch_size']
+        counts = {name: max(1, int(n * scale)) for name, n in PER_SCALE.items()}
+        start = time.monotonic()
+
+        with transaction.atomic():
+            country, _ = Countries.objects.get_or_create(id_countryCode='BE', defaults={'countryName': 'Belgium'})
+            towns = self.createTowns(prefix, counts['towns'], country)
+            persons = self.createPersons(prefix, counts['persons'], towns)
+            groups = self.createGroups(prefix, counts['groups'], towns)
+            self.createMemberships(persons, groups)
+            tools = self.createTools(counts['tools'], persons, groups)
+            self.createReviews(persons, tools)
+            self.createImages(prefix, tools)
+
+        for namespace in ('towns', 'groups', 'countries'):
+            invalidateResponses(namespace)
+        self.stdout.write(self.style.SUCCESS('Generated %s in %.1fs' % (
+            ', '.join('%s %s' % (n, name) for name, n in counts.items()), time.monotonic() - start)))
+
+    def bulkCreate(self, model, rows):
+        return model.objects.bulk_create(rows, batch_size=self.batchSize)
+
+    def createTowns(self, prefix, count, country):
+        towns = []
+        for index in range(count):
+            lat, lng = self.random.uniform(*LAT_RANGE), self.random.uniform(*LNG_RANGE)
+            towns.append(Towns(postCode=1000 + index, townName='%s-town%s' % (prefix, index),
+                               lat=lat, lng=lng, id_countryCode=country))
+        return self.bulkCreate(Towns, towns)
+
+    def createPersons(self, prefix, count, towns):
+        password = hashPassword(PASSWORD) # bcrypt is slow on purpose, hash once
+        persons = self.bulkCreate(Persons, [
+            Persons(lastName=self.random.choice(LAST_NAMES), firstName=self.random.choice(FIRST_NAMES),
+                    alias='%s%s' % (prefix, index), email=email(prefix, index), password=password,
+                    birthDate=date(1950, 1, 1) + timedelta(days=self.random.randrange(20000)))
+            for index in range(count)
+        ])
+        self.bulkCreate(PersonsTowns, [PersonsTowns(id_person=person, id_town=self.random.choice(towns)) for person in persons])
+        return persons
+
+    def createGroups(self, prefix, count, towns):
+        return self.bulkCreate(Groups, [
+            Groups(id_groupName='%s-group%s' % (prefix, index), groupDescription=self.sentence(),
+                   groupType='public' if self.random.random() < 0.8 else 'private',
+                   groupRange=self.random.choice((5, 10, 20, 50, 100)), id_town=self.random.choice(towns))
+            for index in range(count)
+        ])
+
+    def createMemberships(self, persons, groups):
+        members = []
+        for person in persons:
+            for index, group in enumerate(self.random.sample(groups, min(MEMBERSHIPS_PER_PERSON, len(groups)))):
+                members.append(GroupsMembers(id_person=person, id_groupName=group, groupAdmin=index == 0))
+        self.bulkCreate(GroupsMembers, members)
+
+    def createTools(self, count, persons, groups):
+        tools = self.bulkCreate(Tools, [
+            Tools(id_person=self.random.choice(persons), toolDescription=self.sentence(),
+                  toolName='%s %s' % (self.random.choice(TOOL_NAMES), self.random.choice(TOOL_ADJECTIVES)),
+                  toolPrice='%.2f' % self.random.uniform(1, 100))
+            for index in range(count)
+        ])
+        self.bulkCreate(ToolsGroups, [
+            ToolsGroups(id_tool=tool, id_groupName=group)
+            for tool in tools for group in self.random.sample(groups, min(GROUPS_PER_TOOL, len(groups)))
+        ])
+        return tools
+
+    def createReviews(self, persons, tools):
+        self.bulkCreate(ToolReviews, [
+            ToolReviews(id_tool=tool, stars=self.random.randint(0, MAX_STARS), comment=self.sentence())
+            for tool in tools for index in range(REVIEWS_PER_TOOL)
+        ])
+        self.bulkCreate(PersonReviews, [
+            PersonReviews(id_person=person, stars=self.random.randint(0, MAX_STARS), comment=self.sentence())
+            for person in persons for index in range(REVIEWS_PER_PERSON)
+        ])
+
+    def createImages(self, prefix, tools):
+        # a few real files (and their variants), shared by all the rows
+        files = []
+        for index in range(DISTINCT_IMAGES):
+            output = BytesIO()
+            color = tuple(self.random.randrange(256) for channel in range(3))
+            Image.new('RGB', (1024, 768), color).save(output, 'JPEG')
+            toolImage = ToolImages(id_tool=tools[0], image=SimpleUploadedFile('%s-%s.jpg' % (prefix, index), output.getvalue()))
+            toolImage.save()
+            files.append(toolImage)
+        self.bulkCreate(ToolImages, [
+            ToolImages(id_tool=tool, **{field: getattr(file, field).name for field in ('image', 'thumbnail', 'medium', 'webp')})
+            for tool in tools[1:] for file in self.random.sample(files, IMAGES_PER_TOOL)
+        ])
+
+    def sentence(self):
+        return ' '.join(self.random.choice(WORDS) for index in range(self.random.randint(3, 12))).capitalize()
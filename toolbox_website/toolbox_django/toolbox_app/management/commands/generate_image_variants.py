@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from toolbox_app.models import ToolImages
+
+
+class Command(BaseCommand):
+    help = 'Generates the thumbnail / medium / webp variants of the tool images uploaded before they existed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='regenerate the variants of every image')
+
+    def handle(self, *args, **options):
+        queryset = ToolImages.objects.all()
+        if not options['all']:
+            queryset = queryset.filter(thumbnail__isnull=True) | queryset.filter(thumbnail='')
+
+        done = 0
+        for toolImage in queryset.iterator():
+            try:
+                toolImage.thumbnail = None
+                toolImage.save()
+                done += 1
+            except (IOError, OSError) as exception:
+                self.stderr.write('%s: %s' % (toolImage.image.name, exception))
+        self.stdout.write(self.style.SUCCESS('Generated the variants of %s image(s)' % done))
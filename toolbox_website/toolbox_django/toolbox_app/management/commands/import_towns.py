@@ -0,0 +1,150 @@
+import csv
+import gzip
+import time
+from io import StringIO
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from toolbox_app.models import Countries, Towns
+from toolbox_app.responseCache import invalidateResponses
+
+# columns of the GeoNames postal codes dumps (https://download.geonames.org/export/zip/)
+GEONAMES_COLUMNS = (
+    'countryCode', 'postalCode', 'placeName', 'adminName1', 'adminCode1', 'adminName2',
+    'adminCode2', 'adminName3', 'adminCode3', 'latitude', 'longitude', 'accuracy',
+)
+# header of the CSV files, countryName is optional
+CSV_COLUMNS = ('postCode', 'townName', 'lat', 'lng', 'id_countryCode')
+
+# columns of the staging table, in COPY order
+STAGING_COLUMNS = ('postCode', 'townName', 'lat', 'lng', 'id_countryCode', 'countryName')
+# the other geo columns are derived from these by a db trigger (see migration 0014)
+GEO_COLUMNS = ('lat', 'lng')
+
+CREATE_STAGING_SQL = '''
+CREATE TEMP TABLE IF NOT EXISTS import_towns (
+    "postCode" integer, "townName" varchar(30), lat double precision, lng double precision,
+    "id_countryCode" varchar(5), "countryName" varchar(30),
+    line serial
+)
+'''
+
+UPSERT_COUNTRIES_SQL = '''
+INSERT INTO "Countries" ("id_countryCode", "countryName")
+SELECT DISTINCT ON ("id_countryCode") "id_countryCode", coalesce("countryName", "id_countryCode")
+FROM import_towns
+ORDER BY "id_countryCode", "countryName"
+ON CONFLICT ("id_countryCode") DO NOTHING
+'''
+
+# a town appearing twice in a chunk keeps its last line, towns whose coordinates
+# did not change are left untouched (no dead tuple, no search entries refresh)
+UPSERT_TOWNS_SQL = '''
+INSERT INTO "Towns" ({columns})
+SELECT DISTINCT ON ("postCode", "townName", "id_countryCode") {columns}
+FROM import_towns
+ORDER BY "postCode", "townName", "id_countryCode", line DESC
+ON CONFLICT ("postCode", "townName", "id_countryCode") DO UPDATE SET {updates}
+WHERE ("Towns".lat, "Towns".lng) IS DISTINCT FROM (EXCLUDED.lat, EXCLUDED.lng) OR "Towns"."geoCell" IS NULL
+RETURNING (xmax = 0)
+'''.format(
+    columns=', '.join('"%s"' % column for column in ('postCode', 'townName', 'id_countryCode') + GEO_COLUMNS),
+    updates=', '.join('"{0}" = EXCLUDED."{0}"'.format(column) for column in GEO_COLUMNS),
+)
+
+
+class Command(BaseCommand):
+    help = ('Imports (inserts or updates) towns, and their countries, from a CSV file with a '
+            '%s[,countryName] header or a GeoNames postal codes dump, streamed in chunks' % ','.join(CSV_COLUMNS))
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='file to import, .gz files are decompressed on the fly')
+        parser.add_argument('--format', choices=('csv', 'geonames'), default='csv')
+        parser.add_argument('--delimiter', help='defaults to a tab for GeoNames dumps and .tsv files, a comma otherwise')
+        parser.add_argument('--encoding', default='utf-8')
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        delimiter = options['delimiter']
+        if delimiter is None:
+            tabs = options['format'] == 'geonames' or options['path'].replace('.gz', '').endswith('.tsv')
+            delimiter = '\t' if tabs else ','
+
+        opener = gzip.open if options['path'].endswith('.gz') else open
+        try:
+            file = opener(options['path'], 'rt', encoding=options['encoding'], newline='')
+        except OSError as exception:
+            raise CommandError(exception)
+
+        self.skipped = 0
+        inserted = updated = read = 0
+        start = time.monotonic()
+        with file, connection.cursor() as cursor:
+            cursor.execute(CREATE_STAGING_SQL)
+            rows = self.readRows(csv.reader(file, delimiter=delimiter), options['format'])
+            while True:
+                chunk = list(islice(rows, options['batch_size']))
+                if not chunk:
+                    break
+                chunkInserted, chunkUpdated = self.load(cursor, chunk)
+                inserted, updated, read = inserted + chunkInserted, updated + chunkUpdated, read + len(chunk)
+                if options['verbosity'] > 1:
+                    self.stdout.write('%s rows, %.0f rows/s' % (read, read / (time.monotonic() - start)))
+            cursor.execute('DROP TABLE import_towns')
+
+        invalidateResponses('towns')
+        invalidateResponses('countries')
+        invalidateResponses('groups') # groups are listed with their town
+        elapsed = time.monotonic() - start
+        self.stdout.write(self.style.SUCCESS(
+            'Imported %s row(s) in %.1fs (%.0f rows/s): %s town(s) inserted, %s updated, %s unchanged, %s invalid row(s) skipped'
+            % (read, elapsed, read / elapsed if elapsed else 0, inserted, updated, read - inserted - updated, self.skipped)))
+
+    def readRows(self, reader, format):
+        """" yields (postCode, townName, lat, lng, countryCode, countryName) tuples, skipping invalid lines """
+        if format == 'geonames':
+            indexes = [GEONAMES_COLUMNS.index(name) for name in ('postalCode', 'placeName', 'latitude', 'longitude', 'countryCode')]
+            countryNameIndex = None
+        else:
+            header = next(reader, [])
+            missing = [name for name in CSV_COLUMNS if name not in header]
+            if missing:
+                raise CommandError('Missing column(s) in the CSV header: %s' % ', '.join(missing))
+            indexes = [header.index(name) for name in CSV_COLUMNS]
+            countryNameIndex = header.index('countryName') if 'countryName' in header else None
+
+        for line in reader:
+            try:
+                postCode, townName, lat, lng, countryCode = (line[index].strip() for index in indexes)
+                countryName = (line[countryNameIndex].strip() or None) if countryNameIndex is not None else None
+                row = (int(postCode), townName, float(lat), float(lng), countryCode.upper(), countryName)
+            except (IndexError, ValueError):
+                # e.g. alphanumeric post codes, which Towns.postCode can't hold
+                self.skipped += 1
+                continue
+            if (not townName or len(townName) > Towns._meta.get_field('townName').max_length
+                    or not countryCode or len(countryCode) > Countries._meta.get_field('id_countryCode').max_length
+                    or (countryName and len(countryName) > Countries._meta.get_field('countryName').max_length)
+                    or not (-90 <= row[2] <= 90 and -180 <= row[3] <= 180)):
+                self.skipped += 1
+                continue
+            yield row
+
+    def load(self, cursor, chunk):
+        """" COPYs a chunk of rows in the staging table and upserts them, returns the (inserted, updated) counts """
+        buffer = StringIO()
+        writer = csv.writer(buffer)
+        writer.writerows(chunk)
+        buffer.seek(0)
+
+        with transaction.atomic():
+            cursor.copy_expert('COPY import_towns (%s) FROM STDIN WITH (FORMAT csv)'
+                               % ', '.join('"%s"' % column for column in STAGING_COLUMNS), buffer)
+            cursor.execute(UPSERT_COUNTRIES_SQL)
+            cursor.execute(UPSERT_TOWNS_SQL)
+            results = [row[0] for row in cursor.fetchall()]
+            cursor.execute('TRUNCATE import_towns')
+        inserted = sum(results)
+        return inserted, len(results) - inserted
@@ -0,0 +1,76 @@
+"""
+Uploaded media, stored and served like the static files of build/static: every file
+name carries a hash of its content, so its URL can be cached forever (immutable),
+and it is served by WhiteNoise (sendfile through the WSGI file wrapper) before
+the request reaches the URL routing, views or database.
+"""
+import hashlib
+import os
+import re
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.http import HttpResponseNotFound
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+HASH_LENGTH = 12
+HASHED_NAME = re.compile(r'\.[0-9a-f]{%s}\.[^./]+$' % HASH_LENGTH)
+
+
+class HashedFileSystemStorage(FileSystemStorage):
+    """
+    Saves "dir/name.ext" as "dir/name.<content hash>.ext" (the naming scheme of
+    ManifestStaticFilesStorage), a file already stored with the same content is reused
+    """
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        name = self.hashedName(name, content)
+        if self.exists(name):
+            return name
+        return super().save(name, content, max_length)
+
+    def hashedName(self, name, content):
+        digest = hashlib.md5()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+        root, extension = os.path.splitext(name)
+        return '%s.%s%s' % (root, digest.hexdigest()[:HASH_LENGTH], extension)
+
+
+class MediaFilesMiddleware(WhiteNoiseMiddleware):
+    """
+    Serves MEDIA_ROOT at MEDIA_URL. Files are looked up on disk (uploads appear at runtime)
+    until found: a hashed name never changes content, it is then served from memory, as
+    immutable. The older unhashed uploads are looked up on each request and cached for
+    MEDIA_MAX_AGE seconds. Precompressed .gz / .br siblings are used when they exist.
+    """
+    def configure_from_settings(self, settings):
+        super().configure_from_settings(settings)
+        self.autorefresh = True # add_files() registers MEDIA_ROOT for find_file() instead of scanning it
+        self.use_finders = False
+        self.static_root = None # build/static is served by the WhiteNoiseMiddleware before this one
+        self.root = None
+        self.max_age = getattr(settings, 'MEDIA_MAX_AGE', 3600)
+        self.media_prefix = settings.MEDIA_URL
+
+    def __init__(self, get_response=None, settings=settings):
+        super().__init__(get_response, settings)
+        self.add_files(settings.MEDIA_ROOT, prefix=self.media_prefix)
+
+    def process_request(self, request):
+        if not request.path_info.startswith(self.media_prefix):
+            return None
+        static_file = self.files.get(request.path_info)
+        if static_file is None:
+            static_file = self.find_file(request.path_info)
+            if static_file is None:
+                # instead of the React app, which the catch-all url serves
+                return HttpResponseNotFound()
+            if HASHED_NAME.search(request.path_info):
+                self.files[request.path_info] = static_file
+        return self.serve(static_file, request)
+
+    def immutable_file_test(self, path, url):
+        return bool(HASHED_NAME.search(url))
@@ -0,0 +1,292 @@
+"""
+Per endpoint request metrics: wall time, database time, query count, duplicate
+queries (the same SQL run again in one request, usually an N+1), serializer time,
+time waiting for a database connection, connections opened and response bytes,
+recorded by MetricsMiddleware for each resolved view / method.
+
+Every worker process aggregates its own requests and publishes them to the cache
+every METRICS_FLUSH_INTERVAL seconds, the /metrics/ endpoint merges all of them
+in the Prometheus text format.
+"""
+import os
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils.crypto import constant_time_compare
+
+PREFIX = 'toolbox'
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10) # seconds
+QUERIES_BUCKETS = (1, 2, 5, 10, 20, 50, 100)
+PIDS_KEY = 'metrics:pids'
+
+_local = threading.local()
+_lock = threading.Lock()
+_aggregates = {} # (view, method) -> totals, see record()
+_lastFlush = 0
+
+
+def flushInterval():
+    return getattr(settings, 'METRICS_FLUSH_INTERVAL', 10)
+
+
+def snapshotKey(pid):
+    return 'metrics:%s' % pid
+
+
+class RequestRecorder(object):
+    """" measures of the request being handled by this thread """
+    def __init__(self):
+        self.queries = 0
+        self.dbTime = 0.0
+        self.statements = Counter()
+        self.serializerTime = 0.0
+        self.serializing = False
+        self.connectionWait = 0.0
+        self.connectionsOpened = 0
+
+    def recordQuery(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.dbTime += time.perf_counter() - start
+            self.queries += 1
+            self.statements[sql] += 1
+
+    @property
+    def duplicates(self):
+        return sum(count - 1 for count in self.statements.values())
+
+
+def currentRecorder():
+    return getattr(_local, 'recorder', None)
+
+
+def recordConnection(waited, opened):
+    """" a database connection was taken from the pool (see toolbox_app.dbpool) after `waited` seconds """
+    recorder = currentRecorder()
+    if recorder is not None:
+        recorder.connectionWait += waited
+        recorder.connectionsOpened += 1 if opened else 0
+
+
+@contextmanager
+def timedSerialization():
+    """" counts the time spent in its block as serialization time (see EagerLoadingViewMixin.serialized) """
+    recorder = currentRecorder()
+    if recorder is None or recorder.serializing:
+        yield
+        return
+    recorder.serializing = True
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        # includes the queries the serializer triggers (lazy relations)
+        recorder.serializerTime += time.perf_counter() - start
+        recorder.serializing = False
+
+
+def viewLabel(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unresolved'
+    return match.view_name
+
+
+def record(view, method, status, wallTime, recorder, size):
+    totals = {
+        'requests': 1,
+        'errors': 1 if status >= 500 else 0,
+        'wall_seconds': wallTime,
+        'db_seconds': recorder.dbTime,
+        'queries': recorder.queries,
+        'duplicate_queries': recorder.duplicates,
+        'serializer_seconds': recorder.serializerTime,
+        'connection_wait_seconds': recorder.connectionWait,
+        'connections_opened': recorder.connectionsOpened,
+        'response_bytes': size,
+    }
+    with _lock:
+        aggregate = _aggregates.setdefault((view, method), {
+            'totals': Counter(),
+            'duration_buckets': [0] * len(DURATION_BUCKETS),
+            'queries_buckets': [0] * len(QUERIES_BUCKETS),
+        })
+        aggregate['totals'].update(totals)
+        for index, bound in enumerate(DURATION_BUCKETS):
+            if wallTime <= bound:
+                aggregate['duration_buckets'][index] += 1
+        for index, bound in enumerate(QUERIES_BUCKETS):
+            if recorder.queries <= bound:
+                aggregate['queries_buckets'][index] += 1
+
+
+def flush(force=False):
+    """" publishes this process' aggregates to the cache, at most every METRICS_FLUSH_INTERVAL seconds """
+    global _lastFlush
+    now = time.monotonic()
+    if not force and now - _lastFlush < flushInterval():
+        return
+    _lastFlush = now
+    with _lock:
+        snapshot = {key: {
+            'totals': dict(aggregate['totals']),
+            'duration_buckets': list(aggregate['duration_buckets']),
+            'queries_buckets': list(aggregate['queries_buckets']),
+        } for key, aggregate in _aggregates.items()}
+    pid = os.getpid()
+    # a snapshot outlives its process by a while, so that rate() spans its last flush
+    timeout = max(flushInterval() * 100, 3600)
+    cache.set(snapshotKey(pid), snapshot, timeout)
+    pids = cache.get(PIDS_KEY) or set()
+    if pid not in pids:
+        cache.set(PIDS_KEY, pids | {pid}, None)
+
+
+def merged():
+    """" the aggregates of every worker process, summed """
+    flush(force=True)
+    pids = cache.get(PIDS_KEY) or set()
+    snapshots = cache.get_many([snapshotKey(pid) for pid in pids])
+    expired = {pid for pid in pids if snapshotKey(pid) not in snapshots}
+    if expired:
+        # processes gone for longer than their snapshots last, their pids would pile up
+        cache.set(PIDS_KEY, (cache.get(PIDS_KEY) or set()) - expired, None)
+    total = {}
+    for snapshot in snapshots.values():
+        for key, aggregate in snapshot.items():
+            into = total.setdefault(key, {
+                'totals': Counter(),
+                'duration_buckets': [0] * len(DURATION_BUCKETS),
+                'queries_buckets': [0] * len(QUERIES_BUCKETS),
+            })
+            into['totals'].update(aggregate['totals'])
+            for name in ('duration_buckets', 'queries_buckets'):
+                into[name] = [a + b for a, b in zip(into[name], aggregate[name])]
+    return total
+
+
+def exposition(aggregates):
+    """" Prometheus text format of `aggregates` (see merged) """
+    counters = (
+        ('requests', 'requests_total', 'Requests handled'),
+        ('errors', 'request_errors_total', 'Requests answered with a 5xx'),
+        ('db_seconds', 'request_db_seconds_total', 'Time spent in database queries'),
+        ('queries', 'request_queries_total', 'Database queries run'),
+        ('duplicate_queries', 'request_duplicate_queries_total', 'Queries whose SQL already ran in the same request'),
+        ('serializer_seconds', 'request_serializer_seconds_total', 'Time spent serializing responses'),
+        ('connection_wait_seconds', 'request_db_connection_wait_seconds_total', 'Time spent waiting for a database connection'),
+        ('connections_opened', 'request_db_connections_opened_total', 'Database connections opened (not taken from the pool)'),
+        ('response_bytes', 'response_bytes_total', 'Response body bytes'),
+    )
+    histograms = (
+        ('duration_buckets', 'wall_seconds', 'request_duration_seconds', 'Request wall time', DURATION_BUCKETS),
+        ('queries_buckets', 'queries', 'request_queries', 'Database queries per request', QUERIES_BUCKETS),
+    )
+
+    def labels(view, method, **extra):
+        pairs = [('view', view), ('method', method)] + sorted(extra.items())
+        return '{%s}' % ','.join('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"')) for name, value in pairs)
+
+    keys = sorted(aggregates)
+    lines = []
+    for field, name, help in counters:
+        lines += ['# HELP %s_%s %s' % (PREFIX, name, help), '# TYPE %s_%s counter' % (PREFIX, name)]
+        lines += ['%s_%s%s %s' % (PREFIX, name, labels(*key), aggregates[key]['totals'].get(field, 0)) for key in keys]
+    for field, sumField, name, help, buckets in histograms:
+        lines += ['# HELP %s_%s %s' % (PREFIX, name, help), '# TYPE %s_%s histogram' % (PREFIX, name)]
+        for key in keys:
+            aggregate = aggregates[key]
+            for bound, count in zip(buckets, aggregate[field]):
+                lines.append('%s_%s_bucket%s %s' % (PREFIX, name, labels(*key, le=bound), count))
+            lines.append('%s_%s_bucket%s %s' % (PREFIX, name, labels(*key, le='+Inf'), aggregate['totals']['requests']))
+            lines.append('%s_%s_sum%s %s' % (PREFIX, name, labels(*key), aggregate['totals'][sumField]))
+            lines.append('%s_%s_count%s %s' % (PREFIX, name, labels(*key), aggregate['totals']['requests']))
+    return '\n'.join(lines) + '\n'
+
+
+def metricsView(request):
+    """" GET /metrics/, with "Authorization: Bearer <settings.METRICS_TOKEN>", open to all only in DEBUG without a token """
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    if not token and not settings.DEBUG:
+        return HttpResponseForbidden()
+    if token and not constant_time_compare(request.META.get('HTTP_AUTHORIZATION', ''), 'Bearer %s' % token):
+        return HttpResponseForbidden()
+    return HttpResponse(exposition(merged()), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@contextmanager
+def recording(recorder):
+    """" records the queries run in its block, on every connection of this thread, in `recorder` """
+    _local.recorder = recorder
+    try:
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder.recordQuery))
+            yield
+    finally:
+        _local.recorder = None
+
+
+class MetricsMiddleware(object):
+    """
+    Records the metrics of every request (see module docstring), and adds them as a
+    Server-Timing header when settings.METRICS_SERVER_TIMING is on. A streamed response
+    (see toolbox_app.streaming) is recorded once its last chunk is sent, with the queries
+    run and the bytes sent while streaming; its Server-Timing header only covers the view.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = RequestRecorder()
+        start = time.perf_counter()
+        with recording(recorder):
+            response = self.get_response(request)
+        wallTime = time.perf_counter() - start
+
+        label = (viewLabel(request), request.method, response.status_code)
+        if response.streaming and getattr(response, 'file_to_stream', None) is None:
+            # files (FileResponse) keep their file_to_stream, sent by the wsgi.file_wrapper
+            response.streaming_content = self.streamed(label, response.streaming_content, recorder, start)
+        else:
+            size = len(response.content) if not response.streaming else int(response.get('Content-Length', 0))
+            self.record(label, recorder, wallTime, size)
+
+        if getattr(settings, 'METRICS_SERVER_TIMING', False):
+            response['Server-Timing'] = ', '.join((
+                'db;dur=%.1f;desc="%s queries, %s duplicate"' % (recorder.dbTime * 1000, recorder.queries, recorder.duplicates),
+                'serializer;dur=%.1f' % (recorder.serializerTime * 1000),
+                'dbconnect;dur=%.1f;desc="%s opened"' % (recorder.connectionWait * 1000, recorder.connectionsOpened),
+                'total;dur=%.1f' % (wallTime * 1000),
+            ))
+        return response
+
+    def streamed(self, label, content, recorder, start):
+        """" `content`, a streaming_content recorded under `label` once it is sent (or abandoned) """
+        # nothing here refers to the response, whose streaming_content this becomes: an
+        # abandoned stream is then closed (and recorded) as soon as the response is freed
+        content = iter(content)
+        size = 0
+        try:
+            while True:
+                # recording only while a chunk is generated, not between two of them
+                with recording(recorder):
+                    chunk = next(content, None)
+                if chunk is None:
+                    return
+                size += len(chunk)
+                yield chunk
+        finally:
+            self.record(label, recorder, time.perf_counter() - start, size)
+
+    def record(self, label, recorder, wallTime, size):
+        record(*label, wallTime, recorder, size)
+        flush()
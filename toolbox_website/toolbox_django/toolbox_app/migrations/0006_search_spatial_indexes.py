@@ -0,0 +1,21 @@
+# Generated by Django 3.0.3 on 2026-10-17 17:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('toolbox_app', '0005_remove_persons_is_authenticated'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='groups',
+            index=models.Index(fields=['groupType', 'groupRange'], name='groups_type_range_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='towns',
+            index=models.Index(fields=['lat', 'lng'], name='towns_lat_lng_idx'),
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 3.0.3 on 2026-10-17 18:01
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.operations
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+# Tools."searchVector" is computed by postgres on every insert and on every
+# update of toolName/toolDescription, existing rows are backfilled.
+SEARCH_VECTOR_TRIGGER = '''
+CREATE FUNCTION tools_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    NEW."searchVector" :=
+        setweight(to_tsvector('simple', coalesce(NEW."toolName", '')), 'A') ||
+        setweight(to_tsvector('simple', coalesce(NEW."toolDescription", '')), 'B');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER tools_search_vector_trigger
+    BEFORE INSERT OR UPDATE OF "toolName", "toolDescription" ON "Tools"
+    FOR EACH ROW EXECUTE PROCEDURE tools_search_vector_update();
+
+UPDATE "Tools" SET "toolName" = "toolName";
+'''
+
+DROP_SEARCH_VECTOR_TRIGGER = '''
+DROP TRIGGER IF EXISTS tools_search_vector_trigger ON "Tools";
+DROP FUNCTION IF EXISTS tools_search_vector_update();
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('toolbox_app', '0006_search_spatial_indexes'),
+    ]
+
+    operations = [
+        django.contrib.postgres.operations.TrigramExtension(),
+        migrations.AddField(
+            model_name='tools',
+            name='searchVector',
+            field=django.contrib.postgres.search.SearchVectorField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='tools',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['searchVector'], name='tools_search_vector_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tools',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['toolName'], name='tools_name_trgm_idx', opclasses=['gin_trgm_ops']),
+        ),
+        migrations.RunSQL(SEARCH_VECTOR_TRIGGER, DROP_SEARCH_VECTOR_TRIGGER),
+    ]
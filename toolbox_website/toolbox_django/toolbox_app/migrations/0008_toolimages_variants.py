@@ -0,0 +1,28 @@
+# Generated by Django 3.0.3 on 2026-10-17 18:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('toolbox_app', '0007_tools_search_vector'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='toolimages',
+            name='medium',
+            field=models.ImageField(blank=True, editable=False, null=True, upload_to='toolsImgs/variants'),
+        ),
+        migrations.AddField(
+            model_name='toolimages',
+            name='thumbnail',
+            field=models.ImageField(blank=True, editable=False, null=True, upload_to='toolsImgs/variants'),
+        ),
+        migrations.AddField(
+            model_name='toolimages',
+            name='webp',
+            field=models.ImageField(blank=True, editable=False, null=True, upload_to='toolsImgs/variants'),
+        ),
+    ]
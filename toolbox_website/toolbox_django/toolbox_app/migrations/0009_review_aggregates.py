@@ -0,0 +1,102 @@
+# Generated by Django 3.0.3 on 2026-10-17 18:05
+
+import django.contrib.postgres.fields
+from django.db import migrations, models
+import toolbox_app.models
+
+
+# The review aggregates of "Tools" / "Persons" are maintained by postgres on every
+# insert, update and delete of their reviews. Columns get db defaults so that plain
+# SQL inserts (DB/data/data.sql) keep working, existing reviews are backfilled.
+REVIEW_AGGREGATES_SQL = '''
+ALTER TABLE "{parent}"
+    ALTER COLUMN "reviewCount" SET DEFAULT 0,
+    ALTER COLUMN "reviewStarsSum" SET DEFAULT 0,
+    ALTER COLUMN "reviewStarsHistogram" SET DEFAULT array_fill(0, ARRAY[11]);
+
+CREATE FUNCTION {name}_update() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        UPDATE "{parent}" SET
+            "reviewCount" = "reviewCount" - 1,
+            "reviewStarsSum" = "reviewStarsSum" - OLD.stars,
+            "reviewStarsHistogram"[OLD.stars + 1] = "reviewStarsHistogram"[OLD.stars + 1] - 1
+        WHERE {key} = OLD.{key};
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        UPDATE "{parent}" SET
+            "reviewCount" = "reviewCount" + 1,
+            "reviewStarsSum" = "reviewStarsSum" + NEW.stars,
+            "reviewStarsHistogram"[NEW.stars + 1] = "reviewStarsHistogram"[NEW.stars + 1] + 1
+        WHERE {key} = NEW.{key};
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER {name}_trigger
+    AFTER INSERT OR DELETE OR UPDATE OF stars, {key} ON "{reviews}"
+    FOR EACH ROW EXECUTE PROCEDURE {name}_update();
+
+UPDATE "{parent}" p SET
+    "reviewCount" = (SELECT count(*) FROM "{reviews}" r WHERE r.{key} = p.{key}),
+    "reviewStarsSum" = (SELECT coalesce(sum(r.stars), 0) FROM "{reviews}" r WHERE r.{key} = p.{key}),
+    "reviewStarsHistogram" = ARRAY(
+        SELECT count(r.stars)
+        FROM generate_series(0, 10) AS s(stars)
+        LEFT JOIN "{reviews}" r ON (r.stars = s.stars AND r.{key} = p.{key})
+        GROUP BY s.stars
+        ORDER BY s.stars
+    )
+WHERE EXISTS (SELECT 1 FROM "{reviews}" r WHERE r.{key} = p.{key});
+'''
+
+DROP_REVIEW_AGGREGATES_SQL = '''
+DROP TRIGGER IF EXISTS {name}_trigger ON "{reviews}";
+DROP FUNCTION IF EXISTS {name}_update();
+'''
+
+TOOLS = {'parent': 'Tools', 'reviews': 'ToolReviews', 'key': 'id_tool', 'name': 'tool_reviews_aggregates'}
+PERSONS = {'parent': 'Persons', 'reviews': 'PersonReviews', 'key': 'id_person', 'name': 'person_reviews_aggregates'}
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('toolbox_app', '0008_toolimages_variants'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='persons',
+            name='reviewCount',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='persons',
+            name='reviewStarsHistogram',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(), default=toolbox_app.models.emptyStarsHistogram, editable=False, size=11),
+        ),
+        migrations.AddField(
+            model_name='persons',
+            name='reviewStarsSum',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='tools',
+            name='reviewCount',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='tools',
+            name='reviewStarsHistogram',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(), default=toolbox_app.models.emptyStarsHistogram, editable=False, size=11),
+        ),
+        migrations.AddField(
+            model_name='tools',
+            name='reviewStarsSum',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.RunSQL(REVIEW_AGGREGATES_SQL.format(**TOOLS), DROP_REVIEW_AGGREGATES_SQL.format(**TOOLS)),
+        migrations.RunSQL(REVIEW_AGGREGATES_SQL.format(**PERSONS), DROP_REVIEW_AGGREGATES_SQL.format(**PERSONS)),
+    ]
@@ -0,0 +1,77 @@
+# Generated by Django 3.0.3 on 2026-10-17 18:08
+
+from math import cos, floor, radians, sin
+
+from django.db import migrations, models
+
+GEO_FIELDS = ('latRad', 'lngRad', 'unitX', 'unitY', 'unitZ', 'geoCell')
+BATCH_SIZE = 1000
+
+
+# frozen copy of the formulas of toolbox_app.geo at the time of this migration
+def geoFields(lat, lng):
+    latRad, lngRad = radians(lat), radians(lng)
+    return {
+        'latRad': latRad,
+        'lngRad': lngRad,
+        'unitX': cos(latRad) * cos(lngRad),
+        'unitY': cos(latRad) * sin(lngRad),
+        'unitZ': sin(latRad),
+        # 1 degree cells, 180 rows of 360 columns
+        'geoCell': min(int(floor(lat + 90)), 179) * 360 + int(floor(lng + 180)) % 360,
+    }
+
+
+def backfillTownsGeo(apps, schema_editor):
+    Towns = apps.get_model('toolbox_app', 'Towns')
+    batch = []
+    for town in Towns.objects.order_by('id_town').iterator(chunk_size=BATCH_SIZE):
+        for name, value in geoFields(town.lat, town.lng).items():
+            setattr(town, name, value)
+        batch.append(town)
+        if len(batch) == BATCH_SIZE:
+            Towns.objects.bulk_update(batch, GEO_FIELDS)
+            batch = []
+    if batch:
+        Towns.objects.bulk_update(batch, GEO_FIELDS)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('toolbox_app', '0009_review_aggregates'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='towns',
+            name='geoCell',
+            field=models.IntegerField(blank=True, db_index=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='towns',
+            name='latRad',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='towns',
+            name='lngRad',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='towns',
+            name='unitX',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='towns',
+            name='unitY',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='towns',
+            name='unitZ',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(backfillTownsGeo, migrations.RunPython.noop),
+    ]
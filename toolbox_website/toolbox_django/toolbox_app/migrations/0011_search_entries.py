@@ -0,0 +1,161 @@
+# Generated by Django 3.0.3 on 2026-10-17 18:10
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# "SearchEntries" is refreshed incrementally, per group and/or tool, by triggers on
+# every table it is derived from, then filled from the existing rows.
+SEARCH_ENTRIES_SQL = '''
+CREATE FUNCTION search_entries_refresh(p_group varchar, p_tool integer) RETURNS void AS $$
+BEGIN
+    DELETE FROM "SearchEntries"
+    WHERE (p_group IS NULL OR "id_groupName" = p_group)
+    AND (p_tool IS NULL OR id_tool = p_tool);
+
+    INSERT INTO "SearchEntries" ("id_groupName", id_tool, "toolName", "searchVector", "groupRange", "geoCell", "unitX", "unitY", "unitZ")
+    SELECT g."id_groupName", t.id_tool, lower(t."toolName"), t."searchVector", g."groupRange", tw."geoCell", tw."unitX", tw."unitY", tw."unitZ"
+    FROM "ToolsGroups" tg
+    JOIN "Groups" g ON (g."id_groupName" = tg."id_groupName")
+    JOIN "Towns" tw ON (tw.id_town = g.id_town)
+    JOIN "Tools" t ON (t.id_tool = tg.id_tool)
+    WHERE g."groupType" = 'public'
+    AND (p_group IS NULL OR g."id_groupName" = p_group)
+    AND (p_tool IS NULL OR t.id_tool = p_tool);
+END
+$$ LANGUAGE plpgsql;
+
+CREATE FUNCTION search_entries_tools_groups_changed() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM search_entries_refresh(OLD."id_groupName", OLD.id_tool);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM search_entries_refresh(NEW."id_groupName", NEW.id_tool);
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE FUNCTION search_entries_groups_changed() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM search_entries_refresh(OLD."id_groupName", NULL);
+    END IF;
+    IF TG_OP = 'UPDATE' AND NEW."id_groupName" <> OLD."id_groupName" THEN
+        PERFORM search_entries_refresh(NEW."id_groupName", NULL);
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE FUNCTION search_entries_tools_changed() RETURNS trigger AS $$
+BEGIN
+    PERFORM search_entries_refresh(NULL, OLD.id_tool);
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE FUNCTION search_entries_towns_changed() RETURNS trigger AS $$
+BEGIN
+    PERFORM search_entries_refresh(g."id_groupName", NULL)
+    FROM "Groups" g
+    WHERE g.id_town = NEW.id_town;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER search_entries_tools_groups_trigger
+    AFTER INSERT OR DELETE OR UPDATE ON "ToolsGroups"
+    FOR EACH ROW EXECUTE PROCEDURE search_entries_tools_groups_changed();
+
+CREATE TRIGGER search_entries_groups_trigger
+    AFTER DELETE OR UPDATE OF "id_groupName", "groupType", "groupRange", id_town ON "Groups"
+    FOR EACH ROW EXECUTE PROCEDURE search_entries_groups_changed();
+
+CREATE TRIGGER search_entries_tools_trigger
+    AFTER DELETE OR UPDATE OF "toolName", "toolDescription" ON "Tools"
+    FOR EACH ROW EXECUTE PROCEDURE search_entries_tools_changed();
+
+CREATE TRIGGER search_entries_towns_trigger
+    AFTER UPDATE OF "geoCell", "unitX", "unitY", "unitZ" ON "Towns"
+    FOR EACH ROW EXECUTE PROCEDURE search_entries_towns_changed();
+
+SELECT search_entries_refresh(NULL, NULL);
+'''
+
+DROP_SEARCH_ENTRIES_SQL = '''
+DROP TRIGGER IF EXISTS search_entries_tools_groups_trigger ON "ToolsGroups";
+DROP TRIGGER IF EXISTS search_entries_groups_trigger ON "Groups";
+DROP TRIGGER IF EXISTS search_entries_tools_trigger ON "Tools";
+DROP TRIGGER IF EXISTS search_entries_towns_trigger ON "Towns";
+DROP FUNCTION IF EXISTS search_entries_tools_groups_changed();
+DROP FUNCTION IF EXISTS search_entries_groups_changed();
+DROP FUNCTION IF EXISTS search_entries_tools_changed();
+DROP FUNCTION IF EXISTS search_entries_towns_changed();
+DROP FUNCTION IF EXISTS search_entries_refresh(varchar, integer);
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('toolbox_app', '0010_towns_geo'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchEntries',
+            fields=[
+                ('id_searchEntry', models.AutoField(primary_key=True, serialize=False)),
+                ('toolName', models.CharField(max_length=30)),
+                ('searchVector', django.contrib.postgres.search.SearchVectorField(blank=True, null=True)),
+                ('groupRange', models.IntegerField()),
+                ('geoCell', models.IntegerField(blank=True, null=True)),
+                ('unitX', models.FloatField(blank=True, null=True)),
+                ('unitY', models.FloatField(blank=True, null=True)),
+                ('unitZ', models.FloatField(blank=True, null=True)),
+            ],
+            options={
+                'db_table': 'SearchEntries',
+                'managed': True,
+            },
+        ),
+        migrations.RemoveIndex(
+            model_name='tools',
+            name='tools_search_vector_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='tools',
+            name='tools_name_trgm_idx',
+        ),
+        migrations.AddField(
+            model_name='searchentries',
+            name='id_groupName',
+            field=models.ForeignKey(db_column='id_groupName', on_delete=django.db.models.deletion.DO_NOTHING, to='toolbox_app.Groups'),
+        ),
+        migrations.AddField(
+            model_name='searchentries',
+            name='id_tool',
+            field=models.ForeignKey(db_column='id_tool', on_delete=django.db.models.deletion.DO_NOTHING, to='toolbox_app.Tools'),
+        ),
+        migrations.AddIndex(
+            model_name='searchentries',
+            index=models.Index(fields=['geoCell'], name='search_entries_cell_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='searchentries',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['searchVector'], name='search_entries_vector_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='searchentries',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['toolName'], name='search_entries_name_trgm_idx', opclasses=['gin_trgm_ops']),
+        ),
+        migrations.AlterUniqueTogether(
+            name='searchentries',
+            unique_together={('id_groupName', 'id_tool')},
+        ),
+        migrations.RunSQL(SEARCH_ENTRIES_SQL, DROP_SEARCH_ENTRIES_SQL),
+    ]
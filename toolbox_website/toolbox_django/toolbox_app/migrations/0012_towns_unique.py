@@ -0,0 +1,36 @@
+# Generated by Django 3.0.3 on 2026-10-17 18:15
+
+from django.db import migrations
+
+# POST /api/towns/ used to accept duplicates: every duplicated town is merged into its
+# oldest row (lowest id_town), the persons and groups of the others are moved to it
+DUPLICATES = """
+    SELECT id_town, MIN(id_town) OVER (PARTITION BY "postCode", "townName", "id_countryCode") AS keep
+    FROM "Towns"
+"""
+
+MERGE_DUPLICATE_TOWNS = """
+UPDATE "PersonsTowns" pt SET id_town = dup.keep
+FROM ({duplicates}) dup WHERE pt.id_town = dup.id_town AND dup.id_town <> dup.keep;
+
+UPDATE "Groups" g SET id_town = dup.keep
+FROM ({duplicates}) dup WHERE g.id_town = dup.id_town AND dup.id_town <> dup.keep;
+
+DELETE FROM "Towns" t
+USING ({duplicates}) dup WHERE t.id_town = dup.id_town AND dup.id_town <> dup.keep;
+""".format(duplicates=DUPLICATES)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('toolbox_app', '0011_search_entries'),
+    ]
+
+    operations = [
+        migrations.RunSQL(MERGE_DUPLICATE_TOWNS, migrations.RunSQL.noop),
+        migrations.AlterUniqueTogether(
+            name='towns',
+            unique_together={('postCode', 'townName', 'id_countryCode')},
+        ),
+    ]
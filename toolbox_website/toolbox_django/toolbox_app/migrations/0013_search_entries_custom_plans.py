@@ -0,0 +1,20 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    """
+    search_entries_refresh() filters on `p_group IS NULL OR ... = p_group`: once plpgsql switches
+    to a generic plan, these conditions can't use any index and every trigger call scans and
+    joins the whole search tables. Custom plans fold the NULL checks and use the indexes.
+    """
+
+    dependencies = [
+        ('toolbox_app', '0012_towns_unique'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            'ALTER FUNCTION search_entries_refresh(varchar, integer) SET plan_cache_mode = force_custom_plan',
+            'ALTER FUNCTION search_entries_refresh(varchar, integer) RESET plan_cache_mode',
+        ),
+    ]
@@ -0,0 +1,47 @@
+from django.db import migrations
+
+
+# The geo columns of "Towns" are derived from lat / lng by the database, as "SearchEntries"
+# is (see 0011), so that every write path (save(), bulk_create(), update(), raw SQL, the
+# upserts of import_towns) keeps them right. Same formulas as toolbox_app.geo, whose
+# geoCell() uses 1 degree cells: 180 rows of 360 columns.
+TOWNS_GEO_SQL = '''
+CREATE FUNCTION towns_geo_columns() RETURNS trigger AS $$
+BEGIN
+    NEW."latRad" := radians(NEW.lat);
+    NEW."lngRad" := radians(NEW.lng);
+    NEW."unitX" := cos(NEW."latRad") * cos(NEW."lngRad");
+    NEW."unitY" := cos(NEW."latRad") * sin(NEW."lngRad");
+    NEW."unitZ" := sin(NEW."latRad");
+    NEW."geoCell" := least(floor(NEW.lat + 90)::integer, 179) * 360 + mod(mod(floor(NEW.lng + 180)::integer, 360) + 360, 360);
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER towns_geo_trigger
+    BEFORE INSERT OR UPDATE OF lat, lng, "latRad", "lngRad", "unitX", "unitY", "unitZ", "geoCell" ON "Towns"
+    FOR EACH ROW EXECUTE PROCEDURE towns_geo_columns();
+
+UPDATE "Towns" SET lat = lat WHERE "geoCell" IS NULL;
+'''
+
+DROP_TOWNS_GEO_SQL = '''
+DROP TRIGGER IF EXISTS towns_geo_trigger ON "Towns";
+DROP FUNCTION IF EXISTS towns_geo_columns();
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('toolbox_app', '0013_search_entries_custom_plans'),
+    ]
+
+    operations = [
+        # the radius searches filter on "geoCell", nothing reads lat / lng ranges
+        migrations.RemoveIndex(
+            model_name='towns',
+            name='towns_lat_lng_idx',
+        ),
+        migrations.RunSQL(TOWNS_GEO_SQL, DROP_TOWNS_GEO_SQL),
+    ]
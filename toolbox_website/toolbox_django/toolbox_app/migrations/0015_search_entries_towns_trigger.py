@@ -0,0 +1,34 @@
+from django.db import migrations
+
+
+# An UPDATE OF trigger fires on the columns of the SET list, never on the ones a BEFORE
+# trigger changes: since 0014 computes the geo columns, an update of lat / lng alone (the
+# upserts of import_towns, QuerySet.update()) has to be what refreshes "SearchEntries".
+TOWNS_TRIGGER_SQL = '''
+DROP TRIGGER search_entries_towns_trigger ON "Towns";
+
+CREATE TRIGGER search_entries_towns_trigger
+    AFTER UPDATE OF lat, lng ON "Towns"
+    FOR EACH ROW
+    WHEN ((OLD.lat, OLD.lng, OLD."geoCell") IS DISTINCT FROM (NEW.lat, NEW.lng, NEW."geoCell"))
+    EXECUTE PROCEDURE search_entries_towns_changed();
+'''
+
+PREVIOUS_TOWNS_TRIGGER_SQL = '''
+DROP TRIGGER search_entries_towns_trigger ON "Towns";
+
+CREATE TRIGGER search_entries_towns_trigger
+    AFTER UPDATE OF "geoCell", "unitX", "unitY", "unitZ" ON "Towns"
+    FOR EACH ROW EXECUTE PROCEDURE search_entries_towns_changed();
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('toolbox_app', '0014_towns_geo_trigger'),
+    ]
+
+    operations = [
+        migrations.RunSQL(TOWNS_TRIGGER_SQL, PREVIOUS_TOWNS_TRIGGER_SQL),
+    ]
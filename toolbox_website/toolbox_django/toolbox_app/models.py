@@ -1,6 +1,47 @@
+from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
 from django.core.validators import MaxValueValidator, MinValueValidator
 
+from .images import makeVariants
+
+MAX_STARS = 10
+
+
+def emptyStarsHistogram():
+    return [0] * (MAX_STARS + 1)
+
+
+class ReviewAggregates(models.Model):
+    """
+    Denormalized summary of the reviews of a row, kept up to date by db triggers
+    on the reviews table (see migration 0009). reviewStarsHistogram[n] counts the n stars reviews.
+    """
+    reviewCount = models.IntegerField(default=0, editable=False)
+    reviewStarsSum = models.IntegerField(default=0, editable=False)
+    reviewStarsHistogram = ArrayField(models.IntegerField(), size=MAX_STARS + 1, default=emptyStarsHistogram, editable=False)
+
+    AGGREGATE_FIELDS = ('reviewCount', 'reviewStarsSum', 'reviewStarsHistogram')
+
+    def save(self, *args, **kwargs):
+        # updates must not write back (possibly stale) aggregates over the triggers' values
+        if not self._state.adding and not args and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.AGGREGATE_FIELDS
+            ]
+        super().save(*args, **kwargs)
+
+    @property
+    def reviewAverage(self):
+        if not self.reviewCount:
+            return None
+        return self.reviewStarsSum / self.reviewCount
+
+    class Meta:
+        abstract = True
+
 class Countries(models.Model):
     id_countryCode = models.CharField(primary_key=True, max_length=5)
     countryName = models.CharField(max_length=30)
@@ -21,6 +62,9 @@ class Groups(models.Model):
     class Meta:
         managed = True
         db_table = 'Groups'
+        indexes = [
+            models.Index(fields=['groupType', 'groupRange'], name='groups_type_range_idx'),
+        ]
     
 
 
@@ -40,7 +84,7 @@ class GroupsMembers(models.Model):
 class PersonReviews(models.Model):
     id_personReview = models.AutoField(primary_key=True)
     id_person = models.ForeignKey('Persons', models.DO_NOTHING, db_column='id_person')
-    stars = models.IntegerField(validators=[MaxValueValidator(10), MinValueValidator(0)])
+    stars = models.IntegerField(validators=[MaxValueValidator(MAX_STARS), MinValueValidator(0)])
     comment = models.TextField(blank=True, null=True)
 
     class Meta:
@@ -49,7 +93,7 @@ class PersonReviews(models.Model):
 
 
 
-class Persons(models.Model):
+class Persons(ReviewAggregates):
     id_person = models.AutoField(primary_key=True)
     lastName = models.CharField(max_length=150)
     firstName = models.CharField(max_length=100)
@@ -84,7 +128,7 @@ class PersonsTowns(models.Model):
 class ToolReviews(models.Model):
     id_toolReview = models.AutoField(primary_key=True)
     id_tool = models.ForeignKey('Tools', models.DO_NOTHING, db_column='id_tool')
-    stars = models.IntegerField(validators=[MaxValueValidator(10), MinValueValidator(0)])
+    stars = models.IntegerField(validators=[MaxValueValidator(MAX_STARS), MinValueValidator(0)])
     comment = models.TextField(blank=True, null=True)
 
     class Meta:
@@ -93,12 +137,15 @@ class ToolReviews(models.Model):
 
 
 
-class Tools(models.Model):
+class Tools(ReviewAggregates):
     id_tool = models.AutoField(primary_key=True)
     id_person = models.ForeignKey(Persons, models.DO_NOTHING, db_column='id_person')
     toolName = models.CharField(max_length=30)
     toolDescription = models.TextField(blank=True, null=True)
     toolPrice = models.DecimalField(max_digits=8, decimal_places=2, blank=True, null=True)
+    # weighted tsvector of toolName (A) and toolDescription (B), kept up to date by a db trigger (see migration 0007),
+    # searched through its copy in SearchEntries
+    searchVector = SearchVectorField(blank=True, null=True, editable=False)
 
     def __repr__(self):
         return "" + toolName
@@ -111,6 +158,15 @@ class ToolImages(models.Model):
     id_toolImage = models.AutoField(primary_key=True)
     id_tool = models.ForeignKey(Tools, models.DO_NOTHING, db_column='id_tool')
     image = models.ImageField(upload_to='toolsImgs')
+    # resized / re-encoded copies of image, generated on upload (see images.py)
+    thumbnail = models.ImageField(upload_to='toolsImgs/variants', blank=True, null=True, editable=False)
+    medium = models.ImageField(upload_to='toolsImgs/variants', blank=True, null=True, editable=False)
+    webp = models.ImageField(upload_to='toolsImgs/variants', blank=True, null=True, editable=False)
+
+    def save(self, *args, **kwargs):
+        if self.image and not self.thumbnail:
+            makeVariants(self)
+        super().save(*args, **kwargs)
 
     class Meta:
         managed = True
@@ -137,7 +193,45 @@ class Towns(models.Model):
     lat = models.FloatField()
     lng = models.FloatField()
     id_countryCode = models.ForeignKey(Countries, models.DO_NOTHING, db_column='id_countryCode')
+    # derived from lat/lng by a db trigger on every insert / update (see migration 0014 and geo.py)
+    latRad = models.FloatField(blank=True, null=True, editable=False)
+    lngRad = models.FloatField(blank=True, null=True, editable=False)
+    unitX = models.FloatField(blank=True, null=True, editable=False)
+    unitY = models.FloatField(blank=True, null=True, editable=False)
+    unitZ = models.FloatField(blank=True, null=True, editable=False)
+    geoCell = models.IntegerField(blank=True, null=True, editable=False, db_index=True)
 
     class Meta:
         managed = True
         db_table = 'Towns'
+        # key of the towns imported by `manage.py import_towns`
+        unique_together = (('postCode', 'townName', 'id_countryCode'),)
+
+
+
+class SearchEntries(models.Model):
+    """
+    Materialized search relation: one row per (public group, tool) pair with what
+    /api/search/ filters on. Maintained by db triggers on ToolsGroups, Groups, Tools
+    and Towns (see migration 0011), never written by the application.
+    """
+    id_searchEntry = models.AutoField(primary_key=True)
+    id_groupName = models.ForeignKey(Groups, models.DO_NOTHING, db_column='id_groupName')
+    id_tool = models.ForeignKey(Tools, models.DO_NOTHING, db_column='id_tool')
+    toolName = models.CharField(max_length=30) # lower case
+    searchVector = SearchVectorField(blank=True, null=True)
+    groupRange = models.IntegerField()
+    geoCell = models.IntegerField(blank=True, null=True)
+    unitX = models.FloatField(blank=True, null=True)
+    unitY = models.FloatField(blank=True, null=True)
+    unitZ = models.FloatField(blank=True, null=True)
+
+    class Meta:
+        managed = True
+        db_table = 'SearchEntries'
+        unique_together = (('id_groupName', 'id_tool'),)
+        indexes = [
+            models.Index(fields=['geoCell'], name='search_entries_cell_idx'),
+            GinIndex(fields=['searchVector'], name='search_entries_vector_idx'),
+            GinIndex(fields=['toolName'], name='search_entries_name_trgm_idx', opclasses=['gin_trgm_ops']),
+        ]
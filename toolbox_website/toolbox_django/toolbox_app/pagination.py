@@ -0,0 +1,29 @@
+from rest_framework.pagination import CursorPagination
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Cursor (keyset) pagination over the ordering of the listed queryset.
+    Opt-in: a list is only paginated when the request carries `cursor` or
+    `page_size`, so existing clients still receive a plain JSON array.
+
+    GET 127.0.0.1:8000/api/tools/?page_size=50
+    -> {"next": ".../api/tools/?cursor=cD0xMjM%3D&page_size=50", "previous": null, "results": [...]}
+    """
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if (self.cursor_query_param not in request.query_params and
+                self.page_size_query_param not in request.query_params):
+            return None
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_ordering(self, request, queryset, view):
+        """
+        Pages follow the order_by() of the queryset, defaulting to its primary key.
+        The first field is the keyset; it should be unique or nearly so.
+        """
+        if queryset.query.order_by:
+            return tuple(queryset.query.order_by)
+        return (queryset.model._meta.pk.name,)
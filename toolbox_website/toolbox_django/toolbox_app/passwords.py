@@ -0,0 +1,106 @@
+"""
+bcrypt hashing / verification off the request threads.
+
+bcrypt is CPU bound by design, calling it inline blocks a gunicorn worker for
+hundreds of ms. Calls are run by a small pool of processes per worker, and a
+request is turned away (503 + Retry-After) as soon as PASSWORD_POOL_WORKERS
+calls are running and PASSWORD_POOL_QUEUE more are waiting, so that a burst
+of logins can not starve the other endpoints.
+"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+import bcrypt
+from django.conf import settings
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+HASH_ROUNDS = getattr(settings, 'PASSWORD_HASH_ROUNDS', 12)
+POOL_WORKERS = getattr(settings, 'PASSWORD_POOL_WORKERS', 2)
+POOL_QUEUE = getattr(settings, 'PASSWORD_POOL_QUEUE', 8)
+POOL_TIMEOUT = getattr(settings, 'PASSWORD_POOL_TIMEOUT', 10)
+
+_lock = threading.Lock()
+_pool = None
+_poolPid = None
+_slots = threading.BoundedSemaphore(POOL_WORKERS + POOL_QUEUE)
+
+
+class PasswordPoolSaturated(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Too many sign-in requests, try again shortly.'
+    default_code = 'password_pool_saturated'
+    wait = 1 # seconds, sent as Retry-After
+
+
+def getPool():
+    """
+    The process pool of this worker, created after gunicorn forked it. Its processes
+    are started by a fork server: forking the (multi-threaded) worker itself would copy
+    the locks held by its other threads and its database connections into them.
+    """
+    global _pool, _poolPid
+    with _lock:
+        if _pool is None or _poolPid != os.getpid():
+            _pool = ProcessPoolExecutor(max_workers=POOL_WORKERS, mp_context=multiprocessing.get_context('forkserver'))
+            _poolPid = os.getpid()
+        return _pool
+
+
+def dropPool(pool):
+    """" forgets `pool` once broken (a process of it died), the next call starts a new one """
+    global _pool
+    with _lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False)
+
+
+def submit(pool, function, *args):
+    """" runs function(*args) in `pool`, it holds one of the slots until it is done (or failed) """
+    slots = _slots
+    if not slots.acquire(blocking=False):
+        raise PasswordPoolSaturated()
+    try:
+        future = pool.submit(function, *args)
+    except BaseException:
+        slots.release()
+        raise
+    # a call that timed out still runs (or waits) in the pool, its slot with it
+    future.add_done_callback(lambda future: slots.release())
+    return future
+
+
+def run(function, *args):
+    if POOL_WORKERS == 0: # inline, e.g. for local development
+        if not _slots.acquire(blocking=False):
+            raise PasswordPoolSaturated()
+        try:
+            return function(*args)
+        finally:
+            _slots.release()
+
+    for attempt in range(2):
+        pool = getPool()
+        try:
+            return submit(pool, function, *args).result(timeout=POOL_TIMEOUT)
+        except TimeoutError:
+            raise PasswordPoolSaturated()
+        except BrokenProcessPool:
+            dropPool(pool)
+            if attempt:
+                raise
+
+
+def hashPassword(password):
+    """" returns the bcrypt hash (str) of `password` """
+    hashed = run(bcrypt.hashpw, password.encode('utf8'), bcrypt.gensalt(HASH_ROUNDS))
+    return hashed.decode('utf8')
+
+
+def checkPassword(password, hashed):
+    """" returns True if `password` matches the bcrypt hash `hashed` """
+    return run(bcrypt.checkpw, password.encode('utf8'), hashed.encode('utf8'))
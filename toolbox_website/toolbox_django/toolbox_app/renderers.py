@@ -0,0 +1,64 @@
+"""
+JSON renderer and parser backed by orjson, a drop-in replacement of the rest_framework
+ones (select them in settings.REST_FRAMEWORK). The output is the one of JSONRenderer:
+the types orjson doesn't encode itself, or encodes differently (Decimal, dates, lazy
+strings...), go through the rest_framework encoder, files are rendered as their URL.
+Two differences remain, orjson having no option for them:
+- NaN and Infinity floats are rendered as null, where JSONRenderer raises a ValueError
+  (STRICT_JSON, the default) or writes the non standard NaN / Infinity literals
+- an indented output ("Accept: application/json; indent=4", or the `indent` of the
+  renderer context) always uses 2 spaces, whatever width is asked for
+
+`manage.py benchmark_json` compares the encoding time of both renderers.
+"""
+import orjson
+from django.db.models.fields.files import FieldFile
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+# datetimes are formatted by the rest_framework encoder (millisecond precision, "Z" for UTC)
+OPTIONS = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+
+_encoder = JSONEncoder()
+
+
+def default(obj):
+    """" JSON compatible value of an object orjson can't encode """
+    if isinstance(obj, FieldFile):
+        return obj.url if obj else None
+    return _encoder.default(obj)
+
+
+class ORJSONRenderer(BaseRenderer):
+    media_type = 'application/json'
+    format = 'json'
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        options = OPTIONS
+        if self.indented(accepted_media_type, renderer_context):
+            options |= orjson.OPT_INDENT_2
+        content = orjson.dumps(data, default=default, option=options)
+        # as JSONRenderer, valid in JavaScript strings too
+        return content.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+
+    def indented(self, accepted_media_type, renderer_context):
+        """" whether the client asked for an indented output, rendered with 2 spaces whatever its width """
+        if accepted_media_type and 'indent=' in accepted_media_type:
+            return True
+        return bool((renderer_context or {}).get('indent'))
+
+
+class ORJSONParser(BaseParser):
+    media_type = 'application/json'
+    renderer_class = ORJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return orjson.loads(stream.read())
+        except orjson.JSONDecodeError as exception:
+            raise ParseError('JSON parse error - %s' % exception)
@@ -0,0 +1,69 @@
+import hashlib
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+
+# Cached responses of a namespace are stored under its current generation, the
+# unix time of its last invalidation. Invalidating a namespace starts a new
+# generation, which orphans every response cached so far (they expire on their own).
+RESPONSE_CACHE_TTL = getattr(settings, 'RESPONSE_CACHE_TTL', 3600)
+
+
+def generationKey(namespace):
+    return 'response-generation:%s' % namespace
+
+
+def invalidateResponses(namespace):
+    """" forget every cached response of `namespace` """
+    # generations must grow even when invalidated twice within a second (Last-Modified has 1s resolution)
+    previous = cache.get(generationKey(namespace), 0)
+    cache.set(generationKey(namespace), max(int(time.time()), previous + 1), None)
+
+
+def cachedResponse(namespace):
+    """
+    Caches the successful responses of a read-only view per full path (query string included)
+    and answers conditional requests (If-None-Match / If-Modified-Since) with a 304
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(self, request, *args, **kwargs):
+            generation = cache.get(generationKey(namespace))
+            if generation is None:
+                generation = int(time.time())
+                cache.add(generationKey(namespace), generation, None)
+
+            path = request.get_full_path()
+            etag = quote_etag(hashlib.md5(('%s:%s' % (generation, path)).encode('utf8')).hexdigest())
+            if notModified(request, etag, generation):
+                response = Response(status=status.HTTP_304_NOT_MODIFIED)
+            else:
+                key = 'response:%s:%s:%s' % (namespace, generation, path)
+                data = cache.get(key)
+                if data is None:
+                    response = view(self, request, *args, **kwargs)
+                    if response.status_code != status.HTTP_200_OK or response.streaming:
+                        return response
+                    cache.set(key, response.data, RESPONSE_CACHE_TTL)
+                else:
+                    response = Response(data)
+
+            response['ETag'] = etag
+            response['Last-Modified'] = http_date(generation)
+            return response
+        return wrapper
+    return decorator
+
+
+def notModified(request, etag, lastModified):
+    ifNoneMatch = request.META.get('HTTP_IF_NONE_MATCH')
+    if ifNoneMatch is not None:
+        return ifNoneMatch.strip() == '*' or etag in [e.strip().replace('W/', '', 1) for e in ifNoneMatch.split(',')]
+
+    ifModifiedSince = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+    return ifModifiedSince is not None and lastModified <= ifModifiedSince
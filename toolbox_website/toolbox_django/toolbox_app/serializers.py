@@ -1,7 +1,208 @@
+from django.core.exceptions import FieldDoesNotExist
 from rest_framework import serializers
 
 from .models import *
 
+
+class EagerLoadingMixin(object):
+    """
+    Lets a serializer declare the related rows it walks, so that the views
+    can load them up-front instead of issuing one query per row.
+    """
+    select_related_fields = ()
+    prefetch_related_fields = ()
+    only_read_columns = False # load only the columns it reads even when the request is not sparse
+
+    @classmethod
+    def setup_eager_loading(cls, queryset, serializer=None):
+        """
+        `serializer`, an instance pruned by sparseFields(), limits the loading to the
+        relations it still walks and the columns it still reads
+        """
+        select, prefetch = cls.select_related_fields, cls.prefetch_related_fields
+        if serializer is not None:
+            select = [path for path in select if walksPath(serializer, path)]
+            prefetch = [path for path in prefetch if walksPath(serializer, path)]
+        if select:
+            queryset = queryset.select_related(*select)
+        if prefetch:
+            queryset = queryset.prefetch_related(*prefetch)
+        if serializer is not None:
+            queryset = onlyReadColumns(queryset, serializer)
+        return queryset
+
+
+def fieldsTree(value):
+    """" parses a `fields` / `expand` query param, "a,b.c,b.d" -> {'a': {}, 'b': {'c': {}, 'd': {}}}, None when absent """
+    if value is None:
+        return None
+    tree = {}
+    for path in value.split(','):
+        node = tree
+        for name in filter(None, path.strip().split('.')):
+            node = node.setdefault(name, {})
+    return tree
+
+
+def isRelation(field):
+    """" nested serializer of other rows (not a source='*' view of the same row) """
+    return isinstance(field, serializers.BaseSerializer) and field.source != '*'
+
+
+def sparseFields(serializer, fields=None, expand=None):
+    """
+    Removes from `serializer` (and the serializers nested in it) the fields not listed
+    in `fields` and the relations not listed in `expand`, both trees from fieldsTree().
+    None keeps everything at that level, as does a name listed without sub-fields.
+    """
+    if isinstance(serializer, serializers.ListSerializer):
+        serializer = serializer.child
+    errors = {}
+    for param, names in (('fields', fields), ('expand', expand)):
+        unknown = sorted(name for name in names or () if name not in serializer.fields)
+        if unknown:
+            errors[param] = "unknown field(s): %s" % ", ".join(unknown)
+    if errors:
+        raise serializers.ValidationError(errors)
+
+    for name, field in list(serializer.fields.items()):
+        if fields is not None and name not in fields or isRelation(field) and expand is not None and name not in expand:
+            serializer.fields.pop(name)
+        elif isinstance(field, serializers.BaseSerializer):
+            sparseFields(field, (fields or {}).get(name) or None, (expand or {}).get(name) or None)
+    return serializer
+
+
+def walksPath(serializer, path):
+    """" whether `serializer` still reads the relation `path` ("id_tool__toolimages_set") """
+    for source in path.split('__'):
+        if isinstance(serializer, serializers.ListSerializer):
+            serializer = serializer.child
+        nested = [field for field in serializer.fields.values() if isRelation(field) and field.source == source]
+        if not nested:
+            return False
+        serializer = nested[0]
+    return True
+
+
+def readColumns(serializer, model, prefix=''):
+    """
+    only() paths of the columns `serializer` reads from `model` rows, following its
+    nested foreign keys, None when a field reads something other than a column
+    """
+    if isinstance(serializer, serializers.ListSerializer):
+        serializer = serializer.child
+    sourceColumns = getattr(serializer, 'source_columns', {})
+    columns = []
+    for field in serializer.fields.values():
+        if field.source == '*':
+            nested = readColumns(field, model, prefix) if isinstance(field, serializers.BaseSerializer) else None
+            if nested is None:
+                return None
+            columns += nested
+            continue
+        if field.source in sourceColumns:
+            columns += [prefix + column for column in sourceColumns[field.source]]
+            continue
+        try:
+            modelField = model._meta.get_field(field.source)
+        except FieldDoesNotExist:
+            if isinstance(field, serializers.ListSerializer):
+                continue # reverse relation, prefetched in its own query
+            return None
+        if modelField.many_to_many or modelField.one_to_many:
+            continue
+        columns.append(prefix + field.source)
+        if isRelation(field):
+            # the related row is read in full when its serializer can't tell its columns
+            columns += readColumns(field, modelField.related_model, prefix + field.source + '__') or []
+    return columns
+
+
+def onlyReadColumns(queryset, serializer):
+    """" `queryset` loading only the columns `serializer` reads, and those the rows are ordered by """
+    columns = readColumns(serializer, queryset.model)
+    if columns is None:
+        return queryset
+    ordering = [name.lstrip('-') for name in queryset.query.order_by if isinstance(name, str) and '__' not in name]
+    return queryset.only(*columns, *ordering)
+
+
+# read as they come out of values() rows / converted by the field, see valuesPlan
+VALUES_IDENTITY_FIELDS = (serializers.CharField, serializers.IntegerField, serializers.FloatField,
+                          serializers.BooleanField, serializers.PrimaryKeyRelatedField)
+VALUES_CONVERTED_FIELDS = (serializers.DecimalField, serializers.DateField, serializers.DateTimeField,
+                           serializers.TimeField, serializers.DurationField, serializers.UUIDField)
+
+
+def valuesPlan(serializer, model, prefix=''):
+    """
+    How to build the output of `serializer` straight from values() rows of `model`, without
+    model instances nor serializer fields: [(key, values() path, converter or None, nested plan
+    or None)]. None when a field needs a model instance (property, method, file, reverse relation)
+    """
+    if isinstance(serializer, serializers.ListSerializer):
+        serializer = serializer.child
+    plan = []
+    for key, field in serializer.fields.items():
+        if field.write_only:
+            continue
+        try:
+            modelField = model._meta.get_field(field.source)
+        except FieldDoesNotExist:
+            return None
+        if not modelField.concrete or modelField.many_to_many:
+            return None
+        path = prefix + field.source
+        if isRelation(field):
+            nested = valuesPlan(field, modelField.related_model, path + '__')
+            if nested is None:
+                return None
+            plan.append((key, path, None, nested))
+        elif isinstance(field, VALUES_IDENTITY_FIELDS):
+            plan.append((key, path, None, None))
+        elif isinstance(field, VALUES_CONVERTED_FIELDS):
+            plan.append((key, path, field.to_representation, None))
+        else:
+            return None
+    return plan
+
+
+def valuesPaths(plan):
+    """" the values() paths `plan` reads """
+    paths = []
+    for key, path, convert, nested in plan:
+        paths.append(path)
+        if nested is not None:
+            paths += valuesPaths(nested)
+    return paths
+
+
+def valuesRow(plan, row):
+    """" output of one values() row, the same as the serializer's """
+    data = {}
+    for key, path, convert, nested in plan:
+        value = row[path]
+        if nested is not None:
+            data[key] = None if value is None else valuesRow(nested, row)
+        elif convert is None or value is None:
+            data[key] = value
+        else:
+            data[key] = convert(value)
+    return data
+
+
+##################################
+### REVIEW RELATED SERIALIZERS ###
+
+class reviewsSummarySerializer(serializers.Serializer):
+    """ precomputed review aggregates of a Tools or Persons row """
+    source_columns = {'reviewAverage': ('reviewCount', 'reviewStarsSum')}
+    count = serializers.IntegerField(source='reviewCount', read_only=True)
+    average = serializers.FloatField(source='reviewAverage', read_only=True)
+    histogram = serializers.ListField(source='reviewStarsHistogram', child=serializers.IntegerField(), read_only=True)
+
+
 ##################################
 ###  TOWNS RELATED SERIALIZERS ###
 
@@ -20,7 +221,8 @@ class personsTownsSerializer(serializers.ModelSerializer):
         model = PersonsTowns
         fields = ('id_person','id_town')
 
-class personsTownsDetailSerializer(serializers.ModelSerializer):
+class personsTownsDetailSerializer(EagerLoadingMixin, serializers.ModelSerializer):
+    select_related_fields = ('id_town',)
     town = townsSerializer(source='id_town',  read_only=True)
     class Meta:
         model = PersonsTowns
@@ -42,20 +244,23 @@ class toolsSerializer(serializers.ModelSerializer):
 class toolImagesSerializer(serializers.ModelSerializer):
     class Meta:
         model = ToolImages
-        fields = ('id_toolImage', 'id_tool', 'image')
+        fields = ('id_toolImage', 'id_tool', 'image', 'thumbnail', 'medium', 'webp')
+        read_only_fields = ('thumbnail', 'medium', 'webp')
 
 class toolReviewsSerializer(serializers.ModelSerializer):
     class Meta:
         model = ToolReviews
         fields = ('id_toolReview', 'id_tool', 'stars','comment')
         
-class toolsDetailSerializer(serializers.ModelSerializer):
+class toolsDetailSerializer(EagerLoadingMixin, serializers.ModelSerializer):
+    prefetch_related_fields = ('toolimages_set', 'toolreviews_set')
     toolImages = toolImagesSerializer(source='toolimages_set', many=True)
     reviews = toolReviewsSerializer(source='toolreviews_set', many=True)
+    reviewsSummary = reviewsSummarySerializer(source='*', read_only=True)
 
     class Meta:
         model = Tools
-        fields =('id_tool','toolName','toolDescription','toolPrice','toolImages', 'reviews')
+        fields =('id_tool','toolName','toolDescription','toolPrice','toolImages', 'reviews', 'reviewsSummary')
 
 
 
@@ -69,9 +274,10 @@ class personReviewsSerializer(serializers.ModelSerializer):
 
 
 class personsSerializer(serializers.ModelSerializer):
+    reviewsSummary = reviewsSummarySerializer(source='*', read_only=True)
     class Meta:
         model = Persons
-        fields = ('id_person', 'lastName', 'firstName', 'alias', 'birthDate', 'email', 'password')
+        fields = ('id_person', 'lastName', 'firstName', 'alias', 'birthDate', 'email', 'password', 'reviewsSummary')
 
 
 class personsLoginSerializer(serializers.ModelSerializer):
@@ -79,14 +285,23 @@ class personsLoginSerializer(serializers.ModelSerializer):
         model = Persons
         fields = ('id_person', 'alias', 'email')
 
-class toolsDetailWithOwnerSerializer(serializers.ModelSerializer):
-    toolOwner = personsLoginSerializer(source='id_person', read_only=True )
+class personsWithReviewsSummarySerializer(serializers.ModelSerializer):
+    reviewsSummary = reviewsSummarySerializer(source='*', read_only=True)
+    class Meta:
+        model = Persons
+        fields = ('id_person', 'alias', 'email', 'reviewsSummary')
+
+class toolsDetailWithOwnerSerializer(EagerLoadingMixin, serializers.ModelSerializer):
+    select_related_fields = ('id_person',)
+    prefetch_related_fields = ('toolimages_set', 'toolreviews_set')
+    toolOwner = personsWithReviewsSummarySerializer(source='id_person', read_only=True )
     toolImages = toolImagesSerializer(source='toolimages_set', many=True)
     reviews = toolReviewsSerializer(source='toolreviews_set', many=True)
+    reviewsSummary = reviewsSummarySerializer(source='*', read_only=True)
 
     class Meta:
         model = Tools
-        fields =('toolOwner', 'id_tool','toolName','toolDescription','toolPrice','toolImages', 'reviews')
+        fields =('toolOwner', 'id_tool','toolName','toolDescription','toolPrice','toolImages', 'reviews', 'reviewsSummary')
 
 class personsLoginGetTokenSerializer(serializers.ModelSerializer):
     token = serializers.SerializerMethodField()
@@ -107,19 +322,40 @@ class groupsSerializer(serializers.ModelSerializer):
         model = Groups
         fields = ('id_groupName', 'groupType', 'groupDescription','groupRange','id_town')
 
-class groupsDetailSerializer(serializers.ModelSerializer):
+class groupsDetailSerializer(EagerLoadingMixin, serializers.ModelSerializer):
+    select_related_fields = ('id_town',)
     town = townsSerializer(source='id_town', read_only=True)
     class Meta:
         model = Groups
         fields = ('id_groupName', 'groupType', 'groupDescription','groupRange','town')
 
+class groupsSearchResultSerializer(groupsDetailSerializer):
+    source_columns = {'distance': ()} # set by the view
+    distance = serializers.FloatField(read_only=True)
+    class Meta(groupsDetailSerializer.Meta):
+        fields = groupsDetailSerializer.Meta.fields + ('distance',)
+
 class groupsMembersSerializer(serializers.ModelSerializer):
     class Meta:
         model = GroupsMembers
         fields = ('id_person','id_groupName','groupAdmin')
 
-class groupsMembersDetailSerializer(serializers.ModelSerializer):
-    member = personsSerializer(source='id_person', read_only=True)
+class groupsMembersBulkSerializer(serializers.Serializer):
+    """ one row of a bulk POST to /api/groups/members/bulk/, foreign keys are checked by the view """
+    model = GroupsMembers
+    foreign_keys = {'id_person': Persons, 'id_groupName': Groups}
+    id_person = serializers.IntegerField()
+    id_groupName = serializers.CharField(max_length=50)
+    groupAdmin = serializers.BooleanField()
+
+class groupsMembersBulkDeleteSerializer(serializers.Serializer):
+    """ members of a bulk DELETE from /api/groups/members/bulk/ """
+    id_person = serializers.ListField(child=serializers.IntegerField(), allow_empty=False)
+
+class groupsMembersDetailSerializer(EagerLoadingMixin, serializers.ModelSerializer):
+    select_related_fields = ('id_person',)
+    only_read_columns = True # the private columns of Persons (password...) are not even read
+    member = personsWithReviewsSummarySerializer(source='id_person', read_only=True)
     class Meta:
         model = GroupsMembers
         fields = ('member','groupAdmin')
@@ -129,19 +365,34 @@ class groupsToolsSerializer(serializers.ModelSerializer):
         model = ToolsGroups
         fields = ('id_tool','id_groupName')
 
-class groupsToolsDetailSerializer(serializers.ModelSerializer):
+class groupsToolsBulkSerializer(serializers.Serializer):
+    """ one row of a bulk POST to /api/groups/tools/bulk/, foreign keys are checked by the view """
+    model = ToolsGroups
+    foreign_keys = {'id_tool': Tools, 'id_groupName': Groups}
+    id_tool = serializers.IntegerField()
+    id_groupName = serializers.CharField(max_length=50)
+
+class groupsToolsBulkDeleteSerializer(serializers.Serializer):
+    """ tools of a bulk DELETE from /api/groups/tools/bulk/ """
+    id_tool = serializers.ListField(child=serializers.IntegerField(), allow_empty=False)
+
+class groupsToolsDetailSerializer(EagerLoadingMixin, serializers.ModelSerializer):
+    select_related_fields = ('id_tool',)
+    prefetch_related_fields = ('id_tool__toolimages_set', 'id_tool__toolreviews_set')
     tool = toolsDetailSerializer(source='id_tool', read_only=True)
     class Meta:
         model = ToolsGroups
         fields = ('tool',)
 
-class membersGroupsDetailSerializer(serializers.ModelSerializer):
+class membersGroupsDetailSerializer(EagerLoadingMixin, serializers.ModelSerializer):
+    select_related_fields = ('id_groupName__id_town',)
     group = groupsDetailSerializer(source='id_groupName', read_only=True)
     class Meta:
         model = GroupsMembers
         fields = ('group','groupAdmin')
 
-class toolsGroupsDetailSerializer(serializers.ModelSerializer):
+class toolsGroupsDetailSerializer(EagerLoadingMixin, serializers.ModelSerializer):
+    select_related_fields = ('id_groupName',)
     group = groupsSerializer(source='id_groupName', read_only=True)
     class Meta:
         model = ToolsGroups
@@ -0,0 +1,11 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .customJWTAuth import invalidate_principal
+from .models import Persons
+
+
+@receiver([post_save, post_delete], sender=Persons)
+def personChanged(sender, instance, **kwargs):
+    """" drop the cached JWT principal of a modified or deleted person """
+    invalidate_principal(instance.id_person)
@@ -0,0 +1,47 @@
+"""
+Streamed JSON lists, for exports and listings of whole tables: the rows are read
+through a server-side cursor (iterator()) a chunk at a time, and every chunk is
+serialized and sent before the next one is read, so the memory of the worker
+does not grow with the number of rows.
+"""
+from itertools import islice
+
+from django.conf import settings
+from django.db.models import prefetch_related_objects
+from django.http import StreamingHttpResponse
+
+
+def chunkSize():
+    return getattr(settings, 'STREAM_CHUNK_SIZE', 2000)
+
+
+def chunks(queryset, size):
+    """" lists of `size` rows of `queryset` read through a server-side cursor, its prefetches run per list """
+    rows = queryset.iterator(chunk_size=size)
+    lookups = queryset._prefetch_related_lookups # ignored by iterator()
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        if lookups:
+            prefetch_related_objects(chunk, *lookups)
+        yield chunk
+
+
+def jsonArray(queryset, represent, size, renderer):
+    """" the JSON array of represent(row) for every row of `queryset`, one chunk at a time """
+    assert renderer.format == 'json', 'only JSON lists can be streamed, not %s' % renderer.media_type
+    yield b'['
+    separator = b''
+    for chunk in chunks(queryset, size):
+        yield separator + b','.join(renderer.render(represent(row)) for row in chunk)
+        separator = b','
+    yield b']'
+
+
+def streamedListResponse(queryset, represent, renderer):
+    """
+    Response streaming the JSON array of represent(row) for every row of `queryset`, encoded
+    by `renderer` (a JSON one), STREAM_CHUNK_SIZE rows are read (and held in memory) at a time
+    """
+    return StreamingHttpResponse(jsonArray(queryset, represent, chunkSize(), renderer), content_type=renderer.media_type)
@@ -1,13 +1,37 @@
 from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import override_settings
+from decimal import Decimal
+from io import BytesIO, StringIO
+from PIL import Image
+from rest_framework.renderers import BrowsableAPIRenderer, JSONRenderer
 from rest_framework.test import APIClient, APITestCase
 from rest_framework import status
+from concurrent.futures.process import BrokenProcessPool
+import datetime
 import json
+import os
+import tempfile
+import threading
+from unittest import mock
 
+from .. import dbpool, metrics, passwords
+from ..api import searchViewSet
+from ..customJWTAuth import principal_cache_key
+from ..geo import geoCell, unitVector
+from ..media import MediaFilesMiddleware
+from ..renderers import ORJSONParser, ORJSONRenderer
 from ..models import *
+from ..serializers import groupsDetailSerializer, toolsBasicSerializer, toolsDetailSerializer, townsSerializer
+from ..streaming import streamedListResponse
 
 class SetupClass(APITestCase):
 
     def setUpTest(self):
+        cache.clear()
         self.username = 'admin'
         self.password = 'devweb2'
         self.user = User.objects.create_user(username=self.username, password=self.password)
@@ -123,6 +147,37 @@ class TestPersonsApi(SetupClass):
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
         self.assertEqual(json.loads(response.content).get("error"), "wrong sign-in information for: fakefoo.bar@gmail.com")
 
+    def test_personsViewSet_login_GET_fields(self):
+        response = self.not_auth_client.get("/api/persons/login/?email=foo.bar@gmail.com&pwd=testPwd1&fields=id_person,token", format='json')
+        self.assertEqual(set(json.loads(response.content)[0]), {"id_person", "token"})
+        token = json.loads(response.content)[0].get("token")
+
+        response = self.not_auth_client.get("/api/persons/login_token/?token=%s&fields=email"%token, format='json')
+        self.assertEqual(json.loads(response.content), [{"email": "foo.bar@gmail.com"}])
+        response = self.not_auth_client.get("/api/persons/login_token/?token=%s&fields=foo"%token, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_personsViewSet_login_GET_saturated(self):
+        #Every bcrypt slot is taken
+        with mock.patch.object(passwords, '_slots', threading.BoundedSemaphore(1)) as slots:
+            slots.acquire()
+            response = self.not_auth_client.get("/api/persons/login/?email=foo.bar@gmail.com&pwd=testPwd1", format='json')
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response['Retry-After'], "1")
+
+    def test_personsViewSet_login_GET_brokenPool(self):
+        class BrokenPool(object):
+            def submit(self, *args):
+                raise BrokenProcessPool()
+            def shutdown(self, wait):
+                pass
+        brokenPool = BrokenPool()
+        #A bcrypt process died: the pool is replaced and the call retried
+        with mock.patch.object(passwords, '_pool', brokenPool), mock.patch.object(passwords, '_poolPid', os.getpid()):
+            response = self.not_auth_client.get("/api/persons/login/?email=foo.bar@gmail.com&pwd=testPwd1", format='json')
+            self.assertIsNot(passwords._pool, brokenPool)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
     def test_personsViewSet_towns_GET(self):
         response = self.auth_client.get("/api/persons/1/towns/", format='json')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
@@ -165,6 +220,42 @@ class TestPersonsApi(SetupClass):
     
 
 
+class TestJWTAuth(SetupClass):
+
+    def setUp(self):
+        self.setUpTest()
+        response = self.not_auth_client.get("/api/persons/login/?email=foo.bar@gmail.com&pwd=testPwd1", format='json')
+        self.token = json.loads(response.content)[0].get("token")
+        self.jwt_client = APIClient()
+        self.jwt_client.credentials(HTTP_AUTHORIZATION='JWT ' + self.token)
+        self.url = "/api/persons/%s/towns/"%self.dummyPerson_object_id
+
+    def test_jwt_principal_cached(self):
+        #Person lookup + towns
+        with self.assertNumQueries(2):
+            response = self.jwt_client.get(self.url, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        #Towns only
+        with self.assertNumQueries(1):
+            response = self.jwt_client.get(self.url, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_jwt_principal_cached_without_password(self):
+        self.jwt_client.get(self.url, format='json')
+        principal = cache.get(principal_cache_key(self.dummyPerson_object_id))
+        self.assertEqual(principal, {'id_person': self.dummyPerson_object_id, 'email': "foo.bar@gmail.com"})
+
+    def test_jwt_principal_invalidated(self):
+        self.jwt_client.get(self.url, format='json')
+        self.dummyPerson_object.email = "new.foo.bar@gmail.com"
+        self.dummyPerson_object.save()
+
+        #The token was issued for the old email
+        response = self.jwt_client.get(self.url, format='json')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
 class TestToolsApi(SetupClass):
 
     def setUp(self):
@@ -175,6 +266,83 @@ class TestToolsApi(SetupClass):
         #print(response.content)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
     
+    def test_toolsViewSet_list_GET_values(self):
+        response = self.not_auth_client.get("/api/tools/", format='json')
+        self.assertEqual(json.loads(response.content), json.loads(json.dumps(toolsBasicSerializer(Tools.objects.all(), many=True).data)))
+
+    def test_toolsViewSet_list_GET_streamed(self):
+        for i in range(4):
+            Tools.objects.create(id_person=self.dummyPerson_object, toolName="tool%s"%i)
+        expected = json.loads(self.not_auth_client.get("/api/tools/", format='json').content)
+
+        with override_settings(STREAM_CHUNK_SIZE=2):
+            response = self.not_auth_client.get("/api/tools/?stream=1", format='json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertTrue(response.streaming)
+            self.assertEqual(json.loads(b''.join(response.streaming_content)), expected)
+
+            for off in ("0", "false", ""):
+                response = self.not_auth_client.get("/api/tools/?stream=%s"%off, format='json')
+                self.assertFalse(response.streaming)
+            #Only JSON is streamed
+            response = streamedListResponse(Tools.objects.all(), toolsBasicSerializer().to_representation, BrowsableAPIRenderer())
+            with self.assertRaises(AssertionError):
+                b''.join(response.streaming_content)
+
+    def test_streamedListResponse_prefetch(self):
+        for i in range(4):
+            tool = Tools.objects.create(id_person=self.dummyPerson_object, toolName="tool%s"%i)
+            ToolReviews.objects.create(id_tool=tool, stars=i)
+        queryset = toolsDetailSerializer.setup_eager_loading(Tools.objects.order_by('id_tool'))
+        expected = json.loads(json.dumps(toolsDetailSerializer(queryset, many=True).data))
+
+        with override_settings(STREAM_CHUNK_SIZE=2):
+            response = streamedListResponse(queryset, toolsDetailSerializer().to_representation, ORJSONRenderer())
+            # the tools + images and reviews prefetched for each of the 3 chunks
+            with self.assertNumQueries(1 + 3 * 2):
+                content = b''.join(response.streaming_content)
+        self.assertEqual(json.loads(content), expected)
+
+    def test_toolsViewSet_list_GET_paginated(self):
+        for i in range(4):
+            Tools.objects.create(id_person=self.dummyPerson_object, toolName="tool%s"%i)
+
+        response = self.auth_client.get("/api/tools/?page_size=3", format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        firstPage = json.loads(response.content)
+        self.assertEqual(len(firstPage.get("results")), 3)
+        self.assertIsNone(firstPage.get("previous"))
+
+        response = self.auth_client.get(firstPage.get("next"), format='json')
+        secondPage = json.loads(response.content)
+        self.assertEqual(len(secondPage.get("results")), 2)
+        self.assertIsNone(secondPage.get("next"))
+
+        ids = [t.get("id_tool") for t in firstPage.get("results") + secondPage.get("results")]
+        self.assertEqual(ids, sorted(Tools.objects.values_list('id_tool', flat=True)))
+
+    def test_toolsViewSet_detail_GET_sparse(self):
+        ToolReviews.objects.create(id_tool=self.dummyTool_object, stars=5)
+        response = self.not_auth_client.get("/api/tools/%s/"%self.dummyTool_object_id, format='json')
+        self.assertEqual(set(json.loads(response.content)[0]), {"toolOwner", "id_tool", "toolName", "toolDescription", "toolPrice", "toolImages", "reviews", "reviewsSummary"})
+
+        # the tool row only, without the owner join nor the images / reviews prefetches
+        with self.assertNumQueries(1):
+            response = self.not_auth_client.get("/api/tools/%s/?fields=id_tool,toolName,reviewsSummary.average"%self.dummyTool_object_id, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(json.loads(response.content), [{"id_tool": self.dummyTool_object_id, "toolName": "TESTTSTTS", "reviewsSummary": {"average": 5.0}}])
+
+        with self.assertNumQueries(2):
+            response = self.not_auth_client.get("/api/tools/%s/?expand=reviews"%self.dummyTool_object_id, format='json')
+        tool = json.loads(response.content)[0]
+        self.assertNotIn("toolOwner", tool)
+        self.assertNotIn("toolImages", tool)
+        self.assertEqual([r.get("stars") for r in tool.get("reviews")], [5])
+
+        response = self.not_auth_client.get("/api/tools/%s/?fields=id_tool,foo&expand=bar"%self.dummyTool_object_id, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(json.loads(response.content), {"fields": "unknown field(s): foo", "expand": "unknown field(s): bar"})
+
     def test_toolsViewSet_images_GET(self):
         response = self.auth_client.get("/api/tools/%s/images/"%self.dummyTool_object_id, format='json')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
@@ -183,7 +351,51 @@ class TestToolsApi(SetupClass):
         response = self.auth_client.get("/api/tools/%s/reviews/"%self.dummyTool_object_id, format='json')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
-    #//TODO post image
+    def test_toolsViewSet_images_POST(self):
+        upload = BytesIO()
+        Image.new('RGB', (1600, 1200), 'orange').save(upload, 'JPEG')
+        upload = SimpleUploadedFile("drill.jpg", upload.getvalue(), content_type="image/jpeg")
+
+        with tempfile.TemporaryDirectory() as mediaRoot, override_settings(MEDIA_ROOT=mediaRoot):
+            response = self.auth_client.post("/api/tools/%s/images/"%self.dummyTool_object_id, {"image": upload}, format='multipart')
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+            toolImage = ToolImages.objects.get(id_tool=self.dummyTool_object_id)
+            self.assertEqual(Image.open(toolImage.thumbnail.path).size, (200, 150))
+            self.assertEqual(Image.open(toolImage.medium.path).size, (800, 600))
+            self.assertEqual(Image.open(toolImage.webp.path).format, "WEBP")
+            self.assertTrue(json.loads(response.content).get("thumbnail").endswith(".jpg"))
+
+    def test_toolsViewSet_images_GET_media(self):
+        upload = BytesIO()
+        Image.new('RGB', (400, 300), 'orange').save(upload, 'JPEG')
+
+        with tempfile.TemporaryDirectory() as mediaRoot, override_settings(MEDIA_ROOT=mediaRoot):
+            client = APIClient()
+            client.login(username=self.username, password=self.password)
+            for i in range(2):
+                response = client.post("/api/tools/%s/images/"%self.dummyTool_object_id, {"image": SimpleUploadedFile("drill.jpg", upload.getvalue())}, format='multipart')
+                self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            #Named after their content, the same upload is stored once
+            names = set(ToolImages.objects.filter(id_tool=self.dummyTool_object_id).values_list("image", flat=True))
+            self.assertEqual(len(names), 1)
+            self.assertRegex(names.pop(), r'^toolsImgs/drill\.[0-9a-f]{12}\.jpg$')
+
+            url = json.loads(response.content).get("thumbnail")
+            with mock.patch.object(MediaFilesMiddleware, 'find_file', autospec=True, side_effect=MediaFilesMiddleware.find_file) as find_file:
+                for i in range(2):
+                    response = client.get(url[url.index("/media/"):])
+                    self.assertEqual(response.status_code, status.HTTP_200_OK)
+                    #Read to the end: an unread FileResponse closed later by the garbage collector would close the test's connection
+                    content = b"".join(response.streaming_content)
+            #Looked up on disk once, then served from memory
+            self.assertEqual(find_file.call_count, 1)
+            self.assertEqual(response["Cache-Control"], "max-age=315360000, public, immutable")
+            self.assertEqual(Image.open(BytesIO(content)).size, (200, 150))
+
+            response = client.get("/media/toolsImgs/missing.jpg")
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
 
     def test_reviewsViewSet_images_POST(self):
         data = {
@@ -194,6 +406,24 @@ class TestToolsApi(SetupClass):
         #print(response.content)
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
 
+    def test_reviewsViewSet_summary_GET(self):
+        for stars in (7, 9, 9):
+            self.auth_client.post("/api/tools/%s/reviews/"%self.dummyTool_object_id, {"stars": stars}, format='json')
+        ToolReviews.objects.filter(stars=7).update(stars=4)
+
+        response = self.auth_client.get("/api/tools/%s/reviews/?summary=true"%self.dummyTool_object_id, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        summary = json.loads(response.content)
+        self.assertEqual(summary.get("count"), 3)
+        self.assertAlmostEqual(summary.get("average"), 22 / 3)
+        self.assertEqual(summary.get("histogram"), [0, 0, 0, 0, 1, 0, 0, 0, 0, 2, 0])
+
+        #Saving the tool keeps the aggregates
+        self.dummyTool_object.toolPrice = "3.50"
+        self.dummyTool_object.save()
+        response = self.auth_client.get("/api/tools/%s/"%self.dummyTool_object_id, format='json')
+        self.assertEqual(json.loads(response.content)[0].get("reviewsSummary").get("count"), 3)
+
     def test_groupsViewSet_images_GET(self):
         response = self.auth_client.get("/api/tools/%s/groups/"%self.dummyTool_object_id, format='json')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
@@ -228,6 +458,20 @@ class TestGroupsApi(SetupClass):
         response = self.auth_client.get("/api/groups/public/?id_town=%s"%self.dummyTown_object_id, format='json')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
+    def test_groupsViewSet_public_GET_values(self):
+        Groups.objects.create(id_groupName="AGroup", groupType="public", groupRange=10, id_town=self.dummyTown_object)
+        # read from values() rows, same output as the serializer
+        queryset = Groups.objects.filter(groupType='public').order_by('id_groupName')
+        with self.assertNumQueries(1):
+            response = self.not_auth_client.get("/api/groups/public/", format='json')
+        self.assertEqual(json.loads(response.content), json.loads(json.dumps(groupsDetailSerializer(queryset, many=True).data)))
+
+        response = self.not_auth_client.get("/api/groups/public/?page_size=1", format='json')
+        firstPage = json.loads(response.content)
+        self.assertEqual([g.get("id_groupName") for g in firstPage.get("results")], ["AGroup"])
+        response = self.not_auth_client.get(firstPage.get("next"), format='json')
+        self.assertEqual([g.get("id_groupName") for g in json.loads(response.content).get("results")], ["TestGroup4"])
+
     def test_groupsViewSet_private_GET(self):
         response = self.auth_client.get("/api/groups/private/", format='json')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
@@ -239,9 +483,22 @@ class TestGroupsApi(SetupClass):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
     
     def test_groupsViewSet_members_GET(self):
+        GroupsMembers.objects.create(id_person=self.dummyPerson_object, id_groupName=self.dummyGroup_object, groupAdmin=True)
         response = self.auth_client.get("/api/groups/members/?groupName=%s"%self.dummyGroup_object_id, format='json')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
+        #The members' private columns (password hash, names, birth date) are not listed
+        member = json.loads(response.content)[0].get("member")
+        self.assertEqual(sorted(member), ["alias", "email", "id_person", "reviewsSummary"])
     
+    def test_groupsViewSet_members_GET_sparse(self):
+        GroupsMembers.objects.create(id_person=self.dummyPerson_object, id_groupName=self.dummyGroup_object, groupAdmin=True)
+        response = self.auth_client.get("/api/groups/members/?groupName=%s&fields=member.alias,groupAdmin"%self.dummyGroup_object_id, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(json.loads(response.content), [{"member": {"alias": "fobar"}, "groupAdmin": True}])
+
+        response = self.auth_client.get("/api/groups/members/?groupName=%s&expand="%self.dummyGroup_object_id, format='json')
+        self.assertEqual(json.loads(response.content), [{"groupAdmin": True}])
+
     def test_groupsViewSet_members_POST(self):
         data = {
             "id_person": self.dummyPerson_object_id,
@@ -253,6 +510,30 @@ class TestGroupsApi(SetupClass):
     
     #//TODO Delete member
 
+    def test_groupsViewSet_members_bulk_POST(self):
+        otherPerson = Persons.objects.create(lastName="baz", firstName="qux", alias="bazqux", birthDate="1000-12-01", email="baz.qux@gmail.com", password="x")
+        GroupsMembers.objects.create(id_person=otherPerson, id_groupName=self.dummyGroup_object, groupAdmin=False)
+        data = [
+            {"id_person": self.dummyPerson_object_id, "id_groupName": self.dummyGroup_object_id, "groupAdmin": True},
+            {"id_person": otherPerson.id_person, "id_groupName": self.dummyGroup_object_id, "groupAdmin": False},
+            {"id_person": 0, "id_groupName": self.dummyGroup_object_id, "groupAdmin": False},
+            {"id_person": "foo", "id_groupName": self.dummyGroup_object_id},
+        ]
+        #Session auth (2) + persons + groups + existing members + insert + savepoint (2)
+        with self.assertNumQueries(2 + 4 + 2):
+            response = self.auth_client.post("/api/groups/members/bulk/", data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual([r.get("status") for r in json.loads(response.content)], [201, 409, 404, 400])
+        self.assertEqual(GroupsMembers.objects.filter(id_groupName=self.dummyGroup_object_id).count(), 2)
+
+    def test_groupsViewSet_members_bulk_DELETE(self):
+        GroupsMembers.objects.create(id_person=self.dummyPerson_object, id_groupName=self.dummyGroup_object, groupAdmin=False)
+        data = {"id_person": [self.dummyPerson_object_id, 0]}
+        response = self.auth_client.delete("/api/groups/members/bulk/?groupName=%s"%self.dummyGroup_object_id, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual([r.get("status") for r in json.loads(response.content)], [204, 404])
+        self.assertFalse(GroupsMembers.objects.filter(id_groupName=self.dummyGroup_object_id).exists())
+
     def test_groupsViewSet_admins_GET(self):
         response = self.auth_client.get("/api/groups/admins/?groupName=%s"%self.dummyGroup_object_id, format='json')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
@@ -269,8 +550,31 @@ class TestGroupsApi(SetupClass):
         response = self.auth_client.post("/api/groups/tools/?groupName=%s"%self.dummyGroup_object_id, data, format='json')
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
     
+    def test_groupsViewSet_tools_GET_numQueries(self):
+        for i in range(5):
+            tool = Tools.objects.create(id_person=self.dummyPerson_object, toolName="tool%s"%i)
+            ToolReviews.objects.create(id_tool=tool, stars=5)
+            ToolsGroups.objects.create(id_tool=tool, id_groupName=self.dummyGroup_object)
+        # 1 query for the tools + 1 per prefetched relation (images, reviews)
+        with self.assertNumQueries(3):
+            response = self.not_auth_client.get("/api/groups/tools/?groupName=%s"%self.dummyGroup_object_id, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(json.loads(response.content)), 5)
+
     #//TODO Delete tool
 
+    def test_groupsViewSet_tools_bulk(self):
+        tools = [Tools.objects.create(id_person=self.dummyPerson_object, toolName="tool%s"%i) for i in range(5)]
+        data = [{"id_tool": tool.id_tool, "id_groupName": self.dummyGroup_object_id} for tool in tools]
+        response = self.not_auth_client.post("/api/groups/tools/bulk/", data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(ToolsGroups.objects.filter(id_groupName=self.dummyGroup_object_id).count(), 5)
+
+        data = {"id_tool": [tool.id_tool for tool in tools]}
+        response = self.not_auth_client.delete("/api/groups/tools/bulk/?groupName=%s"%self.dummyGroup_object_id, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(ToolsGroups.objects.filter(id_groupName=self.dummyGroup_object_id).exists())
+
 
 class TestTownsApi(SetupClass):
 
@@ -287,18 +591,284 @@ class TestTownsApi(SetupClass):
         self.assertEqual(json.loads(response.content)[0].get("townName"), self.dummyTown_dict.get("townName"))
         self.assertEqual(json.loads(response.content)[0].get("id_countryCode"), self.dummyTown_dict.get("id_countryCode").id_countryCode)
 
+    def test_townsViewSet_list_GET_values(self):
+        response = self.not_auth_client.get("/api/towns/", format='json')
+        self.assertEqual(json.loads(response.content), json.loads(json.dumps(townsSerializer(Towns.objects.all(), many=True).data)))
 
     def test_townsViewSet_POST(self):
         data = {
-            "postCode": 1300,
-            "townName": "Wavre",
-            "lat": 50.123456,
-            "lng": 4.123456,
+            "postCode": 5000,
+            "townName": "Namur",
+            "lat": 50.4669,
+            "lng": 4.8675,
             "id_countryCode": "BE"
         }
         response = self.auth_client.post("/api/towns/", data, format='json')
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
 
+        #(postCode, townName, id_countryCode) is unique
+        response = self.auth_client.post("/api/towns/", data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_import_towns(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as file:
+            self.addCleanup(os.remove, file.name)
+            file.write("postCode,townName,lat,lng,id_countryCode,countryName\n")
+            file.write("1300,Wavre,50.7167,4.6,BE,\n")          # existing town, moved
+            file.write("5000,Namur,50.4669,4.8675,BE,\n")
+            file.write("5000,Namur,50.4669,4.8675,BE,\n")       # duplicate line
+            file.write("1011 AB,Amsterdam,52.37,4.89,NL,\n")    # alphanumeric post code
+            file.write("75001,Paris,48.86,2.34,FR,France\n")
+        out = StringIO()
+        with mock.patch('toolbox_app.management.commands.import_towns.invalidateResponses') as invalidateResponses:
+            call_command('import_towns', file.name, batch_size=2, stdout=out)
+        self.assertEqual(sorted(call[0][0] for call in invalidateResponses.call_args_list), ['countries', 'groups', 'towns'])
+        self.assertIn("2 town(s) inserted, 1 updated", out.getvalue())
+        self.assertIn("1 invalid row(s) skipped", out.getvalue())
+
+        self.assertEqual(Countries.objects.get(pk="FR").countryName, "France")
+        wavre = Towns.objects.get(postCode=1300, townName="Wavre")
+        self.assertEqual((wavre.lat, wavre.geoCell), (50.7167, geoCell(50.7167, 4.6)))
+
+        #Importing again changes nothing
+        out = StringIO()
+        call_command('import_towns', file.name, stdout=out)
+        self.assertIn("0 town(s) inserted, 0 updated", out.getvalue())
+        self.assertEqual(Towns.objects.count(), 3)
+
+
+@override_settings(METRICS_TOKEN="secret")
+class TestMetrics(SetupClass):
+
+    def setUp(self):
+        self.setUpTest()
+
+    def metric(self, name, view, method="GET"):
+        response = self.not_auth_client.get("/metrics/", HTTP_AUTHORIZATION="Bearer secret")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        prefix = 'toolbox_%s{view="%s",method="%s"} '%(name, view, method)
+        values = [float(line[len(prefix):]) for line in response.content.decode().splitlines() if line.startswith(prefix)]
+        return values[0] if values else 0
+
+    def test_metrics_GET(self):
+        requests, queries = self.metric("requests_total", "groups-tools"), self.metric("request_queries_total", "groups-tools")
+        for i in range(3):
+            ToolsGroups.objects.create(id_tool=Tools.objects.create(id_person=self.dummyPerson_object, toolName="tool%s"%i), id_groupName=self.dummyGroup_object)
+        self.not_auth_client.get("/api/groups/tools/?groupName=%s"%self.dummyGroup_object_id, format='json')
+
+        self.assertEqual(self.metric("requests_total", "groups-tools"), requests + 1)
+        self.assertEqual(self.metric("request_queries_total", "groups-tools"), queries + 3)
+
+    @override_settings(METRICS_SERVER_TIMING=True)
+    def test_metrics_serverTiming(self):
+        response = self.not_auth_client.get("/api/tools/%s/"%self.dummyTool_object_id, format='json')
+        self.assertRegex(response["Server-Timing"], r'^db;dur=[0-9.]+;desc="\d+ queries, \d+ duplicate", serializer;dur=[0-9.]+, dbconnect;dur=[0-9.]+;desc="\d+ opened", total;dur=[0-9.]+$')
+
+    def test_metrics_GET_token(self):
+        response = self.not_auth_client.get("/metrics/")
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        response = self.not_auth_client.get("/metrics/", HTTP_AUTHORIZATION="Bearer wrong")
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        response = self.not_auth_client.get("/metrics/", HTTP_AUTHORIZATION="Bearer secret")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    @override_settings(METRICS_TOKEN=None)
+    def test_metrics_GET_noToken(self):
+        #Denied without a token, unless in DEBUG
+        response = self.not_auth_client.get("/metrics/")
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        with override_settings(DEBUG=True):
+            response = self.not_auth_client.get("/metrics/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_metrics_GET_expiredPids(self):
+        #A process whose snapshot expired is forgotten
+        cache.set(metrics.PIDS_KEY, (cache.get(metrics.PIDS_KEY) or set()) | {-1}, None)
+        self.metric("requests_total", "groups-tools")
+        self.assertNotIn(-1, cache.get(metrics.PIDS_KEY))
+        self.assertIn(os.getpid(), cache.get(metrics.PIDS_KEY))
+
+    def test_metrics_streamed(self):
+        for i in range(4):
+            Tools.objects.create(id_person=self.dummyPerson_object, toolName="tool%s"%i)
+        requests, queries, size = (self.metric(name, "tools-list") for name in ("requests_total", "request_queries_total", "response_bytes_total"))
+
+        with override_settings(STREAM_CHUNK_SIZE=2):
+            response = self.not_auth_client.get("/api/tools/?stream=1", format='json')
+            #Recorded once the rows are sent, with the queries run while streaming
+            self.assertEqual(self.metric("requests_total", "tools-list"), requests)
+            content = b''.join(response.streaming_content)
+        self.assertEqual(self.metric("requests_total", "tools-list"), requests + 1)
+        self.assertGreater(self.metric("request_queries_total", "tools-list"), queries)
+        self.assertEqual(self.metric("response_bytes_total", "tools-list"), size + len(content))
+
+    def test_metrics_serializerTime(self):
+        seconds = self.metric("request_serializer_seconds_total", "tools-detail")
+        self.not_auth_client.get("/api/tools/%s/"%self.dummyTool_object_id, format='json')
+        self.assertGreater(self.metric("request_serializer_seconds_total", "tools-detail"), seconds)
+
+
+class TestConnectionPool(SetupClass):
+
+    def setUp(self):
+        self.setUpTest()
+        self.pools = []
+
+    def pool(self, **options):
+        params = connection.get_connection_params()
+        settings = dict(dbpool.DEFAULTS, **options)
+        pool = dbpool.ConnectionPool(lambda: connection.Database.connect(**params), settings['MAX_SIZE'],
+            settings['WAIT_TIMEOUT'], settings['IDLE_TIMEOUT'], settings['HEALTH_CHECK_INTERVAL'])
+        self.pools.append(pool)
+        return pool
+
+    def tearDown(self):
+        for pool in self.pools:
+            pool.closeAll()
+
+    def test_pool_reuse(self):
+        pool = self.pool()
+        first, waited, opened = pool.acquire()
+        self.assertTrue(opened)
+        pool.release(first)
+        second, waited, opened = pool.acquire()
+        self.assertIs(second, first)
+        self.assertFalse(opened)
+        pool.release(second)
+
+    def test_pool_reset(self):
+        pool = self.pool()
+        first = pool.acquire()[0]
+        first.autocommit = True
+        with first.cursor() as cursor:
+            cursor.execute("SET statement_timeout = 1234")
+            cursor.execute("CREATE TEMPORARY TABLE leftover (id int)")
+        pool.release(first)
+
+        second = pool.acquire()[0]
+        self.assertIs(second, first)
+        with second.cursor() as cursor:
+            cursor.execute("SHOW statement_timeout")
+            self.assertNotEqual(cursor.fetchone()[0], '1234ms')
+            cursor.execute("SELECT to_regclass('pg_temp.leftover')")
+            self.assertIsNone(cursor.fetchone()[0])
+        pool.release(second)
+
+    def test_pool_maxSize(self):
+        pool = self.pool(MAX_SIZE=1, WAIT_TIMEOUT=0.2)
+        first = pool.acquire()[0]
+        with self.assertRaises(dbpool.PoolTimeout):
+            pool.acquire()
+
+        threading.Timer(0.05, pool.release, [first]).start()
+        second, waited, opened = pool.acquire()
+        self.assertIs(second, first)
+        self.assertGreater(waited, 0.04)
+        pool.release(second)
+
+    def test_pool_healthCheck(self):
+        pool = self.pool(HEALTH_CHECK_INTERVAL=0)
+        first = pool.acquire()[0]
+        pid = first.get_backend_pid()
+        pool.release(first)
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_terminate_backend(%s)", [pid])
+
+        second, waited, opened = pool.acquire()
+        self.assertTrue(opened)
+        self.assertNotEqual(second.get_backend_pid(), pid)
+        self.assertEqual(pool.size, 1)
+        pool.release(second)
+
+    def test_pool_idleTimeout(self):
+        pool = self.pool(IDLE_TIMEOUT=0)
+        first = pool.acquire()[0]
+        pool.release(first)
+        second, waited, opened = pool.acquire()
+        self.assertTrue(opened)
+        self.assertTrue(first.closed)
+        pool.release(second)
+
+    def test_pool_forked(self):
+        inherited = self.pool()
+        with mock.patch.object(dbpool, '_pools', {'key': inherited}), mock.patch.object(dbpool, '_orphaned', []), \
+             mock.patch.object(dbpool, '_poolsPid', -1):
+            pool = dbpool.poolFor('key', {}, inherited.connect)
+            self.pools.append(pool)
+            self.assertIsNot(pool, inherited)
+            #The pools of the parent process are kept alive, not closed
+            self.assertEqual(dbpool._orphaned, [inherited])
+
+    @override_settings(METRICS_TOKEN="secret")
+    def test_pool_metrics(self):
+        self.not_auth_client.get("/api/tools/", format='json')
+        response = self.not_auth_client.get("/metrics/", HTTP_AUTHORIZATION="Bearer secret")
+        self.assertIn('toolbox_request_db_connection_wait_seconds_total{view="tools-list",method="GET"}', response.content.decode())
+
+
+class TestBenchmark(SetupClass):
+
+    def setUp(self):
+        self.setUpTest()
+
+    def test_generate_data_and_benchmark(self):
+        with tempfile.TemporaryDirectory() as mediaRoot, override_settings(MEDIA_ROOT=mediaRoot), tempfile.TemporaryDirectory() as directory:
+            call_command('generate_data', scale=0.05, stdout=StringIO())
+            self.assertEqual(Tools.objects.filter(toolimages__isnull=False).distinct().count(), Tools.objects.count() - 1)
+            self.assertTrue(Persons.objects.filter(email="bench0@example.com").exists())
+
+            output = os.path.join(directory, 'benchmark.json')
+            call_command('benchmark', requests=3, warmup=0, output=output, stdout=StringIO())
+            with open(output) as file:
+                report = json.load(file)
+        self.assertEqual(set(report["endpoints"]["tools.list"]), {"requests", "p50_ms", "p95_ms", "p99_ms", "mean_ms", "max_ms", "queries_mean", "queries_max", "throughput_rps", "errors"})
+        for name, summary in report["endpoints"].items():
+            self.assertEqual((name, summary["requests"], summary["errors"]), (name, 3, 0))
+
+
+class TestRenderers(SetupClass):
+
+    def setUp(self):
+        self.setUpTest()
+
+    def test_orjsonRenderer_JSONRenderer_output(self):
+        data = {
+            "price": Decimal("18.32"),
+            "birthDate": datetime.date(1000, 12, 1),
+            "created": datetime.datetime(2020, 4, 1, 12, 30, 15, 123456, tzinfo=datetime.timezone.utc),
+            "image": ToolImages(id_tool=self.dummyTool_object, image="toolsImgs/tool.jpg").image,
+            "noImage": ToolImages(id_tool=self.dummyTool_object).image,
+            "text": "line\u2028separator",
+            1: [1.5, None, True],
+        }
+        self.assertEqual(ORJSONRenderer().render(data), JSONRenderer().render(dict(data, image="/media/toolsImgs/tool.jpg", noImage=None)))
+        self.assertEqual(ORJSONParser().parse(BytesIO(ORJSONRenderer().render(data))).get("price"), 18.32)
+
+    def test_orjsonRenderer_differences(self):
+        #Documented in renderers.py
+        self.assertEqual(ORJSONRenderer().render({"km": float("nan")}), b'{"km":null}')
+        with self.assertRaises(ValueError):
+            JSONRenderer().render({"km": float("nan")})
+        self.assertEqual(ORJSONRenderer().render([1], "application/json; indent=4"), b'[\n  1\n]')
+
+    def test_orjsonRenderer_api(self):
+        response = self.auth_client.get("/api/persons/%s/"%self.dummyPerson_object_id, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.content, JSONRenderer().render(response.data))
+        self.assertEqual(json.loads(response.content)[0].get("birthDate"), "1000-12-01")
+
+        response = self.auth_client.post("/api/towns/", b'{"postCode": 5000', content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_benchmark_json(self):
+        ToolsGroups.objects.create(id_tool=self.dummyTool_object, id_groupName=self.dummyGroup_object)
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'benchmark_json.json')
+            call_command('benchmark_json', rows=10, repeat=2, output=output, stdout=StringIO())
+            with open(output) as file:
+                report = json.load(file)
+        self.assertEqual(set(report["payloads"]["tools.retrieve"]["render_ms"]), {"JSONRenderer", "ORJSONRenderer"})
+
 
 class TestCountriesApi(SetupClass):
 
@@ -311,10 +881,154 @@ class TestCountriesApi(SetupClass):
         self.assertEqual(json.loads(response.content)[0].get("id_countryCode"), self.dummyCountry_dict.get("id_countryCode"))
         self.assertEqual(json.loads(response.content)[0].get("countryName"), self.dummyCountry_dict.get("countryName"))
 
+    def test_countriesViewSet_list_GET_cached(self):
+        response = self.not_auth_client.get("/api/countries/", format='json')
+        etag = response['ETag']
+
+        #Served from the cache
+        with self.assertNumQueries(0):
+            response = self.not_auth_client.get("/api/countries/", format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(json.loads(response.content)), 1)
+
+        response = self.not_auth_client.get("/api/countries/", HTTP_IF_NONE_MATCH=etag, format='json')
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        #Invalidated by create
+        self.auth_client.post("/api/countries/", {"id_countryCode": "DE", "countryName": "Germany"}, format='json')
+        response = self.not_auth_client.get("/api/countries/", HTTP_IF_NONE_MATCH=etag, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(json.loads(response.content)), 2)
+
     def test_countriesViewSet_POST(self):
         data = {
             "id_countryCode": "DE",
             "countryName": "Germany"
         }
         response = self.auth_client.post("/api/countries/", data, format='json')
-        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
\ No newline at end of file
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+class TestSearchApi(SetupClass):
+
+    def setUp(self):
+        self.setUpTest()
+        ToolsGroups.objects.create(id_tool=self.dummyTool_object, id_groupName=self.dummyGroup_object)
+
+        ## town ~30km away from the dummy town
+        self.nearTown_object = Towns.objects.create(postCode=5000, townName="Namur", lat=50.35, lng=4.45, id_countryCode=self.dummyCountry_object)
+        ## town ~250km away from the dummy town
+        self.farTown_object = Towns.objects.create(postCode=1000, townName="Bastogne", lat=50.0, lng=7.6, id_countryCode=self.dummyCountry_object)
+
+    def test_searchViewSet_list_GET(self):
+        #Town (with the largest public range) + search entries + groups
+        with self.assertNumQueries(3):
+            response = self.not_auth_client.get("/api/search/?what='tstts'&where='namur'", format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        resp = json.loads(response.content)
+        self.assertEqual([g.get("id_groupName") for g in resp], [self.dummyGroup_object_id])
+
+    def test_searchViewSet_list_GET_entriesRefreshed(self):
+        #Search entries follow the tools, groups and links they are derived from
+        self.assertEqual(SearchEntries.objects.filter(id_groupName=self.dummyGroup_object_id).count(), 1)
+
+        Tools.objects.filter(pk=self.dummyTool_object.pk).update(toolName="Marteau")
+        self.assertEqual(SearchEntries.objects.get(id_groupName=self.dummyGroup_object_id).toolName, "marteau")
+
+        Groups.objects.filter(pk=self.dummyGroup_object_id).update(groupType="private")
+        self.assertFalse(SearchEntries.objects.filter(id_groupName=self.dummyGroup_object_id).exists())
+
+        Groups.objects.filter(pk=self.dummyGroup_object_id).update(groupType="public")
+        self.assertTrue(SearchEntries.objects.filter(id_groupName=self.dummyGroup_object_id).exists())
+
+        ToolsGroups.objects.filter(id_groupName=self.dummyGroup_object_id).delete()
+        self.assertFalse(SearchEntries.objects.filter(id_groupName=self.dummyGroup_object_id).exists())
+
+    def test_searchViewSet_list_GET_fullText(self):
+        #Matches the description and misspelled names
+        for what in ("'super'", "'TESTSTTS'"):
+            response = self.not_auth_client.get("/api/search/?what=%s&where='Namur'"%what, format='json')
+            self.assertEqual([g.get("id_groupName") for g in json.loads(response.content)], [self.dummyGroup_object_id])
+
+    def test_searchViewSet_list_GET_shortTerm(self):
+        response = self.not_auth_client.get("/api/search/?what='ts'&where='Namur'", format='json')
+        self.assertEqual([g.get("id_groupName") for g in json.loads(response.content)], [self.dummyGroup_object_id])
+
+        response = self.not_auth_client.get("/api/search/?what='zz'&where='Namur'", format='json')
+        self.assertEqual(json.loads(response.content), [])
+
+    def test_searchViewSet_list_GET_relevance(self):
+        otherTool = Tools.objects.create(id_person=self.dummyPerson_object, toolName="Scie sauteuse", toolDescription="Coupe TESTTSTTS")
+        otherGroup = Groups.objects.create(id_groupName="TestGroup5", groupType="public", groupRange=50, id_town=self.dummyTown_object)
+        ToolsGroups.objects.create(id_tool=otherTool, id_groupName=otherGroup)
+
+        #Name matches rank above description matches
+        response = self.not_auth_client.get("/api/search/?what='TESTTSTTS'&where='Namur'", format='json')
+        self.assertEqual([g.get("id_groupName") for g in json.loads(response.content)], [self.dummyGroup_object_id, "TestGroup5"])
+
+    def test_searchViewSet_toolsMatching_index(self):
+        #The substring match is a LIKE on the lower cased name, which the trigram index serves
+        match, relevance = searchViewSet().toolsMatching("Pe")
+        with connection.cursor() as cursor:
+            cursor.execute("SET LOCAL enable_seqscan = off")
+        self.assertIn("search_entries_name_trgm_idx", SearchEntries.objects.filter(match).explain())
+        self.assertNotIn("UPPER", str(SearchEntries.objects.filter(match).query))
+
+    def test_towns_geo_trigger(self):
+        #Computed by the database, as geo.py does, on insert and on update
+        Towns.objects.bulk_create([Towns(postCode=3, townName="Pole", lat=90, lng=-180, id_countryCode=self.dummyCountry_object)])
+        Towns.objects.filter(pk=self.farTown_object.pk).update(lat=-33.9, lng=18.4)
+        for town in Towns.objects.all():
+            self.assertEqual(town.geoCell, geoCell(town.lat, town.lng))
+            for value, expected in zip((town.unitX, town.unitY, town.unitZ), unitVector(town.lat, town.lng)):
+                self.assertAlmostEqual(value, expected)
+
+    def test_searchViewSet_list_GET_townMoved(self):
+        #Moved by an update of lat / lng only, as import_towns does: the search entries follow
+        Towns.objects.filter(pk=self.dummyTown_object.pk).update(lat=-33.9, lng=18.4)
+        entry = SearchEntries.objects.get(id_groupName=self.dummyGroup_object_id, id_tool=self.dummyTool_object_id)
+        self.assertEqual(entry.geoCell, geoCell(-33.9, 18.4))
+
+        response = self.not_auth_client.get("/api/search/?what='tstts'&where='Namur'", format='json')
+        self.assertEqual(json.loads(response.content), [])
+
+    def test_searchViewSet_list_GET_westernHemisphere(self):
+        #Both sides of the antimeridian / greenwich meridian
+        town = Towns.objects.create(postCode=1, townName="Taveuni", lat=-16.85, lng=179.95, id_countryCode=self.dummyCountry_object)
+        Towns.objects.create(postCode=2, townName="Rabi", lat=-16.5, lng=-179.98, id_countryCode=self.dummyCountry_object)
+        Groups.objects.filter(pk=self.dummyGroup_object_id).update(id_town=town)
+
+        response = self.not_auth_client.get("/api/search/?what='tstts'&where='Rabi'", format='json')
+        self.assertEqual([g.get("id_groupName") for g in json.loads(response.content)], [self.dummyGroup_object_id])
+
+    def test_searchViewSet_list_GET_nearest(self):
+        #Groups ~30km (dummy), ~0km (Namur) and ~10km (Wepion) away from Namur
+        for name, town in (("TestGroupNamur", self.nearTown_object), ("TestGroupWepion", Towns.objects.create(postCode=5100, townName="Wepion", lat=50.42, lng=4.55, id_countryCode=self.dummyCountry_object))):
+            Groups.objects.create(id_groupName=name, groupType="public", groupRange=50, id_town=town)
+            ToolsGroups.objects.create(id_tool=self.dummyTool_object, id_groupName_id=name)
+
+        response = self.not_auth_client.get("/api/search/?what='tstts'&where='Namur'", format='json')
+        resp = json.loads(response.content)
+        self.assertEqual([g.get("id_groupName") for g in resp], ["TestGroupNamur", "TestGroupWepion", self.dummyGroup_object_id])
+        self.assertAlmostEqual(resp[0].get("distance"), 0)
+        self.assertTrue(5 < resp[1].get("distance") < 15)
+
+        response = self.not_auth_client.get("/api/search/?what='tstts'&where='Namur'&limit=1", format='json')
+        self.assertEqual([g.get("id_groupName") for g in json.loads(response.content)], ["TestGroupNamur"])
+
+        response = self.not_auth_client.get("/api/search/?what='tstts'&where='Namur'&max_km=20", format='json')
+        self.assertEqual([g.get("id_groupName") for g in json.loads(response.content)], ["TestGroupNamur", "TestGroupWepion"])
+
+        response = self.not_auth_client.get("/api/search/?what='tstts'&where='Namur'&limit=zero", format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_searchViewSet_list_GET_outOfRange(self):
+        response = self.not_auth_client.get("/api/search/?what='tstts'&where='Bastogne'", format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(json.loads(response.content), [])
+
+    def test_searchViewSet_list_GET_unknownToolOrTown(self):
+        response = self.not_auth_client.get("/api/search/?what='drill'&where='Namur'", format='json')
+        self.assertEqual(json.loads(response.content), [])
+
+        response = self.not_auth_client.get("/api/search/?what='tstts'&where='Nowhere'", format='json')
+        self.assertEqual(json.loads(response.content), [])
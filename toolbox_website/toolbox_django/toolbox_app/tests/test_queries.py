@@ -0,0 +1,143 @@
+"""
+Query count regression tests: every endpoint is requested at several data scales,
+its number of queries must not grow with the number of rows and must stay within
+the budget stored in query_budgets.json (along with the shape of the queries, to
+review in diffs). After an intended change, record the new budgets with:
+
+    UPDATE_QUERY_BUDGETS=1 pytest toolbox_app/tests/test_queries.py
+
+which still fails (and writes nothing) when a count grows with the rows.
+"""
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient, APITestCase
+from rest_framework import status
+import json
+import os
+import re
+
+from ..models import *
+
+SCALES = (10, 100, 1000)
+BUDGETS_PATH = os.path.join(os.path.dirname(__file__), 'query_budgets.json')
+UPDATE_BUDGETS = os.environ.get('UPDATE_QUERY_BUDGETS') == '1'
+
+# {person}, {tool}, {group} and {town} are the rows every scale adds related rows to
+ENDPOINTS = (
+    ('persons.retrieve', '/api/persons/{person}/'),
+    ('persons.towns', '/api/persons/{person}/towns/'),
+    ('persons.tools', '/api/persons/{person}/tools/'),
+    ('persons.reviews', '/api/persons/{person}/reviews/'),
+    ('persons.reviews.summary', '/api/persons/{person}/reviews/?summary=1'),
+    ('persons.groups', '/api/persons/{person}/groups/'),
+    ('tools.list', '/api/tools/'),
+    ('tools.list.page', '/api/tools/?page_size=50'),
+    ('tools.retrieve', '/api/tools/{tool}/'),
+    ('tools.images', '/api/tools/{tool}/images/'),
+    ('tools.reviews', '/api/tools/{tool}/reviews/'),
+    ('tools.groups', '/api/tools/{tool}/groups/'),
+    ('groups.list', '/api/groups/'),
+    ('groups.public', '/api/groups/public/'),
+    ('groups.public.country', '/api/groups/public/?countryCode=BE'),
+    ('groups.private', '/api/groups/private/'),
+    ('groups.members', '/api/groups/members/?groupName={group}'),
+    ('groups.admins', '/api/groups/admins/?groupName={group}'),
+    ('groups.tools', '/api/groups/tools/?groupName={group}'),
+    ('towns.list', '/api/towns/'),
+    ('countries.list', '/api/countries/'),
+    ('search', "/api/search/?what='perceuse'&where='{town}'"),
+)
+
+
+def queryShape(sql):
+    """" `sql` without its literal values """
+    sql = re.sub(r"'(?:[^']|'')*'", '?', sql)
+    sql = re.sub(r'\b\d+(\.\d+)?(e-?\d+)?\b', '?', sql)
+    sql = re.sub(r'\((\?, )+\?\)', '(?...)', sql)
+    return sql
+
+
+class TestQueryBudgets(APITestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user(username='admin', password='devweb2'))
+        self.country = Countries.objects.create(id_countryCode="BE", countryName="Belgium")
+        self.town = Towns.objects.create(postCode=1300, townName="Wavre", lat=50.7167, lng=4.6, id_countryCode=self.country)
+        self.person = self.createPersons(1)[0]
+        self.tool = Tools.objects.create(id_person=self.person, toolName="Perceuse", toolDescription="Perce super bien!")
+        self.group = Groups.objects.create(id_groupName="TestGroup", groupType="public", groupRange=50, id_town=self.town)
+        ToolsGroups.objects.create(id_tool=self.tool, id_groupName=self.group)
+        self.rows = 0
+
+    def createPersons(self, count):
+        start = Persons.objects.count()
+        return Persons.objects.bulk_create([
+            Persons(lastName="foo%s"%i, firstName="bar", alias="fobar%s"%i, birthDate="1000-12-01", email="foo%s@bar.com"%i, password="x")
+            for i in range(start, start + count)
+        ])
+
+    def grow(self, rows):
+        """" adds rows related to the person / tool / group / town of setUp, up to `rows` of each kind """
+        count, start = rows - self.rows, self.rows
+        self.rows = rows
+
+        persons = self.createPersons(count)
+        towns = Towns.objects.bulk_create([
+            Towns(postCode=2000 + i, townName="Town%s"%i, lat=50.7, lng=4.6, id_countryCode=self.country) for i in range(start, rows)
+        ])
+        groups = Groups.objects.bulk_create([
+            Groups(id_groupName="Group%s"%i, groupType="public" if i % 2 else "private", groupRange=50, id_town=self.town) for i in range(start, rows)
+        ])
+        tools = Tools.objects.bulk_create([
+            Tools(id_person=self.person, toolName="Perceuse %s"%i, toolDescription="Perce") for i in range(start, rows)
+        ])
+        PersonsTowns.objects.bulk_create([PersonsTowns(id_person=self.person, id_town=town) for town in towns])
+        PersonReviews.objects.bulk_create([PersonReviews(id_person=self.person, stars=i % 11) for i in range(count)])
+        GroupsMembers.objects.bulk_create([GroupsMembers(id_person=self.person, id_groupName=group, groupAdmin=False) for group in groups])
+        GroupsMembers.objects.bulk_create([GroupsMembers(id_person=person, id_groupName=self.group, groupAdmin=i % 2 == 0) for i, person in enumerate(persons)])
+        ToolImages.objects.bulk_create([ToolImages(id_tool=self.tool, image="toolsImgs/tool%s.jpg"%i) for i in range(start, rows)])
+        ToolReviews.objects.bulk_create([ToolReviews(id_tool=self.tool, stars=i % 11) for i in range(count)])
+        ToolsGroups.objects.bulk_create([ToolsGroups(id_tool=self.tool, id_groupName=group) for group in groups])
+        ToolsGroups.objects.bulk_create([ToolsGroups(id_tool=tool, id_groupName=self.group) for tool in tools])
+
+    def measure(self, url):
+        url = url.format(person=self.person.id_person, tool=self.tool.id_tool, group=self.group.id_groupName, town=self.town.townName)
+        cache.clear() # cached responses would hide the queries
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK, url)
+        return [queryShape(query['sql']) for query in queries.captured_queries]
+
+    def test_query_budgets(self):
+        measures = {name: [] for name, url in ENDPOINTS}
+        for rows in SCALES:
+            self.grow(rows)
+            for name, url in ENDPOINTS:
+                measures[name].append(self.measure(url))
+
+        with open(BUDGETS_PATH) as file:
+            budgets = json.load(file)
+        growths = []
+        problems = []
+        for name, shapes in measures.items():
+            counts = [len(shape) for shape in shapes]
+            if len(set(counts)) > 1:
+                growths.append("%s: %s queries at %s rows, the count grows with the rows" % (
+                    name, counts, "/".join(str(rows) for rows in SCALES)))
+            elif name not in budgets:
+                problems.append("%s: no stored budget" % name)
+            elif counts[-1] > budgets[name]["queries"]:
+                problems.append("%s: %s queries, over its budget of %s" % (name, counts[-1], budgets[name]["queries"]))
+
+        # an N+1 is never stored as a budget
+        self.assertEqual(growths, [], "\n" + "\n".join(growths))
+        if UPDATE_BUDGETS:
+            with open(BUDGETS_PATH, 'w') as file:
+                json.dump({name: {"queries": len(shapes[-1]), "shape": shapes[-1]}
+                           for name, shapes in sorted(measures.items())}, file, indent=2)
+                file.write('\n')
+        else:
+            self.assertEqual(problems, [], "\n" + "\n".join(problems))
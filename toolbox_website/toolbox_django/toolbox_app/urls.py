@@ -2,6 +2,7 @@ from django.urls import include, path
 from rest_framework import routers
 from . import views
 from . import api
+from . import metrics
 
 router = routers.DefaultRouter()
 router.register(r'persons', api.personsViewSet, basename='persons')
@@ -14,6 +15,7 @@ router.register(r'search', api.searchViewSet, basename='search')
 
 urlpatterns = [
     path(r'dev/',views.index,name='index'),
+    path(r'metrics/',metrics.metricsView,name='metrics'),
     path(r'api/', include(router.urls)),
     path(r'api-auth/', include('rest_framework.urls', namespace='rest_framework'))
 ]
\ No newline at end of file